@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+
+
+class TableCache(object):
+    """Process-local copy of a small, rarely changing table.
+
+    Declared on a model as ``cached = TableCache()``, it loads every row once
+    per database alias and serves lookups by id or name from dicts.  Every
+    ``REDMINE_REFERENCE_CACHE_CHECK`` seconds (default 60) a single aggregate
+    query (row count, ``MAX(id)`` and ``MAX(updated_on)`` when the table has
+    it) detects inserts, deletes and touched rows; after
+    ``REDMINE_REFERENCE_CACHE_TTL`` seconds (default 3600) the table is
+    reloaded regardless.  When ``REDMINE_REFERENCE_CACHE`` names one of
+    Django's caches, loaded rows are shared with other processes through it.
+
+    Rows edited in place leave that aggregate unchanged on tables without
+    ``updated_on`` (trackers, roles, enumerations, custom fields...).  Saves
+    and deletes through Django call :meth:`invalidate`; other processes and
+    edits made by Redmine itself only show up after the TTL, or after an
+    explicit :meth:`invalidate`.
+    """
+
+    def __init__(self, index_by="name"):
+        self.index_by = index_by
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def contribute_to_class(self, cls, name):
+        self.model = cls
+        setattr(cls, name, self)
+        post_save.connect(self._changed, sender=cls, weak=False,
+                          dispatch_uid="redmine_models.cache.%s" % cls.__name__)
+        post_delete.connect(self._changed, sender=cls, weak=False,
+                            dispatch_uid="redmine_models.cache.%s.delete" % cls.__name__)
+
+    def _changed(self, sender, **kwargs):
+        self.invalidate()
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            raise AttributeError("TableCache is only accessible from the model class")
+        return self
+
+    @property
+    def ttl(self):
+        return getattr(settings, "REDMINE_REFERENCE_CACHE_TTL", 3600)
+
+    @property
+    def check_interval(self):
+        return getattr(settings, "REDMINE_REFERENCE_CACHE_CHECK", 60)
+
+    def _shared_cache(self):
+        alias = getattr(settings, "REDMINE_REFERENCE_CACHE", None)
+        if alias is None:
+            return None
+        from django.core.cache import caches
+        return caches[alias]
+
+    def version(self, using):
+        aggregates = {"count": Count("pk"), "max_id": Max("pk")}
+        if any(f.name == "updated_on" for f in self.model._meta.concrete_fields):
+            aggregates["updated_on"] = Max("updated_on")
+        version = self.model._base_manager.using(using).aggregate(**aggregates)
+        return tuple(sorted((k, str(v)) for k, v in version.items()))
+
+    def _shared_key(self, using):
+        return "redmine_models:%s:%s" % (self.model._meta.db_table, using)
+
+    def _load(self, using, version):
+        shared = self._shared_cache()
+        key = self._shared_key(using)
+        rows = None
+        if shared is not None:
+            cached = shared.get(key)
+            if cached is not None and cached[0] == version:
+                rows = cached[1]
+        if rows is None:
+            rows = list(self.model._base_manager.using(using).order_by("pk"))
+            if shared is not None:
+                shared.set(key, (version, rows), self.ttl)
+        by_name = {}
+        if self.index_by is not None:
+            for row in reversed(rows):
+                by_name[getattr(row, self.index_by)] = row
+        now = time.time()
+        return {
+            "version": version,
+            "loaded_at": now,
+            "checked_at": now,
+            "rows": rows,
+            "by_id": dict((row.pk, row) for row in rows),
+            "by_name": by_name,
+        }
+
+    def _current(self, using=None):
+        using = using or settings.REDMINE_DATABASE
+        state = self._state.get(using)
+        now = time.time()
+        if state is not None and now - state["checked_at"] < self.check_interval:
+            return state
+        with self._lock:
+            state = self._state.get(using)
+            if state is None or now - state["loaded_at"] >= self.ttl:
+                state = self._load(using, self.version(using))
+            elif now - state["checked_at"] >= self.check_interval:
+                version = self.version(using)
+                if version != state["version"]:
+                    state = self._load(using, version)
+                else:
+                    state = dict(state, checked_at=now)
+            self._state[using] = state
+        return state
+
+    def invalidate(self, using=None):
+        """Drop the copy of ``using`` (default: every alias), here and in the
+        shared cache; the next lookup reloads it."""
+        with self._lock:
+            if using is None:
+                self._state.clear()
+            else:
+                self._state.pop(using, None)
+        shared = self._shared_cache()
+        if shared is not None:
+            aliases = settings.DATABASES if using is None else [using]
+            shared.delete_many([self._shared_key(alias) for alias in aliases])
+
+    def generation(self, using=None):
+        """Key changing whenever the rows are reloaded, for derived caches."""
+        state = self._current(using)
+        return state["version"], state["loaded_at"]
+
+    def all(self, using=None):
+        return list(self._current(using)["rows"])
+
+    def filter(self, using=None, **attrs):
+        return [row for row in self._current(using)["rows"]
+                if all(getattr(row, k) == v for k, v in attrs.items())]
+
+    def get(self, pk=None, name=None, using=None):
+        state = self._current(using)
+        if name is not None:
+            row = state["by_name"].get(name)
+        else:
+            row = state["by_id"].get(pk)
+        if row is None:
+            raise self.model.DoesNotExist(
+                "%s matching pk=%r name=%r is not cached" % (
+                    self.model.__name__, pk, name))
+        return row
+
+
+class LRUCache(object):
+    """Thread-safe mapping keeping the ``maxsize`` most recently used keys."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
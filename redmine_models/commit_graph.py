@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import bisect
+import threading
+import time
+from array import array
+from collections import deque
+
+from django.conf import settings
+
+
+def _pk(obj):
+    return getattr(obj, "pk", obj)
+
+
+class CommitGraph(object):
+    """Commit DAG of one repository in flat arrays.
+
+    Changesets get dense indexes in id order.  The parents of changeset
+    ``i`` are ``parents[parent_offsets[i]:parent_offsets[i + 1]]``, so the
+    graph costs a few bytes per commit and edge.  :meth:`update` appends the
+    changesets added since the last load with two queries.
+
+    Methods accept revisions (strings), changesets or changeset ids and
+    return changeset ids.
+    """
+
+    def __init__(self, repository, using=None):
+        self.repository_id = _pk(repository)
+        self.using = using or settings.REDMINE_DATABASE
+        self.ids = array("l")
+        self.revisions = []
+        self.index = {}
+        self.by_revision = {}
+        self.parent_offsets = array("l", [0])
+        self.parents = array("l")
+        self.generations = array("l")
+        self.max_id = 0
+        self.update()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self):
+        """Load the changesets created since the last call; returns how many."""
+        from .models import Changeset, ChangesetParent
+
+        rows = list(Changeset.objects.using(self.using)
+                    .filter(repository_id=self.repository_id, pk__gt=self.max_id)
+                    .order_by("pk").values_list("pk", "revision"))
+        if not rows:
+            return 0
+        edges = {}
+        for changeset_id, parent_id in (
+                ChangesetParent.objects.using(self.using)
+                .filter(changeset__repository_id=self.repository_id,
+                        changeset_id__gt=self.max_id)
+                .order_by("pk").values_list("changeset_id", "parent")):
+            edges.setdefault(changeset_id, []).append(parent_id)
+        first = len(self.ids)
+        for changeset_id, revision in rows:
+            self.index[changeset_id] = len(self.ids)
+            self.ids.append(changeset_id)
+            self.revisions.append(revision)
+            self.by_revision[revision] = changeset_id
+        for changeset_id, revision in rows:
+            for parent_id in edges.get(changeset_id, ()):
+                parent = self.index.get(parent_id)
+                if parent is not None:
+                    self.parents.append(parent)
+            self.parent_offsets.append(len(self.parents))
+        self.max_id = rows[-1][0]
+        self._number(first)
+        return len(rows)
+
+    def _number(self, first):
+        """Generation numbers (longest path to a root, plus one) for the
+        nodes from ``first`` on; parents may come later in id order."""
+        generations = self.generations
+        generations.extend([0] * (len(self.ids) - len(generations)))
+        offsets, parents = self.parent_offsets, self.parents
+        for start in range(first, len(self.ids)):
+            stack = [start]
+            while stack:
+                node = stack[-1]
+                if generations[node] > 0:
+                    stack.pop()
+                elif generations[node] == 0:
+                    # in progress; parents still in progress mean a cycle,
+                    # which is not followed
+                    generations[node] = -1
+                    stack.extend(p for p in parents[offsets[node]:offsets[node + 1]]
+                                 if generations[p] == 0)
+                else:
+                    stack.pop()
+                    generations[node] = 1 + max(
+                        [generations[p] for p in parents[offsets[node]:offsets[node + 1]]
+                         if generations[p] > 0] or [0])
+
+    def _node(self, commit):
+        if isinstance(commit, str):
+            changeset_id = self.by_revision.get(commit)
+        else:
+            changeset_id = _pk(commit)
+        node = self.index.get(changeset_id)
+        if node is None:
+            raise KeyError("Unknown changeset %r" % (commit,))
+        return node
+
+    def parent_ids(self, commit):
+        node = self._node(commit)
+        return [self.ids[p] for p in
+                self.parents[self.parent_offsets[node]:self.parent_offsets[node + 1]]]
+
+    def _walk(self, nodes, floor=0):
+        """Indexes of ``nodes`` and their ancestors, skipping those whose
+        generation is below ``floor``."""
+        offsets, parents, generations = self.parent_offsets, self.parents, self.generations
+        seen = set()
+        queue = deque(nodes)
+        while queue:
+            node = queue.popleft()
+            if node in seen or generations[node] < floor:
+                continue
+            seen.add(node)
+            queue.extend(parents[offsets[node]:offsets[node + 1]])
+        return seen
+
+    def ancestors(self, commit, include_self=False):
+        node = self._node(commit)
+        found = self._walk([node])
+        if not include_self:
+            found.discard(node)
+        return set(self.ids[i] for i in found)
+
+    def is_ancestor(self, ancestor, commit):
+        """Whether ``ancestor`` is ``commit`` or reachable from its parents."""
+        a, b = self._node(ancestor), self._node(commit)
+        if a == b:
+            return True
+        if self.generations[a] >= self.generations[b]:
+            return False
+        return a in self._walk([b], floor=self.generations[a])
+
+    def merge_bases(self, a, b):
+        """Best common ancestors of two commits, as ``git merge-base --all``."""
+        common = self._walk([self._node(a)]) & self._walk([self._node(b)])
+        offsets, parents = self.parent_offsets, self.parents
+        redundant = set()
+        for node in common:
+            redundant.update(parents[offsets[node]:offsets[node + 1]])
+        return sorted(self.ids[i] for i in common - redundant)
+
+    def merge_base(self, a, b):
+        bases = self.merge_bases(a, b)
+        return bases[-1] if bases else None
+
+    def reachable(self, include, exclude=()):
+        """Changesets reachable from ``include`` but not from ``exclude``,
+        like ``git rev-list include ^exclude``, newest first."""
+        excluded = self._walk([self._node(c) for c in exclude])
+        found = self._walk([self._node(c) for c in include]) - excluded
+        return sorted((self.ids[i] for i in found), reverse=True)
+
+
+class PathIndex(object):
+    """Inverted index from ``Change.path`` to the changesets touching it,
+    extended by :meth:`update` with the changesets added since."""
+
+    def __init__(self, repository, using=None):
+        self.repository_id = _pk(repository)
+        self.using = using or settings.REDMINE_DATABASE
+        self.paths = {}
+        self.max_id = 0
+        self._sorted = None
+        self.update()
+
+    def update(self):
+        """Index the changes of changesets created since the last call."""
+        from .models import Change
+
+        rows = (Change.objects.using(self.using)
+                .filter(changeset__repository_id=self.repository_id,
+                        changeset_id__gt=self.max_id)
+                .order_by("changeset_id").values_list("changeset_id", "path"))
+        count = 0
+        for changeset_id, path in rows.iterator():
+            ids = self.paths.get(path)
+            if ids is None:
+                ids = self.paths[path] = array("l")
+                self._sorted = None
+            if not ids or ids[-1] != changeset_id:
+                ids.append(changeset_id)
+            self.max_id = changeset_id
+            count += 1
+        return count
+
+    def changesets(self, path, prefix=False):
+        """Ids of the changesets that touched ``path``, newest first.  With
+        ``prefix``, changes anywhere below the ``path`` directory count too.
+        """
+        if not prefix:
+            return list(reversed(self.paths.get(path, ())))
+        if self._sorted is None:
+            self._sorted = sorted(self.paths)
+        directory = path.rstrip("/") + "/"
+        found = set(self.paths.get(path.rstrip("/"), ()))
+        i = bisect.bisect_left(self._sorted, directory)
+        while i < len(self._sorted) and self._sorted[i].startswith(directory):
+            found.update(self.paths[self._sorted[i]])
+            i += 1
+        return sorted(found, reverse=True)
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def repository_history(repository, using=None):
+    """Shared ``(CommitGraph, PathIndex)`` of a repository, brought up to
+    date at most every ``REDMINE_COMMIT_GRAPH_CHECK`` seconds (default 60).
+    """
+    using = using or settings.REDMINE_DATABASE
+    key = (using, _pk(repository))
+    entry = _histories.get(key)
+    if entry is None:
+        entry = [CommitGraph(repository, using), PathIndex(repository, using), time.time()]
+        with _histories_lock:
+            _histories[key] = entry
+    elif time.time() - entry[2] >= getattr(settings, "REDMINE_COMMIT_GRAPH_CHECK", 60):
+        with _histories_lock:
+            entry[0].update()
+            entry[1].update()
+            entry[2] = time.time()
+    return entry[0], entry[1]
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .settings import redmine_setting
+
+# Redmine's Changeset::TIMELOG_RE: "@2h", "@1h30", "@1:30", "@1.5"...
+TIMELOG_RE = (r"(?:(?:\d+)(?:h|hours?)(?:(?:\d+)(?:m|min)?)?"
+              r"|(?:\d+)(?:h|hours?|m|min)"
+              r"|\d+:\d+"
+              r"|\d+(?:[.,]\d+)?h?)")
+
+ISSUE_RE = re.compile(r"#(\d+)(?:\s+@(%s))?" % TIMELOG_RE)
+
+
+def _keywords(value):
+    return [keyword.strip().lower() for keyword in (value or "").split(",")
+            if keyword.strip()]
+
+
+def compile_matcher(ref_keywords, fix_keywords):
+    """Regex finding ``<keyword> #1, #2 and #3`` groups, built like
+    ``Changeset#scan_comment_for_issue_ids``; the keyword is optional."""
+    keywords = "|".join(re.escape(keyword) for keyword in
+                        sorted(set(ref_keywords) | set(fix_keywords), key=len, reverse=True))
+    issue = r"\#\d+(?:\s+@%s)?" % TIMELOG_RE
+    return re.compile(
+        r"(?:[\s(\[,-]|^)(?:(%s)[\s:]+)?(%s(?:[\s,;&]+(?:and|&)?[\s,;&]*%s)*)"
+        r"(?=[^\w\s]|\s|<|$)" % (keywords or "(?!)", issue, issue),
+        re.IGNORECASE | re.UNICODE)
+
+
+class ReferenceParser(object):
+    """Extract issue references from commit messages.
+
+    ``ref_keywords`` link commits to issues; a ``*`` among them makes bare
+    ``#123`` references count too.  ``fix_keywords`` also link, and their
+    references are reported so that the caller can update the issues.
+    """
+
+    def __init__(self, ref_keywords=("refs", "references", "issueid"), fix_keywords=()):
+        ref_keywords = [keyword.lower() for keyword in ref_keywords]
+        self.any_reference = "*" in ref_keywords
+        self.ref_keywords = [keyword for keyword in ref_keywords if keyword != "*"]
+        self.fix_keywords = [keyword.lower() for keyword in fix_keywords]
+        self.matcher = compile_matcher(self.ref_keywords, self.fix_keywords)
+
+    @classmethod
+    def from_settings(cls, using=None):
+        """Parser for the ``commit_ref_keywords`` setting and the keywords of
+        ``commit_update_keywords``, or of the pre-3.4 ``commit_fix_keywords``
+        when none are configured."""
+        fix_keywords = []
+        for rule in redmine_setting("commit_update_keywords", [], using) or []:
+            if isinstance(rule, dict):
+                fix_keywords.extend(_keywords(rule.get("keywords")))
+        if not fix_keywords:
+            fix_keywords = _keywords(redmine_setting("commit_fix_keywords", "", using))
+        return cls(_keywords(redmine_setting("commit_ref_keywords", "", using)), fix_keywords)
+
+    def __getstate__(self):
+        return (self.ref_keywords + (["*"] if self.any_reference else []), self.fix_keywords)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def parse(self, comments):
+        """Return ``[(issue_id, keyword or None, hours or None)]`` in message
+        order, the first mention of each issue winning."""
+        found = []
+        seen = set()
+        for match in self.matcher.finditer(comments or ""):
+            keyword = match.group(1)
+            keyword = keyword.lower() if keyword else None
+            if keyword is None and not self.any_reference:
+                continue
+            for issue_id, hours in ISSUE_RE.findall(match.group(2)):
+                issue_id = int(issue_id)
+                if issue_id not in seen:
+                    seen.add(issue_id)
+                    found.append((issue_id, keyword, hours or None))
+        return found
+
+    def is_fix(self, keyword):
+        return keyword in self.fix_keywords
+
+
+def _parse_batch(parser, rows):
+    return [(changeset_id, parser.parse(comments)) for changeset_id, comments in rows]
+
+
+class ScanResult(object):
+    """Counters of :func:`scan_changesets` and the fixing references, as
+    ``(changeset_id, issue_id, keyword)``.  ``references`` counts the links
+    created, ``linked`` those that already existed."""
+
+    def __init__(self):
+        self.changesets = 0
+        self.references = 0
+        self.linked = 0
+        self.rejected = 0
+        self.last_id = None
+        self.fixes = []
+
+
+def _in_tree(project, issue_project):
+    """Redmine's rule without cross-project references: the repository's
+    project, one of its ancestors or one of its descendants."""
+    if project is None or issue_project is None:
+        return False
+    lft, rgt = project
+    issue_lft, issue_rgt = issue_project
+    return (lft <= issue_lft and issue_rgt <= rgt) or (issue_lft < lft and rgt < issue_rgt)
+
+
+def _link_batch(rows, parsed, parser, cross_project, using, result):
+    from .models import ChangesetsIssue, Issue
+
+    issue_ids = set(issue_id for changeset_id, references in parsed
+                    for issue_id, keyword, hours in references)
+    if not issue_ids:
+        return
+    issues = dict((pk, (lft, rgt) if lft is not None else None) for pk, lft, rgt in
+                  Issue.objects.using(using).filter(pk__in=issue_ids)
+                  .values_list("pk", "project__lft", "project__rgt"))
+    existing = set(ChangesetsIssue.objects.using(using)
+                   .filter(changeset_id__in=rows, issue_id__in=issue_ids)
+                   .values_list("changeset_id", "issue_id"))
+    links = []
+    for changeset_id, references in parsed:
+        project = rows[changeset_id]
+        for issue_id, keyword, hours in references:
+            if issue_id not in issues or not (
+                    cross_project or _in_tree(project, issues[issue_id])):
+                result.rejected += 1
+                continue
+            if (changeset_id, issue_id) in existing:
+                result.linked += 1
+                continue
+            links.append(ChangesetsIssue(changeset_id=changeset_id, issue_id=issue_id))
+            if parser.is_fix(keyword):
+                result.fixes.append((changeset_id, issue_id, keyword))
+    if links:
+        ChangesetsIssue.objects.using(using).bulk_create(links, ignore_conflicts=True)
+        result.references += len(links)
+
+
+def scan_changesets(changesets=None, parser=None, batch_size=1000, workers=1, using=None):
+    """Link changesets to the issues their comments reference.
+
+    ``changesets`` is a queryset (default: every changeset, so pass e.g.
+    ``filter(pk__gt=last_id)`` to scan incrementally).  Rows are streamed in
+    batches of ``batch_size``; each batch checks its issue ids and its
+    existing links with one ``IN`` query each and inserts the new links with
+    one ``bulk_create``.  With ``workers`` > 1 the comments are parsed in
+    that many spawned processes.
+
+    Issues are not updated: fixing references of new links are returned in
+    ``ScanResult.fixes`` for the caller to apply.
+    """
+    from .models import Changeset
+
+    using = using or settings.REDMINE_DATABASE
+    if changesets is None:
+        changesets = Changeset.objects.all()
+    if parser is None:
+        parser = ReferenceParser.from_settings(using)
+    cross_project = redmine_setting("commit_cross_project_ref", "0", using) == "1"
+    rows = (changesets.using(using)
+            .values("id", "comments", "repository__project__lft",
+                    "repository__project__rgt")
+            .stream(batch_size=batch_size))
+    result = ScanResult()
+    pool = None
+    if workers > 1:
+        # spawned, not forked: workers start once streaming has opened the
+        # connection, which they must not inherit
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = []
+
+        def flush():
+            projects = dict(
+                (row["id"], (row["repository__project__lft"], row["repository__project__rgt"])
+                 if row["repository__project__lft"] is not None else None)
+                for row in pending)
+            comments = [(row["id"], row["comments"]) for row in pending]
+            if pool is None:
+                parsed = _parse_batch(parser, comments)
+            else:
+                step = -(-len(comments) // workers)
+                parsed = []
+                for chunk in pool.map(_parse_batch, [parser] * workers,
+                                      [comments[i:i + step]
+                                       for i in range(0, len(comments), step)]):
+                    parsed.extend(chunk)
+            _link_batch(projects, parsed, parser, cross_project, using, result)
+            result.changesets += len(pending)
+            result.last_id = pending[-1]["id"]
+            del pending[:]
+
+        for row in rows:
+            pending.append(row)
+            if len(pending) >= batch_size:
+                flush()
+        if pending:
+            flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return result
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+from collections import defaultdict
+
+from .fields import redmine_type_name
+
+# CustomField.type values applicable to each CustomValue.customized_type
+CUSTOM_FIELD_TYPES = {
+    "Document": ("DocumentCustomField",),
+    "Enumeration": (
+        "DocumentCategoryCustomField",
+        "IssuePriorityCustomField",
+        "TimeEntryActivityCustomField",
+    ),
+    "Issue": ("IssueCustomField",),
+    "Principal": ("GroupCustomField", "UserCustomField"),
+    "Project": ("ProjectCustomField",),
+    "TimeEntry": ("TimeEntryCustomField",),
+    "Version": ("VersionCustomField",),
+}
+
+INTEGER_FORMATS = ("attachment", "enumeration", "int", "user", "version")
+
+
+def custom_field_definitions(using=None):
+    """Return all ``CustomField`` rows from the process-local table cache."""
+    from .models import CustomField
+
+    return sorted(CustomField.cached.all(using),
+                  key=lambda f: (f.position is None, f.position, f.pk))
+
+
+def clear_custom_field_cache():
+    from .models import CustomField
+
+    CustomField.cached.invalidate()
+
+
+def resolve_custom_fields(customized_type, fields=None, using=None):
+    """Map ids, names or ``CustomField`` instances to the cached definitions
+    applicable to ``customized_type``; all of them when ``fields`` is None.
+    """
+    types = CUSTOM_FIELD_TYPES.get(customized_type, ())
+    available = [f for f in custom_field_definitions(using) if f.type in types]
+    if fields is None:
+        return available
+    by_id = dict((f.pk, f) for f in available)
+    by_name = dict((f.name, f) for f in available)
+    resolved = []
+    for field in fields:
+        key = getattr(field, "pk", field)
+        found = by_id.get(key) or by_name.get(key)
+        if found is None:
+            raise ValueError("Unknown %s custom field: %r" % (customized_type, field))
+        resolved.append(found)
+    return resolved
+
+
+def decode_custom_value(field, value):
+    """Convert the text stored in ``CustomValue.value`` according to
+    ``field.field_format``; blank or malformed values decode to None.
+    """
+    if value is None or value == "":
+        return None
+    field_format = field.field_format
+    try:
+        if field_format in INTEGER_FORMATS:
+            return int(value)
+        if field_format == "float":
+            return float(value)
+        if field_format == "date":
+            return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    if field_format == "bool":
+        return value == "1"
+    return value
+
+
+def load_custom_values(instances, fields=None):
+    """Set ``custom_field_values`` (a dict keyed by field name) on every
+    instance, using a single query for all of them.
+    """
+    from .models import CustomValue
+
+    instances = list(instances)
+    if not instances:
+        return instances
+    using = instances[0]._state.db
+    customized_type = redmine_type_name(type(instances[0]))
+    definitions = resolve_custom_fields(customized_type, fields, using)
+    by_id = dict((f.pk, f) for f in definitions)
+    raw = defaultdict(lambda: defaultdict(list))
+    if by_id:
+        rows = (
+            CustomValue.objects.using(using)
+            .filter(
+                customized_type=customized_type,
+                customized_id__in=set(i.pk for i in instances),
+                custom_field_id__in=list(by_id),
+            )
+            .order_by("id")
+            .values_list("customized_id", "custom_field_id", "value")
+        )
+        for customized_id, field_id, value in rows:
+            raw[customized_id][field_id].append(value)
+    for instance in instances:
+        values = {}
+        stored = raw.get(instance.pk, {})
+        for field in definitions:
+            decoded = [decode_custom_value(field, v) for v in stored.get(field.pk, ())]
+            if field.multiple:
+                values[field.name] = [v for v in decoded if v is not None]
+            else:
+                values[field.name] = decoded[0] if decoded else None
+        instance.custom_field_values = values
+    return instances
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import base64
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+from .managers import RedmineQuerySet
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_MODELS = ("Issue", "Journal", "JournalDetail", "TimeEntry", "CustomValue")
+
+
+def arrow_type(field):
+    """Arrow type of the column behind a concrete Django field."""
+    if field.is_relation:
+        field = field.target_field
+    internal = field.get_internal_type()
+    if internal in ("AutoField", "BigAutoField", "BigIntegerField", "IntegerField",
+                    "PositiveIntegerField", "SmallIntegerField"):
+        return pyarrow.int64()
+    if internal == "FloatField":
+        return pyarrow.float64()
+    if internal == "BooleanField":
+        return pyarrow.bool_()
+    if internal == "DateField":
+        return pyarrow.date32()
+    if internal == "DateTimeField":
+        return pyarrow.timestamp("us", tz="UTC" if settings.USE_TZ else None)
+    if internal == "BinaryField":
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+def _columns(model):
+    return [f.attname for f in model._meta.concrete_fields]
+
+
+def _parquet(model, rows, path, row_group_size):
+    fields = model._meta.concrete_fields
+    schema = pyarrow.schema([(f.attname, arrow_type(f)) for f in fields])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        buffered = []
+        for row in rows:
+            buffered.append(row)
+            if len(buffered) >= row_group_size:
+                writer.write_table(pyarrow.Table.from_pylist(buffered, schema))
+                count += len(buffered)
+                buffered = []
+        if buffered or not count:
+            writer.write_table(pyarrow.Table.from_pylist(buffered, schema))
+            count += len(buffered)
+    return count
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return value
+
+
+def _csv(model, rows, path):
+    names = _columns(model)
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow([_csv_value(row[name]) for name in names])
+            count += 1
+    return count
+
+
+def export_model(model_name, directory, file_format="parquet", batch_size=10000,
+                 row_group_size=100000, using=None):
+    """Stream one model to ``<directory>/<db_table>.<file_format>``.
+
+    Rows are read in keyset-paginated batches and written as Parquet row
+    groups of ``row_group_size`` rows (or as CSV), so memory stays bounded by
+    one row group.  Returns the path and the number of rows written.
+    """
+    using = using or settings.REDMINE_DATABASE
+    model = apps.get_model("redmine_models", model_name)
+    if file_format == "parquet" and pyarrow is None:
+        raise ImportError("Parquet export requires pyarrow")
+    path = os.path.join(directory, "%s.%s" % (model._meta.db_table, file_format))
+    rows = (RedmineQuerySet(model, using=using)
+            .values(*_columns(model)).stream(batch_size=batch_size))
+    if file_format == "parquet":
+        count = _parquet(model, rows, path, row_group_size)
+    else:
+        count = _csv(model, rows, path)
+    return path, count
+
+
+def _setup_worker():
+    import django
+    django.setup()
+
+
+def export_models(model_names, directory, workers=1, **kwargs):
+    """Export several models, in ``workers`` parallel processes if > 1."""
+    if workers <= 1:
+        return [export_model(name, directory, **kwargs) for name in model_names]
+    # children must open their own connections instead of sharing ours
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker) as pool:
+        futures = [pool.submit(export_model, name, directory, **kwargs)
+                   for name in model_names]
+        return [future.result() for future in futures]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.apps import apps
+
+# Redmine stores the base class of its single table inheritance hierarchies
+# in the polymorphic ``*_type`` columns, e.g. "Principal" for users and groups.
+REDMINE_TYPES = {
+    "Board": "Board",
+    "Changeset": "Changeset",
+    "Document": "Document",
+    "Enumeration": "Enumeration",
+    "Group": "User",
+    "Issue": "Issue",
+    "Journal": "Journal",
+    "Message": "Message",
+    "News": "News",
+    "Principal": "User",
+    "Project": "Project",
+    "TimeEntry": "TimeEntry",
+    "User": "User",
+    "Version": "Version",
+    "Wiki": "Wiki",
+    "WikiPage": "WikiPage",
+}
+
+
+def redmine_type_model(type_name):
+    model_name = REDMINE_TYPES.get(type_name)
+    if model_name is None:
+        return None
+    return apps.get_model("redmine_models", model_name)
+
+
+def redmine_type_name(model):
+    if model._meta.model_name == "user":
+        return "Principal"
+    return model.__name__
+
+
+class RedmineGenericForeignKey(object):
+    """Follow a Redmine ``<name>_type``/``<name>_id`` column pair.
+
+    Results are cached on the instance as long as the pair is unchanged.
+    """
+
+    def __init__(self, type_field, id_field):
+        self.type_field = type_field
+        self.id_field = id_field
+
+    def contribute_to_class(self, cls, name):
+        self.name = name
+        self.model = cls
+        self.cache_name = "_%s_cache" % name
+        setattr(cls, name, self)
+
+    def _key(self, instance):
+        return getattr(instance, self.type_field), getattr(instance, self.id_field)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        key = self._key(instance)
+        cached = instance.__dict__.get(self.cache_name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        obj = None
+        model = redmine_type_model(key[0])
+        if model is not None and key[1] is not None:
+            obj = (model._default_manager.db_manager(instance._state.db)
+                   .filter(pk=key[1]).first())
+        instance.__dict__[self.cache_name] = (key, obj)
+        return obj
+
+    def __set__(self, instance, value):
+        if value is None:
+            setattr(instance, self.type_field, None)
+            setattr(instance, self.id_field, None)
+        else:
+            setattr(instance, self.type_field, redmine_type_name(type(value)))
+            setattr(instance, self.id_field, value.pk)
+        instance.__dict__[self.cache_name] = (self._key(instance), value)
+
+    def prefetch(self, instances, using=None):
+        wanted = defaultdict(set)
+        for instance in instances:
+            type_name, pk = self._key(instance)
+            if pk is not None and redmine_type_model(type_name) is not None:
+                wanted[type_name].add(pk)
+        loaded = {}
+        for type_name, pks in wanted.items():
+            model = redmine_type_model(type_name)
+            for obj in model._default_manager.db_manager(using).filter(pk__in=pks):
+                loaded[type_name, obj.pk] = obj
+        for instance in instances:
+            key = self._key(instance)
+            instance.__dict__[self.cache_name] = (key, loaded.get(key))
+
+
+class RedmineGenericRelation(object):
+    """Reverse side of a :class:`RedmineGenericForeignKey`.
+
+    Returns a queryset of the ``to`` model rows pointing at the instance,
+    already evaluated when it was loaded by ``prefetch_polymorphic()``.
+    """
+
+    def __init__(self, to, type_field, id_field, type_name=None):
+        self.to = to
+        self.type_field = type_field
+        self.id_field = id_field
+        self.type_name = type_name
+
+    def contribute_to_class(self, cls, name):
+        self.name = name
+        self.model = cls
+        self.cache_name = "_%s_cache" % name
+        if self.type_name is None:
+            self.type_name = redmine_type_name(cls)
+        setattr(cls, name, self)
+
+    @property
+    def related_model(self):
+        return apps.get_model("redmine_models", self.to)
+
+    def _queryset(self, using, pks):
+        return self.related_model._default_manager.db_manager(using).filter(**{
+            self.type_field: self.type_name,
+            self.id_field + "__in": pks,
+        })
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        qs = self._queryset(instance._state.db, [instance.pk])
+        cached = instance.__dict__.get(self.cache_name)
+        if cached is not None:
+            qs._result_cache = cached
+            qs._prefetch_done = True
+            qs._prefilled = True
+        return qs
+
+    def prefetch(self, instances, using=None):
+        grouped = defaultdict(list)
+        pks = set(instance.pk for instance in instances)
+        if pks:
+            for obj in self._queryset(using, pks).order_by("pk"):
+                grouped[getattr(obj, self.id_field)].append(obj)
+        for instance in instances:
+            instance.__dict__[self.cache_name] = grouped.get(instance.pk, [])
+
+
+def prefetch_polymorphic(instances, *names):
+    """Load the named polymorphic relations of ``instances``.
+
+    Each relation costs one ``IN`` query per distinct target type.
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+    model = type(instances[0])
+    using = instances[0]._state.db
+    for name in names:
+        descriptor = getattr(model, name, None)
+        if not isinstance(descriptor, (RedmineGenericForeignKey,
+                                       RedmineGenericRelation)):
+            raise ValueError(
+                "'%s' is not a polymorphic relation of %s" % (name, model.__name__))
+        descriptor.prefetch(instances, using)
+    return instances
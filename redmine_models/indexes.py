@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.db import NotSupportedError, connections, models
+
+# A query shape: columns compared for equality, then at most one range or
+# ORDER BY column.
+QueryPattern = namedtuple("QueryPattern", "model equal range reason")
+
+QUERY_PATTERNS = (
+    QueryPattern("Journal", ("journalized_type", "journalized_id"), None,
+                 "polymorphic prefetch of journals"),
+    QueryPattern("Attachment", ("container_type", "container_id"), None,
+                 "polymorphic prefetch of attachments"),
+    QueryPattern("Watcher", ("watchable_type", "watchable_id"), None,
+                 "polymorphic prefetch of watchers"),
+    QueryPattern("Comment", ("commented_type", "commented_id"), None,
+                 "polymorphic prefetch of comments"),
+    QueryPattern("CustomValue", ("customized_type", "customized_id", "custom_field_id"),
+                 None, "with_custom_fields() and custom field filters"),
+    QueryPattern("TimeEntry", ("project_id",), "spent_on", "time reports by period"),
+    QueryPattern("TimeEntry", (), "updated_on", "incremental rollup refresh"),
+    QueryPattern("Issue", ("root_id",), "lft", "issue subtrees"),
+    QueryPattern("Issue", (), "updated_on", "change feed"),
+    QueryPattern("Project", (), "lft", "project subtrees"),
+    QueryPattern("JournalDetail", ("journal_id",), None, "journal replay"),
+    QueryPattern("WikiPage", ("wiki_id", "title"), None, "wiki title lookups"),
+    QueryPattern("WikiRedirect", ("wiki_id", "title"), None, "wiki redirects"),
+)
+
+# Indexes created by ``redmine_create_indexes`` for the patterns Redmine's
+# own schema leaves uncovered.
+SUPPLEMENTARY_INDEXES = {
+    "CustomValue": [models.Index(
+        fields=["customized_type", "customized_id", "custom_field"],
+        name="custom_values_customized_cf")],
+    "TimeEntry": [
+        models.Index(fields=["project", "spent_on"], name="time_entries_project_spent_on"),
+        models.Index(fields=["updated_on"], name="time_entries_updated_on"),
+    ],
+    "Issue": [models.Index(fields=["updated_on", "id"], name="issues_updated_on_id")],
+}
+
+
+def _model(name):
+    return apps.get_model("redmine_models", name)
+
+
+def _columns(model, field_names):
+    return tuple(model._meta.get_field(name).column for name in field_names)
+
+
+def declared_indexes(model):
+    """Column tuples the model declares: ``Meta.indexes``, unique
+    constraints and foreign keys, which Redmine indexes as well."""
+    indexes = set()
+    for index in model._meta.indexes:
+        indexes.add(_columns(model, index.fields))
+    for fields in model._meta.unique_together:
+        indexes.add(_columns(model, fields))
+    for field in model._meta.concrete_fields:
+        if field.is_relation and field.db_index:
+            indexes.add((field.column,))
+    return indexes
+
+
+def live_indexes(model, using=None):
+    """Column tuples of the indexes on the model's table, or None when the
+    table does not exist."""
+    connection = connections[using or settings.REDMINE_DATABASE]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return None
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return set(tuple(info["columns"]) for info in constraints.values()
+               if (info["index"] or info["unique"] or info["primary_key"])
+               and info["columns"])
+
+
+def covers(index, pattern):
+    """Whether an index on ``index`` columns serves ``pattern``: the equality
+    columns in any order, then the range column."""
+    equal = tuple(pattern.equal)
+    needed = len(equal) + (1 if pattern.range else 0)
+    if not needed or len(index) < needed:
+        return False
+    if set(index[:len(equal)]) != set(equal):
+        return False
+    return not pattern.range or index[len(equal)] == pattern.range
+
+
+def missing_declared(using=None):
+    """Yield ``(model, columns)`` for declared indexes absent from the database."""
+    for model in apps.get_app_config("redmine_models").get_models():
+        live = live_indexes(model, using)
+        if live is None:
+            continue
+        for columns in sorted(declared_indexes(model) - live):
+            yield model, columns
+
+
+def uncovered_patterns(using=None):
+    """Yield ``(pattern, suggested index or None)`` for query patterns no
+    live index serves."""
+    for pattern in QUERY_PATTERNS:
+        model = _model(pattern.model)
+        live = live_indexes(model, using)
+        if live is None or any(covers(index, pattern) for index in live):
+            continue
+        suggestion = None
+        for index in SUPPLEMENTARY_INDEXES.get(pattern.model, ()):
+            if covers(_columns(model, index.fields), pattern):
+                suggestion = index
+        yield pattern, suggestion
+
+
+def create_supplementary_indexes(using=None, dry_run=False):
+    """Create the supplementary indexes suggested for uncovered patterns and
+    return them as ``(model, index)`` pairs.  PostgreSQL builds them
+    concurrently, without locking writes, which cannot run inside a
+    transaction: ``NotSupportedError`` is raised in one.
+    """
+    connection = connections[using or settings.REDMINE_DATABASE]
+    concurrently = connection.vendor == "postgresql"
+    if concurrently and not dry_run and connection.in_atomic_block:
+        raise NotSupportedError(
+            "Supplementary indexes are built concurrently on PostgreSQL, which "
+            "cannot run inside a transaction.")
+    created = []
+    for pattern, index in uncovered_patterns(using):
+        if index is None or any(index is other for model, other in created):
+            continue
+        model = _model(pattern.model)
+        if not dry_run:
+            with connection.schema_editor(atomic=False) as editor:
+                if concurrently:
+                    editor.add_index(model, index, concurrently=True)
+                else:
+                    editor.add_index(model, index)
+        created.append((model, index))
+    return created
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+[`"\[]?(\w+)', re.IGNORECASE)
+
+
+def _table_models():
+    return dict((model._meta.db_table, model.__name__)
+                for model in apps.get_app_config("redmine_models").get_models())
+
+
+class TableStats(object):
+    __slots__ = ("queries", "rows", "seconds", "max_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, queries, rows, seconds, max_seconds):
+        self.queries += queries
+        self.rows += rows
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, max_seconds)
+
+
+class QueryRecorder(object):
+    """``execute_wrapper`` collecting per-table statistics.
+
+    Each statement is attributed to the database alias it ran on and to the
+    first table it names, split by operation (select, insert, ...).  Row
+    counts come from the cursor's ``rowcount`` and are missing for SELECTs on
+    backends that leave it at -1, such as SQLite.  Statements run
+    ``repeat_threshold`` times or more with different parameters are reported
+    as N+1 candidates, identical ones run twice or more as duplicates.
+    """
+
+    def __init__(self, repeat_threshold=None):
+        if repeat_threshold is None:
+            repeat_threshold = getattr(settings, "REDMINE_REPEATED_QUERY_THRESHOLD", 10)
+        self.repeat_threshold = repeat_threshold
+        self.models = _table_models()
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.stats = defaultdict(TableStats)
+            self.statements = defaultdict(int)
+            self.executions = defaultdict(int)
+            self.merged_duplicates = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            rowcount = getattr(context.get("cursor"), "rowcount", -1)
+            alias = getattr(context.get("connection"), "alias", "")
+            self.record(sql, params, elapsed, rowcount, many, alias)
+
+    def record(self, sql, params, seconds, rowcount=-1, many=False, alias=""):
+        match = TABLE_RE.search(sql)
+        table = match.group(1) if match else ""
+        operation = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else ""
+        if many:
+            params = None
+        else:
+            try:
+                params = tuple(params) if params is not None else None
+                hash(params)
+            except TypeError:
+                params = repr(params)
+        with self.lock:
+            self.stats[alias, table, operation].add(1, max(rowcount or 0, 0), seconds,
+                                                    seconds)
+            self.statements[sql] += 1
+            self.executions[sql, params] += 1
+
+    def merge(self, other):
+        """Add the counters of ``other``; statements are not kept, so that
+        long-lived recorders stay small."""
+        duplicates = other.duplicate_count()
+        with self.lock:
+            for key, stats in other.stats.items():
+                self.stats[key].add(stats.queries, stats.rows, stats.seconds,
+                                    stats.max_seconds)
+            self.merged_duplicates += duplicates
+
+    @property
+    def total(self):
+        return sum(stats.queries for stats in self.stats.values())
+
+    def by_table(self):
+        """Return ``{(alias, table, model name or None, operation): TableStats}``."""
+        return dict(((alias, table, self.models.get(table), operation), stats)
+                    for (alias, table, operation), stats in self.stats.items())
+
+    def by_alias(self):
+        """Return ``{alias: number of queries}``."""
+        totals = defaultdict(int)
+        for (alias, table, operation), stats in self.stats.items():
+            totals[alias] += stats.queries
+        return dict(totals)
+
+    def repeated(self):
+        """``(sql, count)`` of statements run ``repeat_threshold`` times or
+        more, most frequent first: usually a missing select_related."""
+        return sorted(((sql, count) for sql, count in self.statements.items()
+                       if count >= self.repeat_threshold),
+                      key=lambda item: -item[1])
+
+    def duplicates(self):
+        """``((sql, params), count)`` of identical statements run twice or more."""
+        return sorted(((key, count) for key, count in self.executions.items()
+                       if count > 1 and key[1] is not None),
+                      key=lambda item: -item[1])
+
+    def duplicate_count(self):
+        return self.merged_duplicates + sum(count - 1 for key, count in self.duplicates())
+
+    def to_prometheus(self, prefix="redmine"):
+        """Prometheus text exposition of the counters."""
+        metrics = (
+            ("queries_total", "counter", "Queries run against Redmine tables.",
+             lambda stats: stats.queries),
+            ("query_rows_total", "counter", "Rows affected or returned, when known.",
+             lambda stats: stats.rows),
+            ("query_seconds_total", "counter", "Time spent in queries.",
+             lambda stats: stats.seconds),
+            ("query_max_seconds", "gauge", "Slowest query.",
+             lambda stats: stats.max_seconds),
+        )
+        with self.lock:
+            items = sorted(self.by_table().items(), key=lambda item: tuple(
+                value or "" for value in item[0]))
+        duplicates = self.duplicate_count()
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for (alias, table, model, operation), stats in items:
+                lines.append(
+                    '%s_%s{database="%s",table="%s",model="%s",operation="%s"} %s' % (
+                        prefix, name, alias, table, model or "", operation,
+                        value(stats)))
+        lines.append("# HELP %s_duplicate_queries_total Identical queries run again." % prefix)
+        lines.append("# TYPE %s_duplicate_queries_total counter" % prefix)
+        lines.append("%s_duplicate_queries_total %d" % (prefix, duplicates))
+        return "\n".join(lines) + "\n"
+
+    def to_statsd(self, prefix="redmine"):
+        """statsd lines: counts as ``|c`` and total time as ``|ms``."""
+        lines = []
+        with self.lock:
+            items = sorted(self.stats.items())
+        for (alias, table, operation), stats in items:
+            name = "%s.%s.%s.%s" % (prefix, alias or "unknown", table or "unknown",
+                                    operation or "unknown")
+            lines.append("%s.queries:%d|c" % (name, stats.queries))
+            lines.append("%s.rows:%d|c" % (name, stats.rows))
+            lines.append("%s.time:%.3f|ms" % (name, stats.seconds * 1000))
+        return lines
+
+
+def redmine_aliases():
+    """``REDMINE_DATABASE`` followed by the ``REDMINE_READ_DATABASES``."""
+    aliases = [settings.REDMINE_DATABASE]
+    for alias in getattr(settings, "REDMINE_READ_DATABASES", ()):
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+@contextmanager
+def record_queries(using=None, recorder=None):
+    """Record the queries run on this thread's Redmine connections, the
+    primary and the read replicas unless ``using`` names an alias or a list
+    of aliases::
+
+        with record_queries() as recorder:
+            ...
+        print(recorder.to_prometheus())
+    """
+    if recorder is None:
+        recorder = QueryRecorder()
+    if using is None:
+        using = redmine_aliases()
+    elif isinstance(using, str):
+        using = [using]
+    with ExitStack() as stack:
+        for alias in using:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def process_recorder():
+    """Recorder accumulating the statistics of every instrumented request."""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = QueryRecorder()
+    return _recorder
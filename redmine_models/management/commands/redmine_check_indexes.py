@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from redmine_models import indexes
+
+
+class Command(BaseCommand):
+    help = ("Compare the indexes declared on the Redmine models and needed by "
+            "this app's queries with those of the live database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=None)
+        parser.add_argument("--fail", action="store_true",
+                            help="Exit with an error when anything is missing.")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        problems = 0
+        for model, columns in indexes.missing_declared(using):
+            problems += 1
+            self.stdout.write("Missing index on %s (%s)" % (
+                model._meta.db_table, ", ".join(columns)))
+        for pattern, suggestion in indexes.uncovered_patterns(using):
+            problems += 1
+            columns = list(pattern.equal) + ([pattern.range] if pattern.range else [])
+            line = "No index for %s on %s (%s)" % (
+                pattern.reason, indexes._model(pattern.model)._meta.db_table,
+                ", ".join(columns))
+            if suggestion is not None:
+                line += ": run redmine_create_indexes to add %s" % suggestion.name
+            self.stdout.write(line)
+        if not problems:
+            self.stdout.write("All expected indexes are present.")
+        elif options["fail"]:
+            raise CommandError("%d missing index(es)" % problems)
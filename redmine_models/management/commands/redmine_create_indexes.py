@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from redmine_models import indexes
+
+
+class Command(BaseCommand):
+    help = ("Create the supplementary indexes this app's queries need on the "
+            "Redmine database (concurrently on PostgreSQL).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=None)
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only list the indexes that would be created.")
+
+    def handle(self, *args, **options):
+        try:
+            created = indexes.create_supplementary_indexes(
+                options["database"], dry_run=options["dry_run"])
+        except NotSupportedError as e:
+            raise CommandError(str(e))
+        for model, index in created:
+            self.stdout.write("%s %s on %s (%s)" % (
+                "Would create" if options["dry_run"] else "Created", index.name,
+                model._meta.db_table, ", ".join(index.fields)))
+        if not created:
+            self.stdout.write("Nothing to create.")
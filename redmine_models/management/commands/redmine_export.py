@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from redmine_models import export
+
+
+class Command(BaseCommand):
+    help = "Export Redmine tables to Parquet (or CSV) files for analytics."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models", nargs="*", default=list(export.DEFAULT_MODELS),
+            help="Model names to export (default: %s)." % ", ".join(export.DEFAULT_MODELS))
+        parser.add_argument("--output-dir", default=".")
+        parser.add_argument("--format", choices=("parquet", "csv"), default="parquet",
+                            help="Falls back to csv when pyarrow is not installed.")
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--row-group-size", type=int, default=100000)
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Export that many tables in parallel processes.")
+        parser.add_argument("--database", default=None)
+
+    def handle(self, *args, **options):
+        file_format = options["format"]
+        if file_format == "parquet" and export.pyarrow is None:
+            self.stderr.write("pyarrow is not installed, writing CSV instead.")
+            file_format = "csv"
+        if not os.path.isdir(options["output_dir"]):
+            raise CommandError("%s is not a directory" % options["output_dir"])
+        results = export.export_models(
+            options["models"],
+            options["output_dir"],
+            workers=options["workers"],
+            file_format=file_format,
+            batch_size=options["batch_size"],
+            row_group_size=options["row_group_size"],
+            using=options["database"] or settings.REDMINE_DATABASE,
+        )
+        for path, count in results:
+            self.stdout.write("%s: %d rows" % (path, count))
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import itertools
+
+from django.db import models
+from django.db.models import F, Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.query import ModelIterable, ValuesIterable
+
+from .custom_fields import load_custom_values
+from .fields import prefetch_polymorphic
+
+ISSUE_RELATED = ("tracker", "project", "status", "priority", "assigned_to",
+                 "author", "fixed_version", "category")
+
+
+class RedmineQuerySet(models.QuerySet):
+
+    def __init__(self, *args, **kwargs):
+        super(RedmineQuerySet, self).__init__(*args, **kwargs)
+        self._polymorphic_lookups = ()
+        self._custom_field_lookup = None
+        self._prefilled = False
+
+    def _clone(self):
+        clone = super(RedmineQuerySet, self)._clone()
+        clone._polymorphic_lookups = self._polymorphic_lookups
+        clone._custom_field_lookup = self._custom_field_lookup
+        return clone
+
+    def all(self):
+        clone = super(RedmineQuerySet, self).all()
+        if self._prefilled:
+            # keep rows filled in by prefetch_polymorphic(), like related
+            # managers do with prefetch_related()
+            clone._result_cache = self._result_cache
+            clone._prefetch_done = True
+            clone._prefilled = True
+        return clone
+
+    def prefetch_polymorphic(self, *lookups):
+        """Like ``prefetch_related()`` for Redmine's ``*_type``/``*_id``
+        relations, e.g. ``Issue.objects.prefetch_polymorphic("journals")``.
+
+        ``prefetch_polymorphic(None)`` clears the lookups.
+        """
+        clone = self._chain()
+        if lookups == (None,):
+            clone._polymorphic_lookups = ()
+        else:
+            clone._polymorphic_lookups = self._polymorphic_lookups + lookups
+        return clone
+
+    def with_custom_fields(self, fields=None):
+        """Set a ``custom_field_values`` dict on every loaded row, holding the
+        typed value of each custom field (ids or names, all when None).
+
+        Values are loaded with one side query for the whole result.
+        """
+        clone = self._chain()
+        clone._custom_field_lookup = (fields,)
+        return clone
+
+    def stream(self, batch_size=1000, order_by="id"):
+        """Iterate lazily over the whole queryset with flat memory use.
+
+        Pages with ``WHERE (<order_by>, id) > (<last values>) LIMIT
+        batch_size`` instead of a server-side cursor, so it works behind
+        transaction-pooling proxies.  ``order_by`` names a column, optionally
+        prefixed with "-"; ties are broken by primary key and rows where it
+        is NULL come last.  Yields instances, or dicts after ``values()``;
+        ``only()`` and ``defer()`` prune columns as usual.
+        """
+        if self.query.is_sliced:
+            raise TypeError("Cannot stream a sliced queryset.")
+        if self._iterable_class not in (ModelIterable, ValuesIterable):
+            raise TypeError("stream() yields model instances or values() dicts.")
+        descending = order_by.startswith("-")
+        field = order_by.lstrip("-")
+        pk = self.model._meta.pk.name
+        if field in ("pk", pk):
+            return self._keyset(batch_size, (pk,), descending)
+        pages = [self.filter(**{field + "__isnull": False})
+                 ._keyset(batch_size, (field, pk), descending)]
+        if self.model._meta.get_field(field).null:
+            pages.append(self.filter(**{field + "__isnull": True})
+                         ._keyset(batch_size, (pk,), descending))
+        return itertools.chain.from_iterable(pages)
+
+    def _keyset(self, batch_size, keys, descending):
+        qs = self.order_by(*[("-" if descending else "") + key for key in keys])
+        strip = []
+        if self._iterable_class is ModelIterable:
+            names, defer = self.query.deferred_loading
+            if not defer and names and not set(keys) <= names:
+                qs = qs.only(*names | set(keys))
+            elif defer and names & set(keys):
+                qs = qs.defer(None).defer(*names - set(keys))
+            attnames = [self.model._meta.get_field(key).attname for key in keys]
+
+            def key(row):
+                return [getattr(row, attname) for attname in attnames]
+        else:
+            if self._fields:
+                strip = [key for key in keys if key not in self._fields]
+                if strip:
+                    qs = qs.values(*self._fields + tuple(strip))
+
+            def key(row):
+                return [row[name] for name in keys]
+        op = "__lt" if descending else "__gt"
+        page = qs
+        while True:
+            rows = list(page[:batch_size])
+            for row in rows:
+                last = key(row)
+                for name in strip:
+                    del row[name]
+                yield row
+            if len(rows) < batch_size:
+                return
+            after = Q(**{keys[-1] + op: last[-1]})
+            if len(keys) == 2:
+                after = Q(**{keys[0] + op: last[0]}) | (Q(**{keys[0]: last[0]}) & after)
+            page = qs.filter(after)
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(RedmineQuerySet, self)._fetch_all()
+        if not fetched and self._iterable_class is ModelIterable:
+            self._after_fetch(self._result_cache)
+
+    def _after_fetch(self, instances):
+        if self._polymorphic_lookups:
+            prefetch_polymorphic(instances, *self._polymorphic_lookups)
+        if self._custom_field_lookup is not None:
+            load_custom_values(instances, *self._custom_field_lookup)
+
+
+class NestedSetQuerySet(RedmineQuerySet):
+    """Tree queries resolved with a single range scan on Redmine's
+    ``lft``/``rgt`` nested-set columns instead of walking ``parent``.
+
+    Subclasses scoping several trees in one table (issues are numbered per
+    ``root``) set ``tree_scope`` to the name of the scoping column.
+    """
+
+    tree_scope = None
+
+    def _scope(self, node):
+        if self.tree_scope is None:
+            return {}
+        return {self.tree_scope: getattr(node, self.tree_scope)}
+
+    def descendants(self, node, include_self=False):
+        if include_self:
+            bounds = {"lft__gte": node.lft, "rgt__lte": node.rgt}
+        else:
+            bounds = {"lft__gt": node.lft, "rgt__lt": node.rgt}
+        return self.filter(**dict(bounds, **self._scope(node))).order_by("lft")
+
+    def ancestors(self, node, include_self=False):
+        if include_self:
+            bounds = {"lft__lte": node.lft, "rgt__gte": node.rgt}
+        else:
+            bounds = {"lft__lt": node.lft, "rgt__gt": node.rgt}
+        return self.filter(**dict(bounds, **self._scope(node))).order_by("lft")
+
+    def with_depth(self):
+        """Annotate each row with ``depth``, 0 for tree roots."""
+        outer = Q(lft__lt=OuterRef("lft"), rgt__gt=OuterRef("rgt"))
+        if self.tree_scope is not None:
+            outer &= Q(**{self.tree_scope: OuterRef(self.tree_scope)})
+        count = (
+            self.model._base_manager.filter(outer)
+            .order_by()
+            .annotate(n=Func(F("pk"), function="COUNT"))
+            .values("n")
+        )
+        return self.annotate(depth=Subquery(count, output_field=IntegerField()))
+
+    def subtree_of(self, node, include_self=True):
+        """Load the subtree under ``node`` in one query and return its root.
+
+        Every loaded instance gets a ``tree_children`` list and a ``depth``
+        relative to ``node``.  With ``include_self=False`` the list of the
+        top-level children is returned instead.
+        """
+        nodes = list(self.descendants(node, include_self=True))
+        if not any(n.pk == node.pk for n in nodes):
+            nodes.insert(0, node)
+        roots = build_tree(nodes)
+        root = next(n for n in roots if n.pk == node.pk)
+        if include_self:
+            return root
+        return root.tree_children
+
+
+def build_tree(nodes):
+    """Link ``lft``-ordered nested-set rows into ``tree_children`` lists.
+
+    Returns the top-level nodes.  Uses a stack over ``rgt`` so ``parent_id``
+    is never consulted and no extra query is issued.
+    """
+    roots = []
+    stack = []
+    for node in sorted(nodes, key=lambda n: n.lft):
+        node.tree_children = []
+        while stack and stack[-1].rgt < node.lft:
+            stack.pop()
+        if stack:
+            stack[-1].tree_children.append(node)
+        else:
+            roots.append(node)
+        node.depth = len(stack)
+        stack.append(node)
+    return roots
+
+
+class ProjectQuerySet(NestedSetQuerySet):
+    pass
+
+
+class IssueQuerySet(NestedSetQuerySet):
+    tree_scope = "root_id"
+
+    def visible_to(self, user):
+        """Issues ``user`` may see, by Redmine's rules, filtered in SQL.
+
+        ``user`` is a ``User``, a user id, or None for the anonymous user.
+        """
+        from .permissions import issue_visibility
+
+        return self.filter(issue_visibility(user, using=self.db))
+
+    def for_list(self):
+        """Columns and relations shown by Redmine's issue list, in one query."""
+        return self.select_related(*ISSUE_RELATED).only(
+            "id", "tracker_id", "project_id", "subject", "status_id",
+            "priority_id", "assigned_to_id", "author_id", "fixed_version_id",
+            "category_id", "parent_id", "start_date", "due_date", "done_ratio",
+            "estimated_hours", "is_private", "created_on", "updated_on",
+            "closed_on", "tracker__name", "project__name", "project__identifier",
+            "status__name", "status__is_closed", "priority__name",
+            "assigned_to__login", "assigned_to__firstname",
+            "assigned_to__lastname", "assigned_to__type", "author__login",
+            "author__firstname", "author__lastname", "fixed_version__name",
+            "category__name")
+
+    def for_detail(self):
+        """Everything the issue page shows: related rows, subtasks,
+        relations, journals, attachments, watchers and custom values."""
+        return (self.select_related("parent", *ISSUE_RELATED)
+                .prefetch_related("children", "related_to", "related_from")
+                .prefetch_polymorphic("journals", "attachments", "watchers",
+                                      "custom_values"))
+
+    def for_export(self):
+        """All columns, related rows and typed custom field values."""
+        return self.select_related(*ISSUE_RELATED).with_custom_fields()
+
+
+class TimeEntryQuerySet(RedmineQuerySet):
+
+    def for_list(self):
+        return self.select_related(
+            "project", "user", "activity", "issue", "issue__tracker").only(
+            "id", "project_id", "user_id", "activity_id", "issue_id", "hours",
+            "comments", "spent_on", "project__name", "project__identifier",
+            "user__login", "user__firstname", "user__lastname",
+            "activity__name", "issue__subject", "issue__tracker_id",
+            "issue__tracker__name")
+
+    def for_detail(self):
+        return (self.select_related("project", "user", "author", "activity",
+                                    "issue", "issue__tracker")
+                .prefetch_polymorphic("custom_values"))
+
+    def for_export(self):
+        return (self.select_related("project", "user", "author", "activity",
+                                    "issue", "issue__tracker")
+                .with_custom_fields())
+
+
+class JournalQuerySet(RedmineQuerySet):
+
+    def for_list(self):
+        return self.select_related("user").prefetch_related("journaldetail_set")
+
+    def for_detail(self):
+        return self.for_list().prefetch_polymorphic("journalized")
+
+    def for_export(self):
+        return self.for_list()
+
+
+class ChangesetQuerySet(RedmineQuerySet):
+
+    def for_list(self):
+        return self.select_related("repository", "user")
+
+    def for_detail(self):
+        from .models import ChangesetsIssue
+
+        return (self.select_related("repository", "repository__project", "user")
+                .prefetch_related("change_set", models.Prefetch(
+                    "changesetsissue_set",
+                    ChangesetsIssue.objects.select_related(
+                        "issue", "issue__tracker", "issue__status"))))
+
+    def for_export(self):
+        return self.select_related("repository", "user")
+
+
+RedmineManager = models.Manager.from_queryset(RedmineQuerySet)
+ProjectManager = models.Manager.from_queryset(ProjectQuerySet)
+IssueManager = models.Manager.from_queryset(IssueQuerySet)
+TimeEntryManager = models.Manager.from_queryset(TimeEntryQuerySet)
+JournalManager = models.Manager.from_queryset(JournalQuerySet)
+ChangesetManager = models.Manager.from_queryset(ChangesetQuerySet)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .instrumentation import process_recorder, record_queries
+from .routers import unpin
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaPinningMiddleware(object):
+    """Scope the router's sticky-primary-after-write to a single request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unpin()
+        try:
+            return self.get_response(request)
+        finally:
+            unpin()
+
+
+class QueryInstrumentationMiddleware(object):
+    """Record the Redmine queries of each request, on the primary and the
+    read replicas, when ``REDMINE_QUERY_INSTRUMENTATION`` is set.
+
+    The request's recorder is available as ``request.redmine_queries`` and
+    its counters are added to ``process_recorder()`` afterwards.  Repeated
+    statements are logged as N+1 candidates.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REDMINE_QUERY_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            request.redmine_queries = recorder
+            response = self.get_response(request)
+        for sql, count in recorder.repeated():
+            logger.warning("Query ran %d times during %s: %s",
+                           count, request.path, sql)
+        process_recorder().merge(recorder)
+        return response
@@ -5,6 +5,11 @@ from __future__ import unicode_literals
 from django.db import models
 from django.conf import settings
 
+from .cache import TableCache
+from .fields import RedmineGenericForeignKey, RedmineGenericRelation
+from .managers import (ChangesetManager, IssueManager, JournalManager,
+                       ProjectManager, RedmineManager, TimeEntryManager)
+
 redmine_models_managed = getattr(settings, 'REDMINE_MODELS_MANAGED', False)
 
 
@@ -22,9 +27,17 @@ class Attachment(models.Model):
     description = models.CharField(max_length=1024, blank=True, null=True)
     disk_directory = models.CharField(max_length=1024, blank=True, null=True)
 
+    objects = RedmineManager()
+    container = RedmineGenericForeignKey("container_type", "container_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "attachments"
+        indexes = [
+            models.Index(fields=["container_id", "container_type"], name="attachments_container"),
+            models.Index(fields=["created_on"], name="attachments_created_on"),
+            models.Index(fields=["disk_filename"], name="attachments_disk_filename"),
+        ]
 
 
 class AuthSource(models.Model):
@@ -44,6 +57,8 @@ class AuthSource(models.Model):
     filter = models.TextField(blank=True, null=True)
     timeout = models.IntegerField(blank=True, null=True)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "auth_sources"
@@ -65,6 +80,9 @@ class Board(models.Model):
     )
     parent = models.ForeignKey("Board", blank=True, null=True, on_delete=models.RESTRICT)
 
+    objects = RedmineManager()
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "boards"
@@ -79,6 +97,8 @@ class Change(models.Model):
     revision = models.CharField(max_length=1024, blank=True, null=True)
     branch = models.CharField(max_length=1024, blank=True, null=True)
 
+    objects = RedmineManager()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "changes"
@@ -91,6 +111,9 @@ class ChangesetParent(models.Model):
     class Meta:
         managed = redmine_models_managed
         db_table = "changeset_parents"
+        indexes = [
+            models.Index(fields=["parent"], name="changeset_parents_parent_ids"),
+        ]
 
 
 class Changeset(models.Model):
@@ -103,10 +126,16 @@ class Changeset(models.Model):
     scmid = models.CharField(max_length=1024, blank=True, null=True)
     user = models.ForeignKey("User", blank=True, null=True, on_delete=models.RESTRICT)
 
+    objects = ChangesetManager()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "changesets"
         unique_together = (("repository", "revision"),)
+        indexes = [
+            models.Index(fields=["repository", "scmid"], name="changesets_repos_scmid"),
+            models.Index(fields=["committed_on"], name="changesets_committed_on"),
+        ]
 
 
 class ChangesetsIssue(models.Model):
@@ -141,9 +170,15 @@ class Comment(models.Model):
     created_on = models.DateTimeField()
     updated_on = models.DateTimeField()
 
+    objects = RedmineManager()
+    commented = RedmineGenericForeignKey("commented_type", "commented_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "comments"
+        indexes = [
+            models.Index(fields=["commented_id", "commented_type"], name="comments_commented"),
+        ]
 
 
 class CustomFieldEnumeration(models.Model):
@@ -209,6 +244,8 @@ class CustomField(models.Model):
     format_store = models.TextField(blank=True, null=True)
     description = models.TextField(blank=True, null=True)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "custom_fields"
@@ -250,9 +287,15 @@ class CustomValue(models.Model):
     custom_field = models.ForeignKey(CustomField, on_delete=models.RESTRICT)
     value = models.TextField(blank=True, null=True)
 
+    objects = RedmineManager()
+    customized = RedmineGenericForeignKey("customized_type", "customized_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "custom_values"
+        indexes = [
+            models.Index(fields=["customized_type", "customized_id"], name="custom_values_customized"),
+        ]
 
 
 class Document(models.Model):
@@ -262,9 +305,15 @@ class Document(models.Model):
     description = models.TextField(blank=True, null=True)
     created_on = models.DateTimeField(blank=True, null=True)
 
+    objects = RedmineManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "documents"
+        indexes = [
+            models.Index(fields=["created_on"], name="documents_created_on"),
+        ]
 
 
 class EmailAddress(models.Model):
@@ -308,6 +357,10 @@ class Enumeration(models.Model):
     parent = models.ForeignKey("Enumeration", blank=True, null=True, on_delete=models.RESTRICT)
     position_name = models.CharField(max_length=30, blank=True, null=True)
 
+    objects = RedmineManager()
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id")
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "enumerations"
@@ -379,9 +432,15 @@ class IssueStatus(models.Model):
     position = models.IntegerField(blank=True, null=True)
     default_done_ratio = models.IntegerField(blank=True, null=True)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "issue_statuses"
+        indexes = [
+            models.Index(fields=["position"], name="issue_statuses_position"),
+            models.Index(fields=["is_closed"], name="issue_statuses_is_closed"),
+        ]
 
 
 class Issue(models.Model):
@@ -423,9 +482,19 @@ class Issue(models.Model):
     is_private = models.BooleanField()
     closed_on = models.DateTimeField(blank=True, null=True)
 
+    objects = IssueManager()
+    journals = RedmineGenericRelation("Journal", "journalized_type", "journalized_id")
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id")
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "issues"
+        indexes = [
+            models.Index(fields=["root", "lft", "rgt"], name="issues_root_lft_rgt"),
+            models.Index(fields=["created_on"], name="issues_created_on"),
+        ]
 
 
 class JournalDetail(models.Model):
@@ -435,6 +504,8 @@ class JournalDetail(models.Model):
     old_value = models.TextField(blank=True, null=True)
     value = models.TextField(blank=True, null=True)
 
+    objects = RedmineManager()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "journal_details"
@@ -448,9 +519,16 @@ class Journal(models.Model):
     created_on = models.DateTimeField()
     private_notes = models.BooleanField()
 
+    objects = JournalManager()
+    journalized = RedmineGenericForeignKey("journalized_type", "journalized_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "journals"
+        indexes = [
+            models.Index(fields=["journalized_id", "journalized_type"], name="journals_journalized_id"),
+            models.Index(fields=["created_on"], name="journals_created_on"),
+        ]
 
 
 class MemberRole(models.Model):
@@ -461,6 +539,9 @@ class MemberRole(models.Model):
     class Meta:
         managed = redmine_models_managed
         db_table = "member_roles"
+        indexes = [
+            models.Index(fields=["inherited_from"], name="member_roles_inherited_from"),
+        ]
 
 
 class Member(models.Model):
@@ -494,9 +575,16 @@ class Message(models.Model):
     locked = models.BooleanField(null=True, blank=True)
     sticky = models.IntegerField(blank=True, null=True)
 
+    objects = RedmineManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "messages"
+        indexes = [
+            models.Index(fields=["created_on"], name="messages_created_on"),
+        ]
 
 
 class News(models.Model):
@@ -508,9 +596,17 @@ class News(models.Model):
     created_on = models.DateTimeField(blank=True, null=True)
     comments_count = models.IntegerField()
 
+    objects = RedmineManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+    comments = RedmineGenericRelation("Comment", "commented_type", "commented_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "news"
+        indexes = [
+            models.Index(fields=["created_on"], name="news_created_on"),
+        ]
 
 
 class OpenIdAuthenticationAssociation(models.Model):
@@ -567,9 +663,17 @@ class Project(models.Model):
         null=True,
     )
 
+    objects = ProjectManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "projects"
+        indexes = [
+            models.Index(fields=["lft"], name="projects_lft"),
+            models.Index(fields=["rgt"], name="projects_rgt"),
+        ]
 
 
 class ProjectTracker(models.Model):
@@ -640,6 +744,8 @@ class Role(models.Model):
     all_roles_managed = models.BooleanField()
     settings = models.TextField(blank=True, null=True)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "roles"
@@ -669,9 +775,14 @@ class Setting(models.Model):
     value = models.TextField(blank=True, null=True)
     updated_on = models.DateTimeField(blank=True, null=True)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "settings"
+        indexes = [
+            models.Index(fields=["name"], name="settings_name"),
+        ]
 
 
 class TimeEntry(models.Model):
@@ -694,9 +805,15 @@ class TimeEntry(models.Model):
     created_on = models.DateTimeField()
     updated_on = models.DateTimeField()
 
+    objects = TimeEntryManager()
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "time_entries"
+        indexes = [
+            models.Index(fields=["created_on"], name="time_entries_created_on"),
+        ]
 
 
 class Token(models.Model):
@@ -709,6 +826,9 @@ class Token(models.Model):
     class Meta:
         managed = redmine_models_managed
         db_table = "tokens"
+        indexes = [
+            models.Index(fields=["value"], name="tokens_value"),
+        ]
 
 
 class Tracker(models.Model):
@@ -721,6 +841,8 @@ class Tracker(models.Model):
     default_status = models.ForeignKey(IssueStatus, blank=True, null=True,
             on_delete=models.RESTRICT)
 
+    cached = TableCache()
+
     class Meta:
         managed = redmine_models_managed
         db_table = "trackers"
@@ -757,9 +879,16 @@ class User(models.Model):
     must_change_passwd = models.BooleanField()
     passwd_changed_on = models.DateTimeField(blank=True, null=True)
 
+    objects = RedmineManager()
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id", type_name="Principal")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "users"
+        indexes = [
+            models.Index(fields=["id", "type"], name="users_id_type"),
+            models.Index(fields=["type"], name="users_type"),
+        ]
 
 
 class Version(models.Model):
@@ -773,9 +902,16 @@ class Version(models.Model):
     status = models.CharField(max_length=1024, blank=True, null=True)
     sharing = models.CharField(max_length=1024)
 
+    objects = RedmineManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    custom_values = RedmineGenericRelation("CustomValue", "customized_type", "customized_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "versions"
+        indexes = [
+            models.Index(fields=["sharing"], name="versions_sharing"),
+        ]
 
 
 class Watcher(models.Model):
@@ -783,9 +919,16 @@ class Watcher(models.Model):
     watchable_id = models.IntegerField()
     user = models.ForeignKey(User, blank=True, null=True, on_delete=models.RESTRICT)
 
+    objects = RedmineManager()
+    watchable = RedmineGenericForeignKey("watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "watchers"
+        indexes = [
+            models.Index(fields=["user", "watchable_type"], name="watchers_user_id_type"),
+            models.Index(fields=["watchable_id", "watchable_type"], name="watchers_watchable"),
+        ]
 
 
 class WikiContentVersion(models.Model):
@@ -801,6 +944,9 @@ class WikiContentVersion(models.Model):
     class Meta:
         managed = redmine_models_managed
         db_table = "wiki_content_versions"
+        indexes = [
+            models.Index(fields=["updated_on"], name="wiki_content_versions_updated"),
+        ]
 
 
 class WikiContent(models.Model):
@@ -823,9 +969,16 @@ class WikiPage(models.Model):
     protected = models.BooleanField()
     parent = models.ForeignKey("WikiPage", blank=True, null=True, on_delete=models.RESTRICT)
 
+    objects = RedmineManager()
+    attachments = RedmineGenericRelation("Attachment", "container_type", "container_id")
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "wiki_pages"
+        indexes = [
+            models.Index(fields=["wiki", "title"], name="wiki_pages_wiki_id_title"),
+        ]
 
 
 class WikiRedirect(models.Model):
@@ -842,6 +995,9 @@ class WikiRedirect(models.Model):
     class Meta:
         managed = redmine_models_managed
         db_table = "wiki_redirects"
+        indexes = [
+            models.Index(fields=["wiki", "title"], name="wiki_redirects_wiki_id_title"),
+        ]
 
 
 class Wiki(models.Model):
@@ -849,6 +1005,9 @@ class Wiki(models.Model):
     start_page = models.CharField(max_length=255)
     status = models.IntegerField()
 
+    objects = RedmineManager()
+    watchers = RedmineGenericRelation("Watcher", "watchable_type", "watchable_id")
+
     class Meta:
         managed = redmine_models_managed
         db_table = "wikis"
@@ -873,6 +1032,34 @@ class Workflow(models.Model):
     field_name = models.CharField(max_length=30, blank=True, null=True)
     rule = models.CharField(max_length=30, blank=True, null=True)
 
+    cached = TableCache(index_by=None)
+
     class Meta:
         managed = redmine_models_managed
         db_table = "workflows"
+        indexes = [
+            models.Index(fields=["role", "tracker", "old_status"], name="wkfs_role_tracker_old_status"),
+        ]
+
+
+class TimeEntryRollup(models.Model):
+    """Weekly time totals maintained by ``redmine_models.reports``.
+
+    Not part of Redmine's schema: the table is owned by this app and created
+    by ``migrate --run-syncdb`` or ``reports.ensure_rollup_table()``.
+    """
+    project = models.ForeignKey(Project, related_name="+", db_constraint=False,
+            on_delete=models.DO_NOTHING)
+    user = models.ForeignKey(User, related_name="+", db_constraint=False,
+            on_delete=models.DO_NOTHING)
+    activity = models.ForeignKey(Enumeration, related_name="+", db_constraint=False,
+            on_delete=models.DO_NOTHING)
+    tyear = models.IntegerField()
+    tweek = models.IntegerField()
+    hours = models.FloatField()
+    entries = models.IntegerField()
+    last_updated_on = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = "redmine_models_time_entry_rollups"
+        unique_together = (("project", "user", "activity", "tyear", "tweek"),)
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.db.models.signals import post_delete, post_save
+
+from .serialization import load_yaml, symbol_name
+
+# Project.status
+PROJECT_ACTIVE = 1
+PROJECT_CLOSED = 5
+PROJECT_ARCHIVED = 9
+PROJECT_SCHEDULED_FOR_DELETION = 10
+
+# Role.builtin
+BUILTIN_NON_MEMBER = 1
+BUILTIN_ANONYMOUS = 2
+
+# Permissions of Redmine's core project modules
+MODULE_PERMISSIONS = {
+    "issue_tracking": (
+        "view_issues", "add_issues", "edit_issues", "edit_own_issues",
+        "copy_issues", "manage_issue_relations", "manage_subtasks",
+        "set_issues_private", "set_own_issues_private", "add_issue_notes",
+        "edit_issue_notes", "edit_own_issue_notes", "view_private_notes",
+        "set_notes_private", "delete_issues", "view_issue_watchers",
+        "add_issue_watchers", "delete_issue_watchers", "import_issues",
+        "manage_categories", "manage_public_queries", "save_queries",
+    ),
+    "time_tracking": (
+        "view_time_entries", "log_time", "edit_time_entries",
+        "edit_own_time_entries", "manage_project_activities",
+        "log_time_for_other_users", "import_time_entries",
+    ),
+    "news": ("view_news", "manage_news", "comment_news"),
+    "documents": (
+        "view_documents", "add_documents", "edit_documents", "delete_documents",
+    ),
+    "files": ("view_files", "manage_files"),
+    "wiki": (
+        "view_wiki_pages", "view_wiki_edits", "export_wiki_pages",
+        "edit_wiki_pages", "rename_wiki_pages", "delete_wiki_pages",
+        "delete_wiki_pages_attachments", "view_wiki_page_watchers",
+        "add_wiki_page_watchers", "delete_wiki_page_watchers",
+        "protect_wiki_pages", "manage_wiki",
+    ),
+    "repository": (
+        "view_changesets", "browse_repository", "commit_access",
+        "manage_related_issues", "manage_repository",
+    ),
+    "boards": (
+        "view_messages", "add_messages", "edit_messages", "edit_own_messages",
+        "delete_messages", "delete_own_messages", "view_message_watchers",
+        "add_message_watchers", "delete_message_watchers", "manage_boards",
+    ),
+    "calendar": ("view_calendar",),
+    "gantt": ("view_gantt",),
+}
+PERMISSION_MODULES = dict(
+    (permission, module)
+    for module, permissions in MODULE_PERMISSIONS.items()
+    for permission in permissions
+)
+
+# Granted to everyone who can see the project
+PUBLIC_PERMISSIONS = frozenset(["view_project", "search_project"])
+
+# The only permissions kept on closed projects
+READ_PERMISSIONS = frozenset([
+    "view_project", "search_project", "view_members", "view_issues",
+    "view_issue_watchers", "view_private_notes", "view_time_entries",
+    "view_news", "view_documents", "view_files", "view_wiki_pages",
+    "view_wiki_edits", "export_wiki_pages", "view_wiki_page_watchers",
+    "view_changesets", "browse_repository", "view_messages",
+    "view_message_watchers", "view_calendar", "view_gantt",
+])
+
+EMPTY = frozenset()
+
+ALWAYS = Q(pk__isnull=False)
+NEVER = Q(pk__in=[])
+
+
+def role_permissions(role):
+    """Decode the YAML list of symbols in ``Role.permissions``."""
+    return frozenset(symbol_name(p) for p in load_yaml(role.permissions) or ())
+
+
+def _pk(obj):
+    return getattr(obj, "pk", obj)
+
+
+class PermissionIndex(object):
+    """In-memory answer to "may user X do P on project Y".
+
+    Built in bulk from projects, enabled modules, roles, memberships and group
+    memberships (a handful of queries for the whole database).  Roles reach a
+    user through their own memberships, their groups' memberships and, for
+    projects with ``inherit_members``, the memberships of parent projects.
+    Lookups are dict accesses.
+
+    Membership rows saved through Django refresh the affected users
+    automatically; :meth:`sync` catches up with changes made by Redmine itself.
+    """
+
+    def __init__(self, using=None):
+        self.using = using or settings.REDMINE_DATABASE
+        self._lock = threading.RLock()
+        self.build()
+        _indexes.add(self)
+
+    def _signature(self):
+        from .models import GroupUser, Member, MemberRole
+
+        return (
+            Member.objects.using(self.using).aggregate(n=Count("pk"), last=Max("pk")),
+            MemberRole.objects.using(self.using).aggregate(n=Count("pk"), last=Max("pk")),
+            GroupUser.objects.using(self.using).aggregate(n=Count("pk")),
+        )
+
+    def build(self):
+        from .models import EnabledModule, GroupUser, Project, Role, User
+
+        with self._lock:
+            self._signature_state = self._signature()
+            self._role_generation = Role.cached.generation(self.using)
+            self.role_permissions = dict(
+                (role.pk, role_permissions(role)) for role in Role.cached.all(self.using))
+            self.builtin_roles = dict(
+                (role.builtin, role.pk) for role in Role.cached.all(self.using)
+                if role.builtin)
+            self.projects = {}
+            self.inheriting = []
+            rows = (Project.objects.using(self.using).order_by("lft")
+                    .values_list("id", "parent_id", "is_public", "status",
+                                 "inherit_members"))
+            for pk, parent_id, is_public, status, inherit_members in rows:
+                self.projects[pk] = (parent_id, is_public, status)
+                if inherit_members and parent_id is not None:
+                    self.inheriting.append(pk)
+            self.modules = defaultdict(set)
+            for project_id, name in (EnabledModule.objects.using(self.using)
+                                     .values_list("project_id", "name")):
+                self.modules[project_id].add(name)
+            self.admins = set(User.objects.using(self.using)
+                              .filter(admin=True).values_list("pk", flat=True))
+            self.builtin_groups = dict(
+                User.objects.using(self.using)
+                .filter(type__in=("GroupNonMember", "GroupAnonymous"))
+                .values_list("type", "pk"))
+            self.groups = defaultdict(set)
+            self.group_members = defaultdict(set)
+            for user_id, group_id in (GroupUser.objects.using(self.using)
+                                      .values_list("user_id", "group_id")):
+                self.groups[user_id].add(group_id)
+                self.group_members[group_id].add(user_id)
+            self.memberships = defaultdict(lambda: defaultdict(set))
+            self._load_memberships(None)
+            self._interned = {}
+            self.non_member = self._builtin_permissions(
+                "GroupNonMember", BUILTIN_NON_MEMBER)
+            self.anonymous = self._builtin_permissions(
+                "GroupAnonymous", BUILTIN_ANONYMOUS)
+            self._users = {}
+
+    def _load_memberships(self, principals):
+        from .models import MemberRole
+
+        self._last_member_role = (MemberRole.objects.using(self.using)
+                                  .aggregate(last=Max("pk"))["last"])
+        rows = MemberRole.objects.using(self.using)
+        if principals is not None:
+            rows = rows.filter(member__user_id__in=principals)
+            for principal in principals:
+                self.memberships.pop(principal, None)
+        rows = rows.values_list("member__user_id", "member__project_id", "role_id")
+        for principal, project_id, role_id in rows:
+            self.memberships[principal][project_id].add(role_id)
+
+    def _intern(self, permissions):
+        return self._interned.setdefault(permissions, permissions)
+
+    def _visible(self, project_id):
+        project = self.projects.get(project_id)
+        return project is not None and project[2] not in (
+            PROJECT_ARCHIVED, PROJECT_SCHEDULED_FOR_DELETION)
+
+    def _permits(self, project_id, permission):
+        """Whether ``project_id`` allows ``permission`` at all: not archived,
+        module enabled and, on closed projects, read-only."""
+        if not self._visible(project_id):
+            return False
+        module = PERMISSION_MODULES.get(permission)
+        if module is not None and module not in self.modules.get(project_id, ()):
+            return False
+        return (self.projects[project_id][2] != PROJECT_CLOSED
+                or permission in READ_PERMISSIONS)
+
+    def _effective(self, project_id, role_ids):
+        granted = set(PUBLIC_PERMISSIONS)
+        for role_id in role_ids:
+            granted.update(self.role_permissions.get(role_id, ()))
+        return self._intern(frozenset(
+            p for p in granted if self._permits(project_id, p)))
+
+    def _builtin_permissions(self, group_type, builtin):
+        overrides = self.memberships.get(self.builtin_groups.get(group_type), {})
+        default = self.builtin_roles.get(builtin)
+        permissions = {}
+        for project_id, (parent_id, is_public, status) in self.projects.items():
+            if is_public and self._visible(project_id):
+                role_ids = overrides.get(project_id) or ([default] if default else [])
+                permissions[project_id] = self._effective(project_id, role_ids)
+        return permissions
+
+    def roles(self, user, project):
+        """Return the ids of the roles ``user`` has on ``project``."""
+        user_id, project_id = _pk(user), _pk(project)
+        if user_id is None:
+            role_id = self.builtin_roles.get(BUILTIN_ANONYMOUS)
+            return frozenset([role_id]) if role_id else EMPTY
+        roles = self._user(user_id)[1].get(project_id)
+        if roles:
+            return roles
+        if self._visible(project_id) and self.projects[project_id][1]:
+            overrides = self.memberships.get(self.builtin_groups.get("GroupNonMember"), {})
+            role_id = self.builtin_roles.get(BUILTIN_NON_MEMBER)
+            return frozenset(overrides.get(project_id) or ([role_id] if role_id else []))
+        return EMPTY
+
+    def _user(self, user_id):
+        cached = self._users.get(user_id)
+        if cached is not None:
+            return cached
+        with self._lock:
+            roles = defaultdict(set)
+            for principal in [user_id] + sorted(self.groups.get(user_id, ())):
+                for project_id, role_ids in self.memberships.get(principal, {}).items():
+                    roles[project_id] |= role_ids
+            if roles:
+                for project_id in self.inheriting:
+                    parent_roles = roles.get(self.projects[project_id][0])
+                    if parent_roles:
+                        roles[project_id] |= parent_roles
+            permissions = {}
+            frozen_roles = {}
+            for project_id, role_ids in roles.items():
+                if role_ids and self._visible(project_id):
+                    permissions[project_id] = self._effective(project_id, role_ids)
+                    frozen_roles[project_id] = frozenset(role_ids)
+            cached = self._users[user_id] = (permissions, frozen_roles)
+        return cached
+
+    def permissions(self, user, project):
+        user_id, project_id = _pk(user), _pk(project)
+        if user_id is None:
+            return self.anonymous.get(project_id, EMPTY)
+        if user_id in self.admins:
+            return self._effective(project_id, self.role_permissions)
+        granted = self._user(user_id)[0].get(project_id)
+        if granted is None:
+            granted = self.non_member.get(project_id, EMPTY)
+        return granted
+
+    def allowed(self, user, permission, project):
+        """``user`` may be None (anonymous), a ``User`` or an id."""
+        if _pk(user) in self.admins:
+            return self._permits(_pk(project), permission)
+        return permission in self.permissions(user, project)
+
+    def visible_projects(self, user):
+        """Return the ids of the projects ``user`` can see."""
+        user_id = _pk(user)
+        if user_id is None:
+            return frozenset(self.anonymous)
+        if user_id in self.admins:
+            return frozenset(pk for pk in self.projects if self._visible(pk))
+        return frozenset(self.non_member) | frozenset(self._user(user_id)[0])
+
+    def refresh(self, principals):
+        """Reload the memberships of the given users or groups."""
+        principals = set(_pk(p) for p in principals)
+        with self._lock:
+            self._load_memberships(principals)
+            for principal in principals:
+                self._users.pop(principal, None)
+                for user_id in self.group_members.get(principal, ()):
+                    self._users.pop(user_id, None)
+            if principals & set(self.builtin_groups.values()):
+                self.non_member = self._builtin_permissions(
+                    "GroupNonMember", BUILTIN_NON_MEMBER)
+                self.anonymous = self._builtin_permissions(
+                    "GroupAnonymous", BUILTIN_ANONYMOUS)
+
+    def group_changed(self, user_id, group_id, added):
+        with self._lock:
+            if added:
+                self.groups[user_id].add(group_id)
+                self.group_members[group_id].add(user_id)
+            else:
+                self.groups[user_id].discard(group_id)
+                self.group_members[group_id].discard(user_id)
+            self._users.pop(user_id, None)
+
+    def sync(self):
+        """Catch up with membership changes made outside of Django.
+
+        Added member roles are applied incrementally; anything else (deleted
+        rows, changed roles or group memberships) triggers a rebuild.
+        """
+        from .models import MemberRole, Role
+
+        if Role.cached.generation(self.using) != self._role_generation:
+            return self.build()
+        old, new = self._signature_state, self._signature()
+        if new == old:
+            return
+        added = list(MemberRole.objects.using(self.using)
+                     .filter(pk__gt=self._last_member_role or 0)
+                     .values_list("member__user_id", flat=True))
+        if (new[0]["n"] >= old[0]["n"] and new[2] == old[2]
+                and new[1]["n"] - old[1]["n"] == len(added)):
+            self.refresh(set(added))
+            self._signature_state = new
+        else:
+            self.build()
+
+
+_indexes = weakref.WeakSet()
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def permission_index(using=None):
+    """Shared :class:`PermissionIndex` of a database, built on first use.
+
+    Like any index it follows membership changes saved through Django; call
+    its :meth:`~PermissionIndex.sync` for changes made by Redmine itself.
+    """
+    using = using or settings.REDMINE_DATABASE
+    index = _shared.get(using)
+    if index is None:
+        with _shared_lock:
+            index = _shared.get(using)
+            if index is None:
+                index = _shared[using] = PermissionIndex(using)
+    return index
+
+
+def _membership_changed(sender, instance, **kwargs):
+    from .models import GroupUser, Member
+
+    added = "created" in kwargs
+    for index in list(_indexes):
+        if isinstance(instance, GroupUser):
+            index.group_changed(instance.user_id, instance.group_id, added)
+            continue
+        if isinstance(instance, Member):
+            principal = instance.user_id
+        else:
+            principal = (Member.objects.using(index.using)
+                         .filter(pk=instance.member_id)
+                         .values_list("user_id", flat=True).first())
+        if principal is None:
+            index.build()
+        else:
+            index.refresh([principal])
+
+
+def _connect_signals():
+    from .models import GroupUser, Member, MemberRole
+
+    for model in (GroupUser, Member, MemberRole):
+        post_save.connect(_membership_changed, sender=model,
+                          dispatch_uid="redmine_models.permissions.%s" % model.__name__)
+        post_delete.connect(_membership_changed, sender=model,
+                            dispatch_uid="redmine_models.permissions.%s.delete" % model.__name__)
+
+
+_connect_signals()
+
+
+def _roles_by_visibility(roles, permission="view_issues"):
+    grouped = defaultdict(list)
+    for role in roles:
+        if permission in role_permissions(role):
+            grouped[role.issues_visibility].append(role.pk)
+    return grouped
+
+
+def _visibility_clause(grouped, has_roles, own):
+    """OR together the issue filters of each ``issues_visibility`` level;
+    ``has_roles(role_ids)`` builds the condition of holding one of them.
+    """
+    clause = NEVER
+    for visibility, restriction in (
+            ("all", ALWAYS),
+            ("default", Q(is_private=False) | own),
+            ("own", own)):
+        if grouped.get(visibility):
+            clause |= has_roles(grouped[visibility]) & restriction
+    return clause
+
+
+def issue_visibility(user, using=None):
+    """Compile Redmine's ``Issue.visible`` scope for ``user`` into a ``Q``.
+
+    Memberships, group memberships, roles and enabled modules become
+    ``project_id IN (...)`` subqueries, evaluated once rather than per issue,
+    so the database does all the filtering.  Only the roles themselves
+    (``Role.cached``) are read up front.
+    """
+    from .models import EnabledModule, Member, MemberRole, Role, User
+
+    using = using or settings.REDMINE_DATABASE
+    condition = ~Q(project__status__in=(
+        PROJECT_ARCHIVED, PROJECT_SCHEDULED_FOR_DELETION)) & Q(
+        project_id__in=EnabledModule.objects.filter(name="issue_tracking")
+        .values("project_id"))
+    user_id = _pk(user)
+    if user_id is not None:
+        admin = getattr(user, "admin", None)
+        if admin is None:
+            admin = User.objects.using(using).filter(pk=user_id).values_list(
+                "admin", flat=True).first()
+        if admin:
+            return condition
+
+    roles = Role.cached.all(using)
+    builtin = BUILTIN_NON_MEMBER if user_id is not None else BUILTIN_ANONYMOUS
+    builtin_group = "GroupNonMember" if user_id is not None else "GroupAnonymous"
+    builtin_roles = _roles_by_visibility(r for r in roles if r.builtin == builtin)
+    override_group = User.objects.filter(type=builtin_group).values("pk")
+
+    def held_by(principals):
+        def has_roles(role_ids):
+            return Q(project_id__in=MemberRole.objects.filter(
+                member__user_id__in=principals,
+                role_id__in=role_ids).values("member__project_id"))
+        return has_roles
+
+    if user_id is None:
+        own = NEVER
+        member_clause = NEVER
+        not_member = ALWAYS
+    else:
+        principal_ids = User.objects.filter(
+            Q(pk=user_id) | Q(users__user_id=user_id)).values("pk")
+        own = Q(author_id=user_id) | Q(assigned_to_id__in=principal_ids)
+        member_clause = _visibility_clause(
+            _roles_by_visibility(r for r in roles if not r.builtin),
+            held_by(principal_ids), own)
+        not_member = ~Q(project_id__in=Member.objects.filter(
+            user_id__in=principal_ids).values("project_id"))
+
+    overridden = Q(project_id__in=Member.objects.filter(
+        user_id__in=override_group).values("project_id"))
+    non_member_clause = Q(project__is_public=True) & not_member & (
+        (~overridden & _visibility_clause(builtin_roles, lambda ids: ALWAYS, own))
+        | (overridden & _visibility_clause(
+            _roles_by_visibility(roles), held_by(override_group), own)))
+    return condition & (member_clause | non_member_clause)
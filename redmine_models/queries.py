@@ -0,0 +1,563 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.db.models import (Count, Exists, F, FloatField, OuterRef, Q, Subquery,
+                              Sum, Value)
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .cache import LRUCache
+from .custom_fields import resolve_custom_fields
+from .serialization import load_yaml, symbol_name
+from .settings import redmine_setting
+
+
+class QueryCompileError(ValueError):
+    """A saved query uses a filter, operator, sort or grouping that cannot be
+    translated."""
+
+
+# IssueQuery filter -> (kind, column)
+FILTERS = {
+    "assigned_to_id": ("user", "assigned_to_id"),
+    "author_id": ("user", "author_id"),
+    "category_id": ("list", "category_id"),
+    "closed_on": ("datetime", "closed_on"),
+    "created_on": ("datetime", "created_on"),
+    "description": ("string", "description"),
+    "done_ratio": ("number", "done_ratio"),
+    "due_date": ("date", "due_date"),
+    "estimated_hours": ("number", "estimated_hours"),
+    "fixed_version_id": ("list", "fixed_version_id"),
+    "id": ("number", "id"),
+    "is_private": ("bool", "is_private"),
+    "parent_id": ("tree", "parent_id"),
+    "priority_id": ("list", "priority_id"),
+    "project_id": ("list", "project_id"),
+    "start_date": ("date", "start_date"),
+    "status_id": ("status", "status_id"),
+    "subject": ("string", "subject"),
+    "subproject_id": ("subproject", None),
+    "tracker_id": ("list", "tracker_id"),
+    "updated_on": ("datetime", "updated_on"),
+    "watcher_id": ("watcher", None),
+}
+
+DATE_OPERATORS = ("=", ">=", "<=", "><", "t", "ld", "nd", "w", "lw", "l2w", "nw",
+                  "m", "lm", "nm", "y", ">t-", "<t-", "><t-", "t-", ">t+", "<t+",
+                  "><t+", "t+", "*", "!*")
+
+OPERATORS = {
+    "bool": ("=", "!"),
+    "date": DATE_OPERATORS,
+    "datetime": DATE_OPERATORS,
+    "list": ("=", "!", "*", "!*"),
+    "number": ("=", "!", ">=", "<=", "><", "*", "!*"),
+    "status": ("o", "c", "=", "!", "*"),
+    "string": ("~", "!~", "^", "$", "=", "!", "*", "!*"),
+    "subproject": ("=", "!", "*", "!*"),
+    "tree": ("=", "~", "*", "!*"),
+    "user": ("=", "!", "*", "!*"),
+    "watcher": ("=", "!"),
+}
+
+CUSTOM_FIELD_KINDS = {
+    "bool": "list", "date": "date", "enumeration": "list", "float": "number",
+    "int": "number", "link": "string", "list": "list", "string": "string",
+    "text": "string", "user": "user", "version": "list",
+}
+
+# sort/group name -> ordering expressions
+SORTS = {
+    "assigned_to": ("assigned_to__lastname", "assigned_to__firstname", "assigned_to_id"),
+    "author": ("author__lastname", "author__firstname", "author_id"),
+    "category": ("category__name",),
+    "closed_on": ("closed_on",),
+    "created_on": ("created_on",),
+    "done_ratio": ("done_ratio",),
+    "due_date": ("due_date",),
+    "estimated_hours": ("estimated_hours",),
+    "fixed_version": ("fixed_version__effective_date", "fixed_version__name"),
+    "id": ("id",),
+    "is_private": ("is_private",),
+    "parent": ("root_id", "lft"),
+    "priority": ("priority__position",),
+    "project": ("project__name",),
+    "start_date": ("start_date",),
+    "status": ("status__position",),
+    "subject": ("subject",),
+    "tracker": ("tracker__position",),
+    "updated_on": ("updated_on",),
+}
+
+GROUPS = {
+    "assigned_to": "assigned_to_id",
+    "author": "author_id",
+    "category": "category_id",
+    "done_ratio": "done_ratio",
+    "due_date": "due_date",
+    "fixed_version": "fixed_version_id",
+    "is_private": "is_private",
+    "priority": "priority_id",
+    "project": "project_id",
+    "start_date": "start_date",
+    "status": "status_id",
+    "tracker": "tracker_id",
+}
+
+_compiled = LRUCache(256)
+
+
+def _today():
+    if settings.USE_TZ:
+        return timezone.localdate()
+    return datetime.date.today()
+
+
+def _date(value):
+    try:
+        return datetime.date(*map(int, value[:10].split("-")))
+    except (TypeError, ValueError):
+        raise QueryCompileError("Invalid date: %r" % (value,))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise QueryCompileError("Invalid number: %r" % (value,))
+
+
+def _days(values):
+    try:
+        return int(values[0])
+    except (IndexError, TypeError, ValueError):
+        raise QueryCompileError("Invalid number of days: %r" % (values,))
+
+
+def _week_start(today, using):
+    first = redmine_setting("start_of_week", using=using)
+    first = int(first) if first else 1
+    return today - datetime.timedelta(days=(today.isoweekday() - first) % 7)
+
+
+def _add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def date_range(operator, values, using=None):
+    """``(from, to)`` dates, either may be None, for a date operator."""
+    today = _today()
+    day = datetime.timedelta(days=1)
+    if operator == "=":
+        return _date(values[0]), _date(values[0])
+    if operator == ">=":
+        return _date(values[0]), None
+    if operator == "<=":
+        return None, _date(values[0])
+    if operator == "><":
+        return _date(values[0]), _date(values[1])
+    if operator == "t":
+        return today, today
+    if operator == "ld":
+        return today - day, today - day
+    if operator == "nd":
+        return today + day, today + day
+    if operator in ("w", "lw", "l2w", "nw"):
+        start = _week_start(today, using)
+        weeks = {"w": (0, 1), "lw": (-1, 0), "l2w": (-2, 0), "nw": (1, 2)}[operator]
+        return (start + datetime.timedelta(weeks=weeks[0]),
+                start + datetime.timedelta(weeks=weeks[1]) - day)
+    if operator in ("m", "lm", "nm"):
+        offset = {"m": 0, "lm": -1, "nm": 1}[operator]
+        start = _add_months(today, offset)
+        return start, _add_months(start, 1) - day
+    if operator == "y":
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    n = datetime.timedelta(days=_days(values))
+    return {
+        ">t-": (today - n, None),
+        "<t-": (None, today - n),
+        "><t-": (today - n, today),
+        "t-": (today - n, today - n),
+        ">t+": (today + n, None),
+        "<t+": (None, today + n),
+        "><t+": (today, today + n),
+        "t+": (today + n, today + n),
+    }[operator]
+
+
+def _user_ids(values, user, using, groups=False):
+    from .models import GroupUser
+
+    ids = []
+    for value in values:
+        if value == "me":
+            user_id = getattr(user, "pk", user)
+            if user_id is not None:
+                ids.append(user_id)
+                if groups:
+                    ids.extend(GroupUser.objects.using(using).filter(user_id=user_id)
+                               .values_list("group_id", flat=True))
+        else:
+            ids.append(value)
+    return ids
+
+
+def _column_q(column, kind, operator, values):
+    """Condition on a plain ``column`` for the generic operators."""
+    if operator == "*":
+        q = Q(**{column + "__isnull": False})
+        return q & ~Q(**{column: ""}) if kind == "string" else q
+    if operator == "!*":
+        q = Q(**{column + "__isnull": True})
+        return q | Q(**{column: ""}) if kind == "string" else q
+    if kind == "bool":
+        values = [value in ("1", "true", True) for value in values]
+    elif kind == "number":
+        values = [_number(value) for value in values]
+    if operator == "=":
+        return Q(**{column + "__in": values})
+    if operator == "!":
+        return ~Q(**{column + "__in": values}) | Q(**{column + "__isnull": True})
+    if operator == ">=":
+        return Q(**{column + "__gte": values[0]})
+    if operator == "<=":
+        return Q(**{column + "__lte": values[0]})
+    if operator == "><":
+        return Q(**{column + "__gte": values[0], column + "__lte": values[1]})
+    if operator in ("~", "!~"):
+        q = Q()
+        for word in " ".join(values).split():
+            q &= Q(**{column + "__icontains": word})
+        return ~q if operator == "!~" else q
+    if operator == "^":
+        return Q(**{column + "__istartswith": values[0]})
+    if operator == "$":
+        return Q(**{column + "__iendswith": values[0]})
+    raise QueryCompileError("Unsupported operator %r" % operator)
+
+
+def _date_q(column, operator, values, is_datetime, using):
+    if operator in ("*", "!*"):
+        return _column_q(column, "date", operator, values)
+    lookup = column + "__date" if is_datetime else column
+    start, end = date_range(operator, values, using)
+    q = Q()
+    if start is not None:
+        q &= Q(**{lookup + "__gte": start})
+    if end is not None:
+        q &= Q(**{lookup + "__lte": end})
+    return q
+
+
+class Filter(object):
+    """One parsed ``field => {operator, values}`` entry of ``Query.filters``."""
+
+    def __init__(self, field, operator, values, using=None):
+        self.field = field
+        self.operator = operator
+        self.values = [value for value in (values or []) if value is not None]
+        self.custom_field = None
+        if field.startswith("cf_"):
+            self.custom_field = self._custom_field(field, using)
+            self.kind = CUSTOM_FIELD_KINDS.get(self.custom_field.field_format, "string")
+            self.column = None
+        elif field in FILTERS:
+            self.kind, self.column = FILTERS[field]
+        else:
+            raise QueryCompileError("Unknown filter %r" % field)
+        if operator not in OPERATORS[self.kind]:
+            raise QueryCompileError("Operator %r is not available for %r" % (operator, field))
+
+    @staticmethod
+    def _custom_field(field, using):
+        try:
+            return resolve_custom_fields("Issue", [int(field[3:])], using=using)[0]
+        except ValueError:
+            raise QueryCompileError("Unknown custom field filter %r" % field)
+
+    def q(self, user=None, using=None):
+        from .models import Issue, Member, Watcher
+
+        if self.custom_field is not None:
+            return self._custom_field_q(user, using)
+        kind, operator, values = self.kind, self.operator, self.values
+        if kind == "status":
+            if operator == "o":
+                return Q(status__is_closed=False)
+            if operator == "c":
+                return Q(status__is_closed=True)
+            return _column_q(self.column, "list", operator, values)
+        if kind in ("date", "datetime"):
+            return _date_q(self.column, operator, values, kind == "datetime", using)
+        if kind == "user":
+            values = _user_ids(values, user, using,
+                               groups=self.field == "assigned_to_id")
+        if self.field == "project_id" and "mine" in values and operator in ("=", "!"):
+            mine = (Member.objects.using(using)
+                    .filter(user_id=getattr(user, "pk", user)).values("project_id"))
+            q = (Q(project_id__in=[value for value in values if value != "mine"])
+                 | Q(project_id__in=mine))
+            return q if operator == "=" else ~q
+        if kind == "watcher":
+            watched = Exists(Watcher.objects.using(using).filter(
+                watchable_type="Issue", watchable_id=OuterRef("pk"),
+                user_id__in=_user_ids(values, user, using, groups=True)))
+            return Q(watched) if operator == "=" else ~Q(watched)
+        if kind == "tree" and operator == "~":
+            return Q(Exists(Issue.objects.using(using).filter(
+                pk__in=values, root_id=OuterRef("root_id"),
+                lft__lt=OuterRef("lft"), rgt__gt=OuterRef("rgt"))))
+        if kind == "subproject":
+            # applied by CompiledQuery with the project scope
+            return Q()
+        return _column_q(self.column, "list" if kind in ("user", "tree") else kind,
+                         operator, values)
+
+    def _custom_field_q(self, user, using):
+        from .models import CustomValue
+
+        field = self.custom_field
+        values = self.values
+        if self.kind == "user":
+            values = [str(value) for value in _user_ids(values, user, using)]
+        custom_values = CustomValue.objects.using(using).filter(
+            customized_type="Issue", customized_id=OuterRef("pk"),
+            custom_field_id=field.pk)
+        operator = {"!": "=", "!*": "*", "!~": "~"}.get(self.operator, self.operator)
+        if operator == "*":
+            condition = ~Q(value="") & Q(value__isnull=False)
+        elif self.kind == "number" and operator in ("=", ">=", "<=", "><"):
+            custom_values = custom_values.exclude(value="").annotate(
+                number=Cast("value", FloatField()))
+            condition = _column_q("number", "number", operator, values)
+        elif self.kind == "date":
+            start, end = date_range(operator, values, using)
+            condition = ~Q(value="")
+            if start is not None:
+                condition &= Q(value__gte=start.isoformat())
+            if end is not None:
+                condition &= Q(value__lte=end.isoformat())
+        else:
+            condition = _column_q("value", self.kind, operator, values)
+        exists = Q(Exists(custom_values.filter(condition)))
+        return ~exists if operator != self.operator else exists
+
+
+def _custom_value(field_id, using, numeric=False):
+    from .models import CustomValue
+
+    value = Subquery(CustomValue.objects.using(using).filter(
+        customized_type="Issue", customized_id=OuterRef("pk"),
+        custom_field_id=field_id).order_by("pk").values("value")[:1])
+    return Cast(value, FloatField()) if numeric else value
+
+
+class CompiledQuery(object):
+    """A saved ``IssueQuery`` turned into ORM building blocks.
+
+    Parsing and validation happen once; :meth:`queryset` and :meth:`totals`
+    build the SQL for a given user, since ``me`` and relative dates are
+    resolved when the query runs.
+    """
+
+    def __init__(self, query, using=None):
+        self.query_id = query.pk
+        self.project_id = query.project_id
+        self.using = using or settings.REDMINE_DATABASE
+        if query.type not in (None, "", "IssueQuery"):
+            raise QueryCompileError("Only issue queries can be compiled, not %s" % query.type)
+        self.filters = [Filter(field, operator, values, self.using)
+                        for field, operator, values in self._parse_filters(query.filters)]
+        self.sort_criteria = self._parse_sort(query.sort_criteria)
+        self.group_by = query.group_by or None
+        if self.group_by and self.group_by not in GROUPS and not self._is_custom(self.group_by):
+            raise QueryCompileError("Cannot group by %r" % self.group_by)
+        options = self._mapping(load_yaml(query.options))
+        self.column_names = [symbol_name(name)
+                             for name in (load_yaml(query.column_names) or [])]
+        self.totalable_names = [symbol_name(name)
+                                for name in (options.get("totalable_names") or [])]
+        for name in self.totalable_names:
+            if name not in ("estimated_hours", "spent_hours") and not self._is_custom(name):
+                raise QueryCompileError("Cannot total %r" % name)
+
+    @staticmethod
+    def _mapping(value):
+        if not value:
+            return {}
+        if not isinstance(value, dict):
+            raise QueryCompileError("Expected a mapping, got %r" % (value,))
+        return dict((symbol_name(key), item) for key, item in value.items())
+
+    def _parse_filters(self, text):
+        for field, spec in sorted(self._mapping(load_yaml(text)).items()):
+            spec = self._mapping(spec)
+            if "operator" not in spec:
+                raise QueryCompileError("Filter %r has no operator" % field)
+            values = spec.get("values") or []
+            if not isinstance(values, list):
+                values = [values]
+            yield field, spec["operator"], values
+
+    def _parse_sort(self, text):
+        criteria = load_yaml(text) or []
+        if isinstance(criteria, dict):
+            # older Redmine versions dumped {"0" => [name, dir], ...}
+            criteria = [criteria[key] for key in sorted(criteria, key=int)]
+        parsed = []
+        for criterion in criteria:
+            name, direction = (list(criterion) + ["asc"])[:2]
+            if name not in SORTS and not self._is_custom(name):
+                raise QueryCompileError("Cannot sort by %r" % name)
+            parsed.append((name, (direction or "asc").lower() == "desc"))
+        return parsed
+
+    def _is_custom(self, name):
+        if not name.startswith("cf_"):
+            return False
+        Filter._custom_field(name, self.using)
+        return True
+
+    def _custom_field_format(self, name):
+        return Filter._custom_field(name, self.using).field_format
+
+    def _project_q(self, using):
+        from .models import Project
+
+        if self.project_id is None:
+            return Q()
+        subprojects = [f for f in self.filters if f.kind == "subproject"]
+        if not subprojects and redmine_setting("display_subprojects_issues",
+                                               using=using) != "1":
+            return Q(project_id=self.project_id)
+        project = Project.objects.using(using).get(pk=self.project_id)
+        tree = Q(project__lft__gte=project.lft, project__rgt__lte=project.rgt)
+        if not subprojects:
+            return tree
+        subproject = subprojects[0]
+        if subproject.operator == "*":
+            return tree
+        if subproject.operator == "!*":
+            return Q(project_id=self.project_id)
+        if subproject.operator == "=":
+            return Q(project_id=self.project_id) | Q(project_id__in=subproject.values)
+        return tree & ~Q(project_id__in=subproject.values)
+
+    def _group_expression(self):
+        if self.group_by in GROUPS:
+            return F(GROUPS[self.group_by])
+        return _custom_value(int(self.group_by[3:]), self.using,
+                             self._custom_field_format(self.group_by) in ("int", "float"))
+
+    def _ordering(self, name, descending):
+        if name.startswith("cf_"):
+            expression = _custom_value(int(name[3:]), self.using,
+                                       self._custom_field_format(name) in ("int", "float"))
+            return [expression.desc(nulls_last=True) if descending
+                    else expression.asc(nulls_last=True)]
+        return [F(column).desc(nulls_last=True) if descending
+                else F(column).asc(nulls_last=True) for column in SORTS[name]]
+
+    def queryset(self, user=None, using=None, visible=True):
+        """Issues matched by the query, ordered by group then sort criteria.
+
+        ``user`` resolves ``me`` in filters and, unless ``visible`` is False,
+        restricts the result to the issues they may see.
+        """
+        from .models import Issue
+
+        using = using or self.using
+        issues = Issue.objects.using(using)
+        if user is not None and visible:
+            issues = issues.visible_to(user)
+        condition = self._project_q(using)
+        for query_filter in self.filters:
+            condition &= query_filter.q(user, using)
+        issues = issues.filter(condition)
+        ordering = []
+        if self.group_by:
+            group = self.group_by
+            if group in SORTS:
+                ordering.extend(self._ordering(group, False))
+            else:
+                issues = issues.annotate(query_group=self._group_expression())
+                ordering.append(F("query_group").asc(nulls_last=True))
+        for name, descending in self.sort_criteria or [("id", True)]:
+            ordering.extend(self._ordering(name, descending))
+        if not any(name == "id" for name, descending in self.sort_criteria):
+            ordering.append(F("id").desc())
+        return issues.order_by(*ordering)
+
+    def _total_expressions(self, using):
+        from .models import TimeEntry
+
+        expressions = {"count": Count("pk")}
+        for name in self.totalable_names:
+            if name == "estimated_hours":
+                expressions[name] = Coalesce(Sum("estimated_hours"), Value(0.0))
+            elif name == "spent_hours":
+                spent = Subquery(TimeEntry.objects.using(using)
+                                 .filter(issue_id=OuterRef("pk")).order_by()
+                                 .values("issue_id").annotate(hours=Sum("hours"))
+                                 .values("hours"))
+                expressions[name] = (spent, Coalesce(Sum("total_spent_hours"), Value(0.0)))
+            else:
+                expressions[name] = (_custom_value(int(name[3:]), using, numeric=True),
+                                     Coalesce(Sum("total_" + name), Value(0.0)))
+        return expressions
+
+    def totals(self, user=None, using=None, visible=True):
+        """Issue count and totals per group, in one grouped query.
+
+        Returns a list of dicts with ``group`` (the grouped value, None
+        without ``group_by``), ``count`` and one entry per totalable column.
+        """
+        using = using or self.using
+        issues = self.queryset(user, using, visible).order_by()
+        aggregates = {}
+        for name, expression in self._total_expressions(using).items():
+            if isinstance(expression, tuple):
+                issues = issues.annotate(**{"total_" + name: expression[0]})
+                expression = expression[1]
+            aggregates[name] = expression
+        if not self.group_by:
+            row = issues.aggregate(**aggregates)
+            row["group"] = None
+            return [row]
+        issues = issues.annotate(query_group=self._group_expression())
+        if self.group_by in SORTS:
+            ordering = self._ordering(self.group_by, False)
+        else:
+            ordering = [F("query_group").asc(nulls_last=True)]
+        rows = []
+        for row in issues.values("query_group").annotate(**aggregates).order_by(*ordering):
+            row["group"] = row.pop("query_group")
+            rows.append(row)
+        return rows
+
+
+def _signature(query):
+    content = "\0".join("%s" % (value,) for value in (
+        query.type, query.project_id, query.filters, query.sort_criteria,
+        query.group_by, query.column_names, query.options))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def compile_query(query, using=None):
+    """Return the :class:`CompiledQuery` of a ``Query`` row, reusing the
+    cached compilation while the row's content is unchanged."""
+    using = using or query._state.db or settings.REDMINE_DATABASE
+    key = (using, query.pk, _signature(query))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = CompiledQuery(query, using)
+        _compiled.set(key, compiled)
+    return compiled
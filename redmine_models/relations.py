@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db.models import Q
+
+from .settings import redmine_setting
+
+RELATES = "relates"
+DUPLICATES = "duplicates"
+BLOCKS = "blocks"
+PRECEDES = "precedes"
+COPIED_TO = "copied_to"
+
+# Redmine stores reversed types swapped onto their canonical name
+REVERSED_TYPES = {
+    "blocked": BLOCKS,
+    "copied_from": COPIED_TO,
+    "duplicated": DUPLICATES,
+    "follows": PRECEDES,
+}
+
+SYMMETRIC_TYPES = (RELATES,)
+
+RELATION_FIELDS = (
+    "issue_from_id", "issue_to_id", "relation_type", "delay",
+    "issue_from__start_date", "issue_from__due_date",
+    "issue_to__start_date", "issue_to__due_date",
+)
+
+
+class RelationCycleError(ValueError):
+    """The relations of a type that must be acyclic contain cycles."""
+
+    def __init__(self, relation_type, cycles):
+        self.relation_type = relation_type
+        self.cycles = cycles
+        super(RelationCycleError, self).__init__(
+            "%d cycle(s) in %r relations" % (len(cycles), relation_type))
+
+
+class WorkingDays(object):
+    """Redmine's working-day arithmetic (``Redmine::Utils::DateCalculation``)."""
+
+    def __init__(self, non_working_week_days=(6, 7)):
+        self.non_working = frozenset(int(day) for day in non_working_week_days)
+        self.per_week = 7 - len(self.non_working)
+
+    def _is_working(self, cwday):
+        return ((cwday - 1) % 7) + 1 not in self.non_working
+
+    def next_working_date(self, date):
+        if not self.per_week:
+            return date
+        cwday = date.isoweekday()
+        days = 0
+        while not self._is_working(cwday + days):
+            days += 1
+        return date + datetime.timedelta(days=days)
+
+    def add_working_days(self, date, working_days):
+        if working_days <= 0 or not self.per_week:
+            return self.next_working_date(date)
+        weeks = working_days // self.per_week
+        result = weeks * 7
+        days_left = working_days - weeks * self.per_week
+        cwday = date.isoweekday()
+        while days_left > 0:
+            cwday += 1
+            if self._is_working(cwday):
+                days_left -= 1
+            result += 1
+        return self.next_working_date(date + datetime.timedelta(days=result))
+
+    def working_days(self, start, end):
+        days = (end - start).days
+        if days <= 0:
+            return 0
+        weeks = days // 7
+        result = weeks * self.per_week
+        cwday = start.isoweekday()
+        for offset in range(1, days - weeks * 7 + 1):
+            if self._is_working(cwday + offset):
+                result += 1
+        return result
+
+
+def _kahn(adjacency):
+    """Topological order of the acyclic part of ``adjacency`` (Kahn's
+    algorithm); nodes on or after a cycle are left out."""
+    indegree = [0] * len(adjacency)
+    for edges in adjacency:
+        for j in edges:
+            indegree[j] += 1
+    queue = deque(i for i, degree in enumerate(indegree) if not degree)
+    order = []
+    while queue:
+        i = queue.popleft()
+        order.append(i)
+        for j in adjacency[i]:
+            indegree[j] -= 1
+            if not indegree[j]:
+                queue.append(j)
+    return order
+
+
+class RelationGraph(object):
+    """Issue relations held as integer-indexed adjacency lists.
+
+    Rows are ``RELATION_FIELDS`` tuples.  Reversed relation types are folded
+    onto their canonical name, so ``blocks`` edges always point from the
+    blocking issue to the blocked one and ``precedes`` edges from the
+    preceding issue to the following one.  Issue ids given to and returned
+    by the methods are Redmine ids.
+    """
+
+    def __init__(self, rows=(), using=None):
+        self.using = using or settings.REDMINE_DATABASE
+        self.ids = []
+        self.index = {}
+        self.start_dates = []
+        self.due_dates = []
+        self.successors = {}
+        self.predecessors = {}
+        self.delays = {}
+        for row in rows:
+            self.add(*row)
+
+    def _node(self, issue_id, start_date, due_date):
+        i = self.index.get(issue_id)
+        if i is None:
+            i = self.index[issue_id] = len(self.ids)
+            self.ids.append(issue_id)
+            self.start_dates.append(start_date)
+            self.due_dates.append(due_date)
+        return i
+
+    def add(self, issue_from_id, issue_to_id, relation_type, delay=None,
+            from_start=None, from_due=None, to_start=None, to_due=None):
+        if relation_type in REVERSED_TYPES:
+            relation_type = REVERSED_TYPES[relation_type]
+            issue_from_id, issue_to_id = issue_to_id, issue_from_id
+            from_start, from_due, to_start, to_due = to_start, to_due, from_start, from_due
+        i = self._node(issue_from_id, from_start, from_due)
+        j = self._node(issue_to_id, to_start, to_due)
+        self.successors.setdefault(relation_type, defaultdict(list))[i].append(j)
+        self.predecessors.setdefault(relation_type, defaultdict(list))[j].append(i)
+        if relation_type == PRECEDES:
+            self.delays[(i, j)] = delay or 0
+
+    @classmethod
+    def load(cls, issues, relation_types=None, using=None):
+        """Load, in one query, every relation with an end in ``issues``.
+
+        Issues outside of ``issues`` appear as the far end of those
+        relations but their own relations are not followed.
+        """
+        from .models import IssueRelation
+
+        using = using or issues.db
+        ids = issues.values("pk")
+        relations = (IssueRelation.objects.using(using)
+                     .filter(Q(issue_from_id__in=ids) | Q(issue_to_id__in=ids)))
+        if relation_types is not None:
+            names = set(relation_types)
+            names.update(r for r, canonical in REVERSED_TYPES.items() if canonical in names)
+            relations = relations.filter(relation_type__in=names)
+        return cls(relations.values_list(*RELATION_FIELDS).iterator(), using=using)
+
+    @classmethod
+    def for_project(cls, project, include_subprojects=False, **kwargs):
+        from .models import Issue, Project
+
+        using = kwargs.get("using")
+        issues = Issue.objects.using(using or settings.REDMINE_DATABASE)
+        if include_subprojects:
+            if not isinstance(project, Project):
+                project = Project.objects.using(issues.db).get(pk=project)
+            issues = issues.filter(project__lft__gte=project.lft,
+                                   project__rgt__lte=project.rgt)
+        else:
+            issues = issues.filter(project_id=getattr(project, "pk", project))
+        return cls.load(issues, **kwargs)
+
+    @classmethod
+    def for_version(cls, version, **kwargs):
+        from .models import Issue
+
+        issues = (Issue.objects.using(kwargs.get("using") or settings.REDMINE_DATABASE)
+                  .filter(fixed_version_id=getattr(version, "pk", version)))
+        return cls.load(issues, **kwargs)
+
+    def _adjacency(self, relation_type, reverse=False):
+        if relation_type in REVERSED_TYPES:
+            relation_type = REVERSED_TYPES[relation_type]
+            reverse = not reverse
+        empty = {}
+        forward = self.successors.get(relation_type, empty)
+        backward = self.predecessors.get(relation_type, empty)
+        if relation_type in SYMMETRIC_TYPES:
+            return [forward.get(i, []) + backward.get(i, []) for i in range(len(self.ids))]
+        edges = backward if reverse else forward
+        return [edges.get(i, ()) for i in range(len(self.ids))]
+
+    def related(self, issue, relation_type, reverse=False):
+        """Issues directly related to ``issue``; with ``reverse``, those
+        pointing at it (e.g. the issues blocking it)."""
+        i = self.index.get(getattr(issue, "pk", issue))
+        if i is None:
+            return []
+        if relation_type in REVERSED_TYPES:
+            relation_type = REVERSED_TYPES[relation_type]
+            reverse = not reverse
+        forward = self.successors.get(relation_type, {}).get(i, [])
+        backward = self.predecessors.get(relation_type, {}).get(i, [])
+        if relation_type in SYMMETRIC_TYPES:
+            edges = forward + backward
+        else:
+            edges = backward if reverse else forward
+        return [self.ids[j] for j in edges]
+
+    def reachable(self, issues, relation_type=BLOCKS, reverse=False):
+        """Issue ids transitively reachable from ``issues``, excluding them
+        unless they lie on a cycle.  ``reachable(version_issues, "blocks",
+        reverse=True)`` is everything that blocks a release.
+        """
+        adjacency = self._adjacency(relation_type, reverse)
+        seen = [False] * len(self.ids)
+        queue = deque()
+        for issue in issues:
+            i = self.index.get(getattr(issue, "pk", issue))
+            if i is not None:
+                queue.extend(adjacency[i])
+        while queue:
+            i = queue.popleft()
+            if not seen[i]:
+                seen[i] = True
+                queue.extend(j for j in adjacency[i] if not seen[j])
+        return set(self.ids[i] for i, flag in enumerate(seen) if flag)
+
+    def _components(self, adjacency):
+        """Strongly connected components (iterative Tarjan), emitted in
+        reverse topological order of the condensed graph."""
+        n = len(adjacency)
+        order = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        components = []
+        counter = 0
+        for root in range(n):
+            if order[root] != -1:
+                continue
+            work = [(root, 0)]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                node, pos = work[-1]
+                edges = adjacency[node]
+                if pos < len(edges):
+                    work[-1] = (node, pos + 1)
+                    succ = edges[pos]
+                    if order[succ] == -1:
+                        order[succ] = low[succ] = counter
+                        counter += 1
+                        stack.append(succ)
+                        on_stack[succ] = True
+                        work.append((succ, 0))
+                    elif on_stack[succ] and order[succ] < low[node]:
+                        low[node] = order[succ]
+                    continue
+                work.pop()
+                if work and low[node] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[node]
+                if low[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+    def cycles(self, relation_type=BLOCKS):
+        """Lists of issue ids that (transitively) relate to themselves."""
+        adjacency = self._adjacency(relation_type)
+        cycles = []
+        for component in self._components(adjacency):
+            if len(component) > 1 or component[0] in adjacency[component[0]]:
+                cycles.append(sorted(self.ids[i] for i in component))
+        return cycles
+
+    def closure(self, relation_type=BLOCKS, reverse=False):
+        """Return ``{issue_id: frozenset(reachable issue ids)}`` for every issue.
+
+        Reachable sets are built in reverse topological order from those of
+        the successors, once per strongly connected component when there are
+        cycles, so the cost grows with the size of the result: linearly for
+        the usual forest of short chains, quadratically only for long chains,
+        whose closure does.
+        """
+        adjacency = self._adjacency(relation_type, reverse)
+        empty = frozenset()
+        ids = self.ids
+        order = _kahn(adjacency)
+        if len(order) == len(ids):
+            reach = [empty] * len(ids)
+            for i in reversed(order):
+                edges = adjacency[i]
+                if edges:
+                    reachable = set()
+                    for j in edges:
+                        reachable.add(ids[j])
+                        reachable.update(reach[j])
+                    reach[i] = frozenset(reachable)
+            return dict(zip(ids, reach))
+
+        components = self._components(adjacency)
+        component_of = [0] * len(ids)
+        for c, component in enumerate(components):
+            for i in component:
+                component_of[i] = c
+        reach = [empty] * len(components)
+        closure = {}
+        # components come out successors first
+        for c, component in enumerate(components):
+            reachable = set()
+            cyclic = len(component) > 1
+            for i in component:
+                for j in adjacency[i]:
+                    d = component_of[j]
+                    if d == c:
+                        cyclic = True
+                    else:
+                        reachable.add(ids[j])
+                        reachable.update(reach[d])
+            if cyclic:
+                reachable.update(ids[i] for i in component)
+            reach[c] = reachable = frozenset(reachable) if reachable else empty
+            for i in component:
+                closure[ids[i]] = reachable
+        return closure
+
+    def _topological(self, relation_type):
+        order = _kahn(self._adjacency(relation_type))
+        if len(order) < len(self.ids):
+            raise RelationCycleError(relation_type, self.cycles(relation_type))
+        return order
+
+    def topological_order(self, relation_type=PRECEDES):
+        """Issue ids ordered so that every issue comes after those it
+        follows (Kahn's algorithm).  Raises :class:`RelationCycleError`."""
+        return [self.ids[i] for i in self._topological(relation_type)]
+
+    def schedule(self, working_days=None):
+        """Return ``{issue_id: (start_date, due_date)}`` after applying
+        ``precedes`` relations the way Redmine reschedules following issues,
+        plus ``{issue_id: driving_issue_id}`` for issues that were pushed.
+
+        A following issue cannot start before the working day after its
+        predecessor ends plus ``delay`` working days, and keeps its working
+        duration when moved.
+        """
+        if working_days is None:
+            working_days = WorkingDays(
+                redmine_setting("non_working_week_days", (), using=self.using) or ())
+        starts = list(self.start_dates)
+        dues = list(self.due_dates)
+        drivers = {}
+        predecessors = self.predecessors.get(PRECEDES, {})
+        for i in self._topological(PRECEDES):
+            soonest = None
+            driver = None
+            for p in predecessors.get(i, ()):
+                end = dues[p] or starts[p]
+                if end is None:
+                    continue
+                date = working_days.add_working_days(end, 1 + self.delays[(p, i)])
+                if soonest is None or date > soonest:
+                    soonest, driver = date, p
+            if soonest is None:
+                continue
+            if starts[i] is None or starts[i] < soonest:
+                duration = (working_days.working_days(starts[i], dues[i])
+                            if starts[i] and dues[i] else 0)
+                starts[i] = working_days.next_working_date(soonest)
+                dues[i] = working_days.add_working_days(starts[i], duration)
+                drivers[self.ids[i]] = self.ids[driver]
+            elif starts[i] == soonest:
+                drivers[self.ids[i]] = self.ids[driver]
+        dates = dict((self.ids[i], (starts[i], dues[i])) for i in range(len(self.ids)))
+        return dates, drivers
+
+    def critical_path(self, working_days=None):
+        """Return ``(issue_ids, finish_date)`` for the chain of ``precedes``
+        relations that determines the latest finish, in execution order.
+        """
+        dates, drivers = self.schedule(working_days)
+        finish, last = None, None
+        for issue_id in self.ids:
+            start, due = dates[issue_id]
+            end = due or start
+            if end is not None and (finish is None or end > finish):
+                finish, last = end, issue_id
+        if last is None:
+            return [], None
+        path = [last]
+        while path[-1] in drivers:
+            path.append(drivers[path[-1]])
+        path.reverse()
+        return path, finish
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import bisect
+import datetime
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _int(value):
+    return int(value) if value not in (None, "") else None
+
+
+def _float(value):
+    return float(value) if value not in (None, "") else None
+
+
+def _date(value):
+    return datetime.date(*map(int, value[:10].split("-"))) if value else None
+
+
+def _bool(value):
+    return value in ("1", "true", "t")
+
+
+# Issue attribute -> decoder of JournalDetail old_value/value
+ATTRIBUTES = {
+    "assigned_to_id": _int,
+    "category_id": _int,
+    "done_ratio": _int,
+    "due_date": _date,
+    "estimated_hours": _float,
+    "fixed_version_id": _int,
+    "is_private": _bool,
+    "parent_id": _int,
+    "priority_id": _int,
+    "project_id": _int,
+    "start_date": _date,
+    "status_id": _int,
+    "subject": lambda value: value,
+    "tracker_id": _int,
+}
+
+DEFAULT_FIELDS = ("status_id", "assigned_to_id", "fixed_version_id",
+                  "done_ratio", "estimated_hours")
+
+
+class IssueHistory(object):
+    """States of one issue over time, as ``(timestamp, {field: value})``
+    snapshots in chronological order.  The first one is the state at
+    creation, the last one the current row.
+    """
+
+    def __init__(self, issue_id, snapshots):
+        self.issue_id = issue_id
+        self.snapshots = snapshots
+        self.times = [when for when, state in snapshots]
+
+    @property
+    def created_on(self):
+        return self.times[0]
+
+    @property
+    def current(self):
+        return self.snapshots[-1][1]
+
+    def state_at(self, when):
+        """State as of ``when``, or None before the issue existed."""
+        i = bisect.bisect_right(self.times, when)
+        return self.snapshots[i - 1][1] if i else None
+
+    def value_at(self, field, when):
+        state = self.state_at(when)
+        return state[field] if state is not None else None
+
+    def intervals(self, field, until=None):
+        """``(value, start, end)`` for each period ``field`` kept a value;
+        the last period ends at ``until`` (None for open-ended)."""
+        intervals = []
+        for when, state in self.snapshots:
+            value = state[field]
+            if intervals and intervals[-1][0] == value:
+                continue
+            if intervals:
+                intervals[-1][2] = when
+            intervals.append([value, when, until])
+        return [tuple(interval) for interval in intervals]
+
+    def time_in(self, field="status_id", until=None):
+        """Return ``{value: timedelta}`` spent with each value of ``field``."""
+        until = until or _now()
+        totals = {}
+        for value, start, end in self.intervals(field, until):
+            totals[value] = totals.get(value, datetime.timedelta(0)) + (end - start)
+        return totals
+
+
+def _now():
+    if settings.USE_TZ:
+        return datetime.datetime.now(datetime.timezone.utc)
+    return datetime.datetime.now()
+
+
+def replay(issues, fields=DEFAULT_FIELDS, using=None):
+    """Rebuild the history of many issues with two queries.
+
+    ``issues`` is an Issue queryset or a list of issues or ids.  Attribute
+    changes are read in one query, newest first, and undone one journal at a
+    time starting from the current row.  Returns ``{issue_id: IssueHistory}``.
+    """
+    from .models import Issue, JournalDetail
+
+    fields = tuple(fields)
+    for field in fields:
+        if field not in ATTRIBUTES:
+            raise ValueError("Cannot replay issue attribute %r" % field)
+    if isinstance(issues, QuerySet):
+        using = using or issues.db
+        ids = issues.values("pk")
+        rows = issues.values_list("id", "created_on", *fields)
+    else:
+        using = using or settings.REDMINE_DATABASE
+        ids = [getattr(issue, "pk", issue) for issue in issues]
+        rows = (Issue.objects.using(using).filter(pk__in=ids)
+                .values_list("id", "created_on", *fields))
+    details = (JournalDetail.objects.using(using)
+               .filter(property="attr", prop_key__in=fields,
+                       journal__journalized_type="Issue",
+                       journal__journalized_id__in=ids)
+               .order_by("journal__journalized_id", "-journal__created_on",
+                         "-journal_id", "-id")
+               .values_list("journal__journalized_id", "journal__created_on",
+                            "journal_id", "prop_key", "old_value"))
+    changes = {}
+    for issue_id, created_on, journal_id, field, old_value in details.iterator():
+        journals = changes.setdefault(issue_id, [])
+        if not journals or journals[-1][0] != journal_id:
+            journals.append((journal_id, created_on, []))
+        journals[-1][2].append((field, ATTRIBUTES[field](old_value)))
+
+    histories = {}
+    for row in rows:
+        issue_id, created_on = row[0], row[1]
+        state = dict(zip(fields, row[2:]))
+        snapshots = []
+        for journal_id, changed_on, undo in changes.get(issue_id, ()):
+            snapshots.append((changed_on, state))
+            state = dict(state)
+            # details of a journal are newest first too; the oldest wins
+            for field, old_value in undo:
+                state[field] = old_value
+        snapshots.append((created_on or (snapshots[-1][0] if snapshots else None), state))
+        snapshots.reverse()
+        histories[issue_id] = IssueHistory(issue_id, snapshots)
+    return histories
+
+
+def _closed_statuses(using):
+    from .models import IssueStatus
+
+    return frozenset(status.pk for status in IssueStatus.cached.filter(using, is_closed=True))
+
+
+def time_in_status(histories, until=None):
+    """Return ``{issue_id: {status_id: timedelta}}``."""
+    return dict((issue_id, history.time_in("status_id", until))
+                for issue_id, history in histories.items())
+
+
+def cycle_time(history, start_statuses=None, using=None):
+    """Time from the first move into one of ``start_statuses`` (creation
+    when None) until the issue was last closed, or None while it is open.
+    """
+    closed = _closed_statuses(using)
+    intervals = history.intervals("status_id")
+    if not intervals or intervals[-1][0] not in closed:
+        return None
+    closed_on = intervals[-1][1]
+    for status_id, start, end in intervals:
+        if start_statuses is None or status_id in start_statuses:
+            return closed_on - start
+    return None
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def burndown(histories, start, end, using=None):
+    """Per-day counts of open issues and of their remaining estimated hours.
+
+    Every stretch of history adds its weight to the day it starts on and
+    removes it from the day it ends on; a running sum then gives the value
+    at the end of each day.  numpy does the sums when it is installed.
+    Returns ``{"dates", "total", "open", "remaining_hours"}`` lists.
+    """
+    closed = _closed_statuses(using)
+    days = (end - start).days + 1
+    starts, ends, exists, opened, hours = [], [], [], [], []
+
+    def index(when):
+        return min(max((_day(when) - start).days, 0), days)
+
+    for history in histories.values():
+        snapshots = history.snapshots
+        for i, (when, state) in enumerate(snapshots):
+            first = index(when)
+            last = index(snapshots[i + 1][0]) if i + 1 < len(snapshots) else days
+            if first >= last:
+                continue
+            is_open = state.get("status_id") not in closed
+            starts.append(first)
+            ends.append(last)
+            exists.append(1)
+            opened.append(1 if is_open else 0)
+            hours.append((state.get("estimated_hours") or 0.0) if is_open else 0.0)
+
+    if numpy is not None:
+        starts, ends = numpy.array(starts, dtype=int), numpy.array(ends, dtype=int)
+        series = []
+        for weights in (exists, opened, hours):
+            diff = numpy.zeros(days + 1)
+            numpy.add.at(diff, starts, weights)
+            numpy.subtract.at(diff, ends, weights)
+            series.append(numpy.cumsum(diff[:days]).tolist())
+    else:
+        series = []
+        for weights in (exists, opened, hours):
+            diff = [0.0] * (days + 1)
+            for first, last, weight in zip(starts, ends, weights):
+                diff[first] += weight
+                diff[last] -= weight
+            running, values = 0.0, []
+            for value in diff[:days]:
+                running += value
+                values.append(running)
+            series.append(values)
+    return {
+        "dates": [start + datetime.timedelta(days=i) for i in range(days)],
+        "total": [int(round(value)) for value in series[0]],
+        "open": [int(round(value)) for value in series[1]],
+        "remaining_hours": series[2],
+    }
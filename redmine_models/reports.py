@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.signals import post_delete, pre_save
+
+from .models import Project, TimeEntry, TimeEntryRollup
+
+# Report dimension -> TimeEntry column
+DIMENSIONS = {
+    "activity": "activity_id",
+    "author": "author_id",
+    "category": "issue__category_id",
+    "issue": "issue_id",
+    "project": "project_id",
+    "spent_on": "spent_on",
+    "status": "issue__status_id",
+    "tmonth": "tmonth",
+    "tracker": "issue__tracker_id",
+    "tweek": "tweek",
+    "tyear": "tyear",
+    "user": "user_id",
+    "version": "issue__fixed_version_id",
+}
+
+ROLLUP_DIMENSIONS = ("project", "user", "activity", "tyear", "tweek")
+
+
+def _lookups(filters, using):
+    """Translate ``{"project__in": [...], "spent_on__gte": d}`` style filters
+    on dimension names into ORM lookups.  ``project_tree`` selects a project
+    and all of its subprojects.
+    """
+    q = Q()
+    for key, value in (filters or {}).items():
+        if key == "project_tree":
+            project = (value if isinstance(value, Project)
+                       else Project.objects.using(using).get(pk=value))
+            q &= Q(project__lft__gte=project.lft, project__rgt__lte=project.rgt)
+            continue
+        name, sep, rest = key.partition("__")
+        if name not in DIMENSIONS:
+            raise ValueError("Unknown time report filter: %r" % key)
+        q &= Q(**{DIMENSIONS[name] + sep + rest: value})
+    return q
+
+
+def _can_use_rollup(group_by, filters):
+    names = set(group_by)
+    for key in (filters or {}):
+        names.add(key.partition("__")[0])
+    return names <= set(ROLLUP_DIMENSIONS) | set(["project_tree"])
+
+
+def time_report(group_by, filters=None, using=None, use_rollup=False):
+    """Sum ``TimeEntry.hours`` grouped by the given dimensions, in SQL.
+
+    Returns one dict per group holding the dimension values, ``hours`` and
+    ``entries``.  With ``use_rollup`` the pre-aggregated weekly table is read
+    instead when the dimensions and filters allow it.
+    """
+    using = using or settings.REDMINE_DATABASE
+    group_by = list(group_by)
+    for name in group_by:
+        if name not in DIMENSIONS:
+            raise ValueError("Unknown time report dimension: %r" % name)
+    if use_rollup and _can_use_rollup(group_by, filters):
+        rows = (TimeEntryRollup.objects.using(using).filter(_lookups(filters, using))
+                .values(*[DIMENSIONS[name] for name in group_by])
+                .annotate(total_hours=Sum("hours"), total_entries=Sum("entries")))
+    else:
+        rows = (TimeEntry.objects.using(using).filter(_lookups(filters, using))
+                .values(*[DIMENSIONS[name] for name in group_by])
+                .annotate(total_hours=Sum("hours"), total_entries=Count("pk")))
+    rows = rows.order_by(*[DIMENSIONS[name] for name in group_by])
+    report = []
+    for row in rows:
+        entry = dict((name, row[DIMENSIONS[name]]) for name in group_by)
+        entry["hours"] = row["total_hours"] or 0.0
+        entry["entries"] = row["total_entries"]
+        report.append(entry)
+    return report
+
+
+def hierarchy_totals(filters=None, using=None, use_rollup=False):
+    """Return ``{project_id: hours}`` where each project includes the time
+    spent on all of its subprojects, using Redmine's ``lft``/``rgt`` tree.
+    """
+    using = using or settings.REDMINE_DATABASE
+    own = defaultdict(float)
+    for row in time_report(["project"], filters, using, use_rollup):
+        own[row["project"]] = row["hours"]
+    totals = {}
+    stack = []
+    projects = (Project.objects.using(using).order_by("lft")
+                .values_list("id", "lft", "rgt"))
+    for pk, lft, rgt in projects:
+        while stack and stack[-1][1] < lft:
+            done = stack.pop()
+            if stack:
+                totals[stack[-1][0]] += totals[done[0]]
+        totals[pk] = own.get(pk, 0.0)
+        stack.append((pk, rgt))
+    while stack:
+        done = stack.pop()
+        if stack:
+            totals[stack[-1][0]] += totals[done[0]]
+    return totals
+
+
+_rollup_tables = {}
+
+
+def ensure_rollup_table(using=None):
+    using = using or settings.REDMINE_DATABASE
+    connection = connections[using]
+    if TimeEntryRollup._meta.db_table not in connection.introspection.table_names():
+        with connection.schema_editor() as editor:
+            editor.create_model(TimeEntryRollup)
+    _rollup_tables[using] = True
+
+
+def _has_rollup_table(using):
+    if using not in _rollup_tables:
+        _rollup_tables[using] = (TimeEntryRollup._meta.db_table
+                                 in connections[using].introspection.table_names())
+    return _rollup_tables[using]
+
+
+def _bucket_filters(buckets, size=100):
+    """Yield filters matching exactly the ``(project_id, tyear, tweek)``
+    ``buckets``, ``size`` project-years at a time."""
+    weeks = defaultdict(set)
+    for project_id, tyear, tweek in buckets:
+        weeks[(project_id, tyear)].add(tweek)
+    keys = sorted(weeks)
+    for start in range(0, len(keys), size):
+        region = Q()
+        for project_id, tyear in keys[start:start + size]:
+            region |= Q(project_id=project_id, tyear=tyear,
+                        tweek__in=sorted(weeks[(project_id, tyear)]))
+        yield region
+
+
+def _rebuild_buckets(using, entries, rollups):
+    rows = (entries.values(*[DIMENSIONS[name] for name in ROLLUP_DIMENSIONS])
+            .annotate(total_hours=Sum("hours"), total_entries=Count("pk"),
+                      last=Max("updated_on"))
+            .order_by())
+    rollups.delete()
+    TimeEntryRollup.objects.using(using).bulk_create([
+        TimeEntryRollup(
+            project_id=row["project_id"],
+            user_id=row["user_id"],
+            activity_id=row["activity_id"],
+            tyear=row["tyear"],
+            tweek=row["tweek"],
+            hours=row["total_hours"] or 0.0,
+            entries=row["total_entries"],
+            last_updated_on=row["last"],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+def refresh_rollup(using=None, full=False):
+    """Bring ``TimeEntryRollup`` up to date with ``TimeEntry``.
+
+    Only the ``(project, tyear, tweek)`` buckets of entries updated since the
+    last refresh are recomputed, along with the buckets marked stale when an
+    entry is moved out of them or deleted through Django.  Entries moved or
+    deleted by Redmine itself leave no trace here; ``full=True`` rebuilds the
+    whole table to catch up with them.
+    """
+    using = using or settings.REDMINE_DATABASE
+    entries = TimeEntry.objects.using(using)
+    rollups = TimeEntryRollup.objects.using(using)
+    with transaction.atomic(using=using):
+        since = rollups.aggregate(last=Max("last_updated_on"))["last"]
+        if full or since is None:
+            _rebuild_buckets(using, entries.all(), rollups.all())
+            return
+        buckets = set(entries.filter(updated_on__gte=since)
+                      .values_list("project_id", "tyear", "tweek").distinct())
+        buckets.update(rollups.filter(last_updated_on__isnull=True)
+                       .values_list("project_id", "tyear", "tweek").distinct())
+        for region in _bucket_filters(buckets):
+            _rebuild_buckets(using, entries.filter(region), rollups.filter(region))
+
+
+def _mark_stale(using, project_id, tyear, tweek):
+    """Clear ``last_updated_on`` so the next refresh recomputes the bucket."""
+    (TimeEntryRollup.objects.using(using)
+     .filter(project_id=project_id, tyear=tyear, tweek=tweek)
+     .update(last_updated_on=None))
+
+
+def _entry_saving(sender, instance, raw=False, using=None, **kwargs):
+    if raw or instance.pk is None or not _has_rollup_table(using):
+        return
+    old = (TimeEntry._base_manager.using(using).filter(pk=instance.pk)
+           .values_list("project_id", "tyear", "tweek").first())
+    if old is not None and old != (instance.project_id, instance.tyear, instance.tweek):
+        _mark_stale(using, *old)
+
+
+def _entry_deleted(sender, instance, using=None, **kwargs):
+    if _has_rollup_table(using):
+        _mark_stale(using, instance.project_id, instance.tyear, instance.tweek)
+
+
+pre_save.connect(_entry_saving, sender=TimeEntry,
+                 dispatch_uid="redmine_models.reports.TimeEntry")
+post_delete.connect(_entry_deleted, sender=TimeEntry,
+                    dispatch_uid="redmine_models.reports.TimeEntry.delete")
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Max, Min, Q, Sum
+
+from .cache import LRUCache
+from .permissions import PROJECT_ARCHIVED, PROJECT_SCHEDULED_FOR_DELETION
+
+# Version.status
+VERSION_OPEN = "open"
+VERSION_LOCKED = "locked"
+VERSION_CLOSED = "closed"
+
+ESTIMATED = Q(estimated_hours__gt=0)
+UNESTIMATED = Q(estimated_hours__isnull=True) | Q(estimated_hours__lte=0)
+CLOSED = Q(status__is_closed=True)
+OPEN = Q(status__is_closed=False)
+
+# Grouped per fixed_version; "weighted" sums estimated hours x done ratio
+# over estimated issues, "unestimated" the done ratios of the others.
+AGGREGATES = {
+    "count": Count("pk"),
+    "open_count": Count("pk", filter=OPEN),
+    "start_date": Min("start_date"),
+    "estimated": Sum("estimated_hours"),
+    "estimated_total": Sum("estimated_hours", filter=ESTIMATED),
+    "estimated_count": Count("pk", filter=ESTIMATED),
+    "closed_weighted": Sum("estimated_hours", filter=CLOSED & ESTIMATED),
+    "closed_unestimated": Count("pk", filter=CLOSED & UNESTIMATED),
+    "open_weighted": Sum(F("estimated_hours") * F("done_ratio"), filter=OPEN & ESTIMATED,
+                         output_field=FloatField()),
+    "open_unestimated": Sum("done_ratio", filter=OPEN & UNESTIMATED),
+}
+
+
+class VersionStats(object):
+    """Progress figures of a version, computed like Redmine's ``Version``.
+
+    Closed issues count as 100% done; issues without estimate weigh the
+    average estimate of the others (1 when none has one).  The date-based
+    flags take ``today``, defaulting to the current date.
+    """
+
+    def __init__(self, version, aggregates, spent_hours):
+        self.version = version
+        self.issues_count = aggregates.get("count") or 0
+        self.open_issues_count = aggregates.get("open_count") or 0
+        self.closed_issues_count = self.issues_count - self.open_issues_count
+        self.start_date = aggregates.get("start_date")
+        self.estimated_hours = float(aggregates.get("estimated") or 0)
+        self.spent_hours = float(spent_hours or 0)
+        if aggregates.get("estimated_count"):
+            average = aggregates["estimated_total"] / aggregates["estimated_count"]
+        else:
+            average = 1.0
+        self.estimated_average = average
+
+        def progress(weighted, unestimated):
+            if not self.issues_count:
+                return 0.0
+            return ((weighted or 0) + average * (unestimated or 0)) / (
+                average * self.issues_count)
+
+        self.closed_percent = progress(100 * (aggregates.get("closed_weighted") or 0),
+                                       100 * (aggregates.get("closed_unestimated") or 0))
+        if not self.issues_count:
+            self.completed_percent = 0.0
+        elif not self.open_issues_count:
+            self.completed_percent = 100.0
+        else:
+            self.completed_percent = self.closed_percent + progress(
+                aggregates.get("open_weighted"), aggregates.get("open_unestimated"))
+
+    @property
+    def due_date(self):
+        return self.version.effective_date
+
+    def completed(self, today=None):
+        today = today or datetime.date.today()
+        return self.version.status == VERSION_CLOSED or bool(
+            self.due_date and self.due_date < today and not self.open_issues_count)
+
+    def overdue(self, today=None):
+        today = today or datetime.date.today()
+        return bool(self.due_date and self.due_date < today and not self.completed(today))
+
+    def behind_schedule(self, today=None):
+        """Whether less is done than the time elapsed since the earliest
+        issue start date would call for."""
+        if self.completed_percent == 100 or not (self.due_date and self.start_date):
+            return False
+        days = (self.due_date - self.start_date).days + 1
+        done_date = self.start_date + datetime.timedelta(
+            days=int(days * self.completed_percent // 100))
+        return done_date <= (today or datetime.date.today())
+
+
+_aggregates = LRUCache(getattr(settings, "REDMINE_VERSION_STATS_CACHE_SIZE", 1000))
+
+
+def version_stats(versions, using=None):
+    """Return ``{version_id: VersionStats}`` with a constant number of
+    queries: one for the cache signatures, then one grouped aggregate over
+    issues and one over time entries for the versions that changed.
+
+    Figures are cached per version until the count or the latest
+    ``updated_on`` of its issues changes; time logged without touching an
+    issue shows up on the next such change.
+    """
+    from .models import Issue, TimeEntry
+
+    using = using or settings.REDMINE_DATABASE
+    versions = list(versions)
+    ids = [version.pk for version in versions]
+    signatures = dict(
+        (row["fixed_version_id"], (row["updated_on"], row["count"])) for row in
+        Issue.objects.using(using).filter(fixed_version_id__in=ids)
+        .values("fixed_version_id").order_by()
+        .annotate(updated_on=Max("updated_on"), count=Count("pk")))
+    found = {}
+    stale = []
+    for pk in ids:
+        cached = _aggregates.get((using, pk))
+        if cached is not None and cached[0] == signatures.get(pk):
+            found[pk] = cached[1]
+        else:
+            stale.append(pk)
+    if stale:
+        rows = dict((pk, {}) for pk in stale)
+        for row in (Issue.objects.using(using).filter(fixed_version_id__in=stale)
+                    .values("fixed_version_id").order_by().annotate(**AGGREGATES)):
+            rows[row.pop("fixed_version_id")] = row
+        spent = dict(
+            TimeEntry.objects.using(using).filter(issue__fixed_version_id__in=stale)
+            .values("issue__fixed_version_id").order_by()
+            .annotate(hours=Sum("hours")).values_list("issue__fixed_version_id", "hours"))
+        for pk in stale:
+            found[pk] = (rows[pk], spent.get(pk))
+            _aggregates.set((using, pk), (signatures.get(pk), found[pk]))
+    return dict((version.pk, VersionStats(version, *found[version.pk]))
+                for version in versions)
+
+
+def shared_versions(project, using=None):
+    """Versions usable in ``project``, following ``Version.sharing``: its
+    own, "system" ones, "tree" ones of its root's tree, "hierarchy" and
+    "descendants" ones of its ancestors and "hierarchy" ones of its
+    descendants, outside archived projects.
+    """
+    from .models import Project, Version
+
+    using = using or settings.REDMINE_DATABASE
+    if not isinstance(project, Project):
+        project = Project.objects.using(using).get(pk=project)
+    if project.parent_id is None:
+        root = project
+    else:
+        root = (Project.objects.using(using)
+                .filter(lft__lte=project.lft, rgt__gte=project.rgt, parent__isnull=True)
+                .first()) or project
+    shared = (
+        Q(sharing="system")
+        | Q(sharing="tree", project__lft__gte=root.lft, project__rgt__lte=root.rgt)
+        | Q(sharing__in=("hierarchy", "descendants"),
+            project__lft__lt=project.lft, project__rgt__gt=project.rgt)
+        | Q(sharing="hierarchy", project__lft__gt=project.lft, project__rgt__lt=project.rgt))
+    live = ~Q(project__status__in=(PROJECT_ARCHIVED, PROJECT_SCHEDULED_FOR_DELETION))
+    return (Version.objects.using(using)
+            .filter(Q(project_id=project.pk) | (live & shared))
+            .select_related("project"))
+
+
+def _sort_key(version):
+    # Version#<=>: dated versions first, by date, then by name
+    return (version.effective_date is None, version.effective_date or datetime.date.min,
+            version.name.lower(), version.pk)
+
+
+def roadmap(project, include_subprojects=False, completed=False, today=None, using=None):
+    """``[(version, VersionStats)]`` of a project's roadmap in Redmine's
+    order, leaving out closed and completed versions unless ``completed``.
+    """
+    from .models import Project, Version
+
+    using = using or settings.REDMINE_DATABASE
+    if not isinstance(project, Project):
+        project = Project.objects.using(using).get(pk=project)
+    versions = shared_versions(project, using)
+    if include_subprojects:
+        versions = versions | Version.objects.using(using).filter(
+            project__lft__gt=project.lft, project__rgt__lt=project.rgt).exclude(
+            project__status__in=(PROJECT_ARCHIVED, PROJECT_SCHEDULED_FOR_DELETION))
+    versions = sorted(set(versions), key=_sort_key)
+    stats = version_stats(versions, using)
+    return [(version, stats[version.pk]) for version in versions
+            if completed or not stats[version.pk].completed(today)]
@@ -2,20 +2,159 @@
 
 from __future__ import unicode_literals
 
+import threading
+import time
+from contextlib import contextmanager
+
 from django.conf import settings
+from django.utils.module_loading import import_string
+
+_local = threading.local()
+
+
+def pin_primary(seconds=None):
+    """Send the reads of the current thread to the primary database, so they
+    see the thread's own writes: for ``seconds``, or until :func:`unpin` is
+    called when not given.
+    """
+    if seconds is None:
+        _local.pinned = True
+    else:
+        _local.pinned_until = max(getattr(_local, "pinned_until", 0), time.time() + seconds)
+
+
+def unpin():
+    _local.pinned = False
+    _local.pinned_until = 0
+
+
+def is_pinned():
+    return (getattr(_local, "pinned", False)
+            or getattr(_local, "pinned_until", 0) > time.time())
+
+
+@contextmanager
+def use_primary():
+    state = getattr(_local, "pinned", False), getattr(_local, "pinned_until", 0)
+    pin_primary()
+    try:
+        yield
+    finally:
+        _local.pinned, _local.pinned_until = state
+
+
+class ReplicaPool(object):
+    """Smooth weighted round-robin over the healthy read replicas.
+
+    ``REDMINE_READ_DATABASES`` is a list of aliases or a dict mapping aliases
+    to integer weights.  When ``REDMINE_REPLICA_LAG_CHECK`` names a callable
+    taking an alias and returning its replication lag in seconds, replicas
+    lagging more than ``REDMINE_REPLICA_MAX_LAG`` (or failing the check) are
+    left out until the next check, at most every
+    ``REDMINE_REPLICA_CHECK_INTERVAL`` seconds.
+    """
+
+    def __init__(self, replicas, lag_check=None, max_lag=30,
+                 check_interval=10, clock=time.time):
+        if not isinstance(replicas, dict):
+            replicas = dict((alias, 1) for alias in replicas)
+        self.weights = replicas
+        self.lag_check = lag_check
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.clock = clock
+        self.ejected = {}
+        self._current = dict((alias, 0) for alias in replicas)
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        lag_check = getattr(settings, "REDMINE_REPLICA_LAG_CHECK", None)
+        if isinstance(lag_check, str):
+            lag_check = import_string(lag_check)
+        return cls(
+            getattr(settings, "REDMINE_READ_DATABASES", ()),
+            lag_check=lag_check,
+            max_lag=getattr(settings, "REDMINE_REPLICA_MAX_LAG", 30),
+            check_interval=getattr(settings, "REDMINE_REPLICA_CHECK_INTERVAL", 10),
+        )
+
+    def eject(self, alias, seconds=None):
+        """Leave ``alias`` out for ``seconds``, or until the next lag check."""
+        if seconds is None:
+            seconds = self.check_interval
+        with self._lock:
+            self.ejected[alias] = self.clock() + seconds
+
+    def healthy(self):
+        now = self.clock()
+        if self.lag_check is not None and (
+                self._checked_at is None
+                or now - self._checked_at >= self.check_interval):
+            self._checked_at = now
+            for alias in self.weights:
+                try:
+                    lag = self.lag_check(alias)
+                except Exception:
+                    lag = None
+                if lag is None or lag > self.max_lag:
+                    self.eject(alias)
+                else:
+                    with self._lock:
+                        self.ejected.pop(alias, None)
+        return [alias for alias in self.weights
+                if self.ejected.get(alias, 0) <= now]
+
+    def choose(self):
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        with self._lock:
+            total = 0
+            best = None
+            for alias in candidates:
+                self._current[alias] += self.weights[alias]
+                total += self.weights[alias]
+                if best is None or self._current[alias] > self._current[best]:
+                    best = alias
+            self._current[best] -= total
+        return best
 
 
 class DatabaseRouter(object):
+    """Send writes to ``REDMINE_DATABASE`` and reads to the replicas.
+
+    A write pins the reads of its thread to the primary for
+    ``REDMINE_PRIMARY_PIN_SECONDS`` (default ``REDMINE_REPLICA_MAX_LAG``), so
+    that they see it even outside of requests, in commands or tasks.
+    """
+
     app_name = "redmine_models"
 
+    def __init__(self):
+        self.replicas = ReplicaPool.from_settings()
+        self.pin_seconds = getattr(settings, "REDMINE_PRIMARY_PIN_SECONDS",
+                                   self.replicas.max_lag)
+
     def db_for_read(self, model, **hints):
         if model._meta.app_label == self.app_name:
+            if not is_pinned():
+                replica = self.replicas.choose()
+                if replica is not None:
+                    return replica
             return settings.REDMINE_DATABASE
 
     def db_for_write(self, model, **hints):
         if model._meta.app_label == self.app_name:
+            pin_primary(self.pin_seconds)
             return settings.REDMINE_DATABASE
 
+    def allow_relation(self, obj1, obj2, **hints):
+        if (obj1._meta.app_label == self.app_name
+                and obj2._meta.app_label == self.app_name):
+            return True
+
     def allow_migrate(self, db, app_label, model_name=None, **hints):
         if db == settings.REDMINE_DATABASE:
             return app_label == self.app_name
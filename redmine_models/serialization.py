@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import base64
+
+import yaml
+
+
+class RedmineLoader(yaml.SafeLoader):
+    """Safe YAML loader accepting the Ruby specific tags found in Redmine's
+    serialized columns (``!ruby/hash:ActiveSupport::HashWithIndifferentAccess``,
+    ``!ruby/object:...``, syck's ``!binary``).  Tagged nodes are loaded as
+    plain mappings, sequences and strings; no Ruby object is instantiated.
+    """
+
+
+def _construct_ruby(loader, tag_suffix, node):
+    if isinstance(node, yaml.MappingNode):
+        return loader.construct_mapping(node, deep=True)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_scalar(node)
+
+
+def _construct_binary(loader, node):
+    data = base64.b64decode(loader.construct_scalar(node))
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data
+
+
+RedmineLoader.add_multi_constructor("!ruby/", _construct_ruby)
+RedmineLoader.add_constructor("!binary", _construct_binary)
+
+
+def load_yaml(text):
+    if text is None or text == "":
+        return None
+    return yaml.load(text, Loader=RedmineLoader)
+
+
+def symbol_name(value):
+    """Strip the leading colon of a Ruby symbol dumped as ``:name``."""
+    if isinstance(value, str) and value.startswith(":"):
+        return value[1:]
+    return value
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+
+from .serialization import load_yaml
+
+# Subset of Redmine's config/settings.yml: name -> (default, serialized, format)
+DEFAULTS = {
+    "activity_days_default": (30, False, "int"),
+    "app_subtitle": ("Project management", False, None),
+    "app_title": ("Redmine", False, None),
+    "attachment_extensions_allowed": ("", False, None),
+    "attachment_extensions_denied": ("", False, None),
+    "attachment_max_size": (5120, False, "int"),
+    "autofetch_changesets": ("1", False, None),
+    "autologin": ("0", False, None),
+    "cache_formatted_text": ("0", False, None),
+    "commit_cross_project_ref": ("0", False, None),
+    "commit_logtime_activity_id": (0, False, "int"),
+    "commit_logtime_enabled": ("0", False, None),
+    "commit_ref_keywords": ("refs,references,IssueID", False, None),
+    "commit_update_keywords": ([], True, None),
+    "cross_project_issue_relations": ("0", False, None),
+    "cross_project_subtasks": ("tree", False, None),
+    "date_format": ("", False, None),
+    "default_language": ("en", False, None),
+    "default_notification_option": ("only_my_events", False, None),
+    "default_projects_modules": ([
+        "issue_tracking", "time_tracking", "news", "documents", "files",
+        "wiki", "repository", "boards", "calendar", "gantt",
+    ], True, None),
+    "default_projects_public": ("1", False, None),
+    "default_projects_tracker_ids": ([], True, None),
+    "diff_max_lines_displayed": (1500, False, "int"),
+    "display_subprojects_issues": ("1", False, None),
+    "enabled_scm": ([
+        "Subversion", "Darcs", "Mercurial", "Cvs", "Bazaar", "Git",
+    ], True, None),
+    "feeds_limit": (15, False, "int"),
+    "file_max_size_displayed": (512, False, "int"),
+    "gantt_items_limit": (500, False, "int"),
+    "gravatar_enabled": ("0", False, None),
+    "host_name": ("localhost:3000", False, None),
+    "issue_done_ratio": ("issue_field", False, None),
+    "issue_group_assignment": ("0", False, None),
+    "issue_list_default_columns": ([
+        "tracker", "status", "priority", "subject", "assigned_to", "updated_on",
+    ], True, None),
+    "issue_list_default_totals": ([], True, None),
+    "issues_export_limit": (500, False, "int"),
+    "login_required": ("0", False, None),
+    "mail_from": ("redmine@example.net", False, None),
+    "non_working_week_days": (["6", "7"], True, None),
+    "notified_events": (["issue_added", "issue_updated"], True, None),
+    "parent_issue_dates": ("derived", False, None),
+    "parent_issue_done_ratio": ("derived", False, None),
+    "parent_issue_priority": ("derived", False, None),
+    "password_min_length": (8, False, "int"),
+    "per_page_options": ("25,50,100", False, None),
+    "protocol": ("http", False, None),
+    "repository_log_display_limit": (100, False, "int"),
+    "rest_api_enabled": ("0", False, None),
+    "search_results_per_page": (10, False, "int"),
+    "self_registration": ("2", False, None),
+    "sequential_project_identifiers": ("0", False, None),
+    "start_of_week": ("", False, None),
+    "text_formatting": ("textile", False, None),
+    "time_entry_list_defaults": ({
+        "fields": ["spent_on", "user", "activity", "issue", "comments", "hours"],
+        "totals": ["hours"],
+    }, True, None),
+    "time_format": ("", False, None),
+    "timelog_required_fields": ([], True, None),
+    "ui_theme": ("", False, None),
+    "user_format": ("firstname_lastname", False, "symbol"),
+    "welcome_text": ("", False, None),
+    "wiki_compression": ("", False, None),
+}
+
+_decoded = {}
+_lock = threading.Lock()
+
+
+def decode_setting(name, value):
+    """Decode a raw ``Setting.value`` the way Redmine does.
+
+    Only serialized settings (and ``plugin_*`` ones) hold YAML; the others
+    are plain text, converted to int for numeric settings.
+    """
+    default, serialized, setting_format = DEFAULTS.get(name, (None, False, None))
+    if serialized or name.startswith("plugin_"):
+        value = load_yaml(value)
+    if setting_format == "int":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+    if setting_format == "symbol" and value:
+        return value.lstrip(":")
+    return value
+
+
+def redmine_settings(using=None):
+    """Return every setting decoded, with Redmine's defaults for missing rows.
+
+    Rows come from ``Setting.cached`` and are decoded once per reload of that
+    cache, which follows changes to ``Setting.updated_on``.  The returned
+    dict is shared and must not be modified.
+    """
+    from .models import Setting
+
+    generation = Setting.cached.generation(using)
+    decoded = _decoded.get(using)
+    if decoded is None or decoded[0] != generation:
+        values = dict((name, spec[0]) for name, spec in DEFAULTS.items())
+        for row in Setting.cached.all(using):
+            values[row.name] = decode_setting(row.name, row.value)
+        decoded = (generation, values)
+        with _lock:
+            _decoded[using] = decoded
+    return decoded[1]
+
+
+def redmine_setting(name, default=None, using=None):
+    return redmine_settings(using).get(name, default)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+from .cache import LRUCache
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Redmine writes SHA-256 digests since 3.4, MD5 before
+DIGEST_ALGORITHMS = {32: "md5", 64: "sha256"}
+
+
+def _file_size(fp):
+    try:
+        return os.fstat(fp.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = fp.tell()
+        size = fp.seek(0, os.SEEK_END)
+        fp.seek(position)
+        return size
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single-range ``Range``
+    header, None to serve the whole file, or False when unsatisfiable."""
+    match = RANGE_RE.match((header or "").strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if not length or not size:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class AttachmentStorage(object):
+    """Access to the files behind ``Attachment`` rows.
+
+    Subclasses implement :meth:`open` and may override :meth:`version`,
+    which keys cached digest results and should change with the file.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, workers=None, cache_size=None):
+        if workers is None:
+            workers = getattr(settings, "REDMINE_DIGEST_WORKERS", 4)
+        if cache_size is None:
+            cache_size = getattr(settings, "REDMINE_DIGEST_CACHE_SIZE", 10000)
+        self.workers = workers
+        self.results = LRUCache(cache_size)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def open(self, attachment):
+        """Return the file as a binary file object."""
+        raise NotImplementedError
+
+    def exists(self, attachment):
+        try:
+            self.open(attachment).close()
+        except (IOError, OSError):
+            return False
+        return True
+
+    def version(self, attachment):
+        return None
+
+    def size(self, attachment):
+        """Size of the file in bytes, which may differ from
+        ``attachment.filesize``."""
+        with self.open(attachment) as fp:
+            return _file_size(fp)
+
+    def chunks(self, attachment, start=0, end=None, chunk_size=None):
+        """Yield the bytes from ``start`` to ``end`` (inclusive, default the
+        end of the file) in ``chunk_size`` pieces."""
+        return self._chunks(self.open(attachment), start, end, chunk_size)
+
+    def _chunks(self, fp, start=0, end=None, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        with fp:
+            if start:
+                fp.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                data = fp.read(chunk_size if remaining is None
+                               else min(chunk_size, remaining))
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def response(self, attachment, request=None, as_attachment=True):
+        """Serve the file, streaming it and honouring a single-range
+        ``Range`` header of ``request``.  Sizes come from the opened file,
+        not from ``attachment.filesize``."""
+        fp = self.open(attachment)
+        size = _file_size(fp)
+        content_type = attachment.content_type or "application/octet-stream"
+        byte_range = None
+        if request is not None:
+            byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+        if byte_range is False:
+            fp.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % size
+            return response
+        if byte_range is None:
+            response = FileResponse(fp, as_attachment=as_attachment,
+                                    filename=attachment.filename)
+            response["Content-Type"] = content_type
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(self._chunks(fp, start, end),
+                                             status=206, content_type=content_type)
+            response["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+            response["Content-Length"] = str(end - start + 1)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    def compute_digest(self, attachment, algorithm=None):
+        """Hex digest of the file, computed chunk by chunk.  The algorithm
+        follows the length of ``attachment.digest`` unless given."""
+        if algorithm is None:
+            algorithm = DIGEST_ALGORITHMS.get(len(attachment.digest or ""), "sha256")
+        digest = hashlib.new(algorithm)
+        for chunk in self.chunks(attachment, chunk_size=1024 * 1024):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def verify(self, attachment):
+        """Whether the file matches ``attachment.digest``; False when it is
+        missing.  Results are cached until the file or the row changes."""
+        key = (attachment.pk, attachment.digest, self.version(attachment))
+        result = self.results.get(key)
+        if result is None:
+            try:
+                result = self.compute_digest(attachment) == (attachment.digest or "").lower()
+            except (IOError, OSError):
+                result = False
+            self.results.set(key, result)
+        return result
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def verify_async(self, attachment):
+        """Schedule :meth:`verify` on the background pool; returns a future."""
+        return self.pool.submit(self.verify, attachment)
+
+    def verify_many(self, attachments):
+        """Return ``{attachment_id: bool}``, hashing files in parallel."""
+        futures = [(attachment.pk, self.verify_async(attachment))
+                   for attachment in attachments]
+        return dict((pk, future.result()) for pk, future in futures)
+
+
+class FileSystemAttachmentStorage(AttachmentStorage):
+    """Files under Redmine's ``files`` directory, ``REDMINE_ATTACHMENTS_ROOT``."""
+
+    def __init__(self, root=None, **kwargs):
+        super(FileSystemAttachmentStorage, self).__init__(**kwargs)
+        root = root or getattr(settings, "REDMINE_ATTACHMENTS_ROOT", None)
+        if not root:
+            raise ImproperlyConfigured("REDMINE_ATTACHMENTS_ROOT is not set")
+        self.root = os.path.realpath(root)
+
+    def path(self, attachment):
+        path = os.path.realpath(os.path.join(
+            self.root, attachment.disk_directory or "", attachment.disk_filename))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise SuspiciousFileOperation(
+                "Attachment %s points outside of the attachments root" % attachment.pk)
+        return path
+
+    def open(self, attachment):
+        return open(self.path(attachment), "rb")
+
+    def exists(self, attachment):
+        return os.path.isfile(self.path(attachment))
+
+    def size(self, attachment):
+        return os.path.getsize(self.path(attachment))
+
+    def version(self, attachment):
+        try:
+            stat = os.stat(self.path(attachment))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def mmap(self, attachment):
+        """Read-only memory map of the file; close it when done.  Empty
+        files, which cannot be mapped, give an empty ``bytes``."""
+        with self.open(attachment) as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                return b""
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def attachment_storage():
+    """The storage named by ``REDMINE_ATTACHMENT_STORAGE`` (a dotted path,
+    default :class:`FileSystemAttachmentStorage`), created once."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                path = getattr(settings, "REDMINE_ATTACHMENT_STORAGE", None)
+                storage_class = (import_string(path) if path
+                                 else FileSystemAttachmentStorage)
+                _storage = storage_class()
+    return _storage
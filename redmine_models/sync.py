@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# Model name -> column bumped by Redmine whenever a row is created or changed
+SYNC_SOURCES = {
+    "Attachment": "created_on",
+    "Comment": "updated_on",
+    "Issue": "updated_on",
+    "Journal": "created_on",
+    "Message": "updated_on",
+    "News": "created_on",
+    "Project": "updated_on",
+    "TimeEntry": "updated_on",
+    "User": "updated_on",
+    "Version": "updated_on",
+    "WikiContent": "updated_on",
+}
+
+
+class FileCursorStore(object):
+    """Keep cursors in a JSON file, rewritten atomically on every change."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (IOError, OSError):
+            return {}
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def set(self, key, value):
+        data = self._load()
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".redmine-sync-")
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp)
+        os.replace(tmp, self.path)
+
+
+class CacheCursorStore(object):
+    """Keep cursors in one of Django's caches (which must be persistent)."""
+
+    def __init__(self, alias="default", prefix="redmine_models.sync:"):
+        self.alias = alias
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value):
+        if value is None:
+            self.cache.delete(self.prefix + key)
+        else:
+            self.cache.set(self.prefix + key, value, None)
+
+
+def encode_ids(ids):
+    """Compress sorted ids into ``[first, last]`` runs."""
+    runs = []
+    for pk in ids:
+        if runs and runs[-1][1] + 1 == pk:
+            runs[-1][1] = pk
+        else:
+            runs.append([pk, pk])
+    return runs
+
+
+def decode_ids(runs):
+    for first, last in runs:
+        for pk in range(first, last + 1):
+            yield pk
+
+
+class ChangeFeed(object):
+    """Yield the rows changed since the last run, one batch at a time.
+
+    Rows are ordered by ``(timestamp, id)`` and read after the cursor's
+    ``(timestamp, id)`` pair, so every batch is an index range scan.  Redmine
+    stores timestamps to the second, so a row with a lower id may still be
+    stamped with a second the feed has read: rows changed in the last
+    ``settle`` seconds are left for the next run.  The cursor of a batch is
+    saved when the next one is requested (or the feed is exhausted), which
+    gives at-least-once delivery across restarts.
+    """
+
+    def __init__(self, store, using=None, batch_size=1000,
+                 deletion_interval=3600, sources=None, settle=5):
+        self.store = store
+        self.using = using or settings.REDMINE_DATABASE
+        self.batch_size = batch_size
+        self.deletion_interval = deletion_interval
+        self.sources = sources or SYNC_SOURCES
+        self.settle = settle
+
+    def _source(self, name):
+        try:
+            column = self.sources[name]
+        except KeyError:
+            raise ValueError("No sync source for %r" % name)
+        return apps.get_model("redmine_models", name), column
+
+    def cursor(self, name):
+        """Return the saved timestamp and id."""
+        state = self.store.get(name)
+        if state is None:
+            return None, None
+        return parse_datetime(state["timestamp"]), state["id"]
+
+    def _horizon(self):
+        if settings.USE_TZ:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        else:
+            now = datetime.datetime.now()
+        return now - datetime.timedelta(seconds=self.settle)
+
+    def reset(self, name):
+        self.store.set(name, None)
+        self.store.set(name + ":ids", None)
+
+    def changes(self, name, fields=None):
+        """Yield lists of changed instances, or of dicts when ``fields``
+        are given (the timestamp column and ``id`` are always included).
+        """
+        model, column = self._source(name)
+        qs = (model._default_manager.using(self.using)
+              .filter(**{column + "__lt": self._horizon()})
+              .order_by(column, "pk"))
+        if fields is not None:
+            fields = list(fields)
+            qs = qs.values(*fields + [f for f in (column, "id") if f not in fields])
+        timestamp, last_pk = self.cursor(name)
+        while True:
+            page = qs
+            if timestamp is not None:
+                page = qs.filter(Q(**{column + "__gt": timestamp})
+                                 | Q(**{column: timestamp, "pk__gt": last_pk}))
+            rows = list(page[:self.batch_size])
+            if not rows:
+                return
+            yield rows
+            if fields is None:
+                timestamp, last_pk = getattr(rows[-1], column), rows[-1].pk
+            else:
+                timestamp, last_pk = rows[-1][column], rows[-1]["id"]
+            self.store.set(name, {"timestamp": timestamp.isoformat(), "id": last_pk})
+            if len(rows) < self.batch_size:
+                return
+
+    def deletions(self, name, force=False):
+        """Return the ids deleted since the previous check.
+
+        Diffing the id sets costs a full index scan, so it runs at most every
+        ``deletion_interval`` seconds; None is returned when not due.  The
+        first check only records the current ids.
+        """
+        model, column = self._source(name)
+        state = self.store.get(name + ":ids")
+        now = time.time()
+        if (state is not None and not force
+                and now - state["checked_at"] < self.deletion_interval):
+            return None
+        current = encode_ids(self._ids(model))
+        self.store.set(name + ":ids", {"checked_at": now, "runs": current})
+        if state is None:
+            return []
+        alive = set(decode_ids(current))
+        return [pk for pk in decode_ids(state["runs"]) if pk not in alive]
+
+    def _ids(self, model):
+        # paged by id rather than iterator(): no server-side cursor
+        ids = model._default_manager.using(self.using).order_by("pk").values_list(
+            "pk", flat=True)
+        page = ids
+        while True:
+            batch = list(page[:self.batch_size])
+            for pk in batch:
+                yield pk
+            if len(batch) < self.batch_size:
+                return
+            page = ids.filter(pk__gt=batch[-1])
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import difflib
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .cache import LRUCache
+
+
+def decompress(data, compression):
+    """Return the text of a ``WikiContentVersion.data`` blob.
+
+    Redmine's "gzip" compression is a zlib deflate stream; real gzip headers
+    are accepted as well.
+    """
+    if data is None:
+        return ""
+    data = bytes(data)
+    if compression == "gzip":
+        data = zlib.decompress(data, 15 + 32)
+    return data.decode("utf-8", "replace")
+
+
+def _pk(obj):
+    return getattr(obj, "pk", obj)
+
+
+def latest_contents(pages, using=None):
+    """Return ``{page_id: WikiContent}`` for many pages with one query."""
+    from .models import WikiContent
+
+    using = using or settings.REDMINE_DATABASE
+    contents = (WikiContent.objects.using(using)
+                .filter(page_id__in=set(_pk(p) for p in pages)))
+    return dict((content.page_id, content) for content in contents)
+
+
+class WikiHistory(object):
+    """Page history with decompressed texts and diffs kept in LRU caches.
+
+    Only the versions asked for are fetched and decompressed, several at a
+    time when needed; texts are cached by ``(page_id, version)`` and diffs by
+    ``(page_id, from_version, to_version)``.
+    """
+
+    def __init__(self, maxsize=None, using=None):
+        if maxsize is None:
+            maxsize = getattr(settings, "REDMINE_WIKI_CACHE_SIZE", 256)
+        self.using = using or settings.REDMINE_DATABASE
+        self.texts_cache = LRUCache(maxsize)
+        self.diffs_cache = LRUCache(maxsize)
+
+    def texts(self, page, versions):
+        """Return ``{version: text}``, loading the uncached versions at once."""
+        from .models import WikiContent, WikiContentVersion
+
+        page_id = _pk(page)
+        found = {}
+        missing = []
+        for version in versions:
+            text = self.texts_cache.get((page_id, version))
+            if text is None:
+                missing.append(version)
+            else:
+                found[version] = text
+        if missing:
+            rows = (WikiContentVersion.objects.using(self.using)
+                    .filter(page_id=page_id, version__in=missing)
+                    .values_list("version", "data", "compression"))
+            for version, data, compression in rows:
+                found[version] = decompress(data, compression)
+            if any(version not in found for version in missing):
+                # older Redmine versions keep the current text out of the
+                # versions table
+                current = (WikiContent.objects.using(self.using)
+                           .filter(page_id=page_id, version__in=missing)
+                           .values_list("version", "text").first())
+                if current is not None:
+                    found[current[0]] = current[1] or ""
+            for version in missing:
+                if version not in found:
+                    raise KeyError("Page %s has no version %s" % (page_id, version))
+                self.texts_cache.set((page_id, version), found[version])
+        return found
+
+    def text(self, page, version):
+        return self.texts(page, [version])[version]
+
+    def diff(self, page, from_version, to_version):
+        """Unified diff lines between two versions of a page."""
+        page_id = _pk(page)
+        key = (page_id, from_version, to_version)
+        lines = self.diffs_cache.get(key)
+        if lines is None:
+            texts = self.texts(page_id, [from_version, to_version])
+            lines = list(difflib.unified_diff(
+                texts[from_version].splitlines(),
+                texts[to_version].splitlines(),
+                "v%s" % from_version, "v%s" % to_version, lineterm=""))
+            self.diffs_cache.set(key, lines)
+        return lines
+
+    def history_diffs(self, page, versions):
+        """Yield ``(from_version, to_version, lines)`` for consecutive
+        versions, fetching every text needed in one query beforehand.
+        """
+        versions = sorted(versions)
+        self.texts(page, versions)
+        for from_version, to_version in zip(versions, versions[1:]):
+            yield from_version, to_version, self.diff(page, from_version, to_version)
+
+    def clear(self):
+        self.texts_cache.clear()
+        self.diffs_cache.clear()
+
+
+def titleize(title):
+    """Normalize a wiki link the way Redmine's ``Wiki.titleize`` does."""
+    title = re.sub(r"\s+", "_", title.strip())
+    title = re.sub(r"[,./?;|:]", "", title)
+    return title[:1].upper() + title[1:]
+
+
+class WikiIndex(object):
+    """Titles, parents and redirects of one wiki, loaded with two queries.
+
+    Lookups are case-insensitive like Redmine's.  Redirect chains are
+    followed in memory, across wikis through :func:`wiki_index`.
+    """
+
+    max_redirects = 20
+
+    def __init__(self, wiki, using=None):
+        self.wiki_id = _pk(wiki)
+        self.using = using or settings.REDMINE_DATABASE
+        self.load()
+
+    def _signature(self):
+        from .models import WikiPage, WikiRedirect
+
+        return (
+            WikiPage.objects.using(self.using).filter(wiki_id=self.wiki_id)
+            .aggregate(n=Count("pk"), last=Max("created_on")),
+            WikiRedirect.objects.using(self.using).filter(wiki_id=self.wiki_id)
+            .aggregate(n=Count("pk"), last=Max("created_on")),
+        )
+
+    def load(self):
+        from .models import WikiPage, WikiRedirect
+
+        pages = list(WikiPage.objects.using(self.using).filter(wiki_id=self.wiki_id)
+                     .values_list("id", "title", "parent_id", "created_on"))
+        redirects = list(WikiRedirect.objects.using(self.using)
+                         .filter(wiki_id=self.wiki_id).order_by("pk")
+                         .values_list("title", "redirects_to",
+                                      "redirects_to_wiki_id", "created_on"))
+        self.titles = dict((pk, title) for pk, title, parent_id, created_on in pages)
+        self.parents = dict((pk, parent_id) for pk, title, parent_id, created_on in pages)
+        self.by_title = dict((title.lower(), pk) for pk, title, parent_id, created_on in pages)
+        self.redirects = {}
+        for title, redirects_to, target_wiki_id, created_on in redirects:
+            if title:
+                self.redirects.setdefault(title.lower(), (
+                    target_wiki_id or self.wiki_id, redirects_to))
+        self.signature = (
+            {"n": len(pages), "last": max([p[3] for p in pages] or [None])},
+            {"n": len(redirects), "last": max([r[3] for r in redirects] or [None])},
+        )
+        self.checked_at = time.time()
+
+    def is_stale(self):
+        return self._signature() != self.signature
+
+    def find(self, title):
+        """Page id of ``title`` in this wiki, ignoring redirects."""
+        return self.by_title.get(titleize(title).lower())
+
+    def resolve(self, title):
+        """Return ``(wiki_id, page_id)`` for ``title``, following redirects.
+
+        None is returned for unknown titles and for redirect cycles.
+        """
+        index = self
+        seen = set()
+        for hop in range(self.max_redirects + 1):
+            key = titleize(title).lower()
+            page_id = index.by_title.get(key)
+            if page_id is not None:
+                return index.wiki_id, page_id
+            if (index.wiki_id, key) in seen or key not in index.redirects:
+                return None
+            seen.add((index.wiki_id, key))
+            target_wiki_id, title = index.redirects[key]
+            if target_wiki_id != index.wiki_id:
+                index = wiki_index(target_wiki_id, self.using)
+        return None
+
+    def tree(self):
+        """Return the page hierarchy as nested ``(page_id, title, children)``
+        tuples, ordered by title like Redmine's page index.
+        """
+        children = defaultdict(list)
+        for pk, parent_id in self.parents.items():
+            if parent_id not in self.titles:
+                parent_id = None
+            children[parent_id].append(pk)
+
+        def build(pk):
+            ordered = sorted(children.get(pk, ()), key=lambda c: self.titles[c].lower())
+            return [(c, self.titles[c], build(c)) for c in ordered]
+
+        return build(None)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def wiki_index(wiki, using=None):
+    """Shared :class:`WikiIndex` of ``wiki``, reloaded when pages or
+    redirects were added or removed.  Staleness is checked at most every
+    ``REDMINE_WIKI_INDEX_CHECK`` seconds (default 60).
+    """
+    using = using or settings.REDMINE_DATABASE
+    key = (using, _pk(wiki))
+    index = _indexes.get(key)
+    if index is None:
+        index = WikiIndex(wiki, using)
+        with _indexes_lock:
+            _indexes[key] = index
+    elif time.time() - index.checked_at >= getattr(
+            settings, "REDMINE_WIKI_INDEX_CHECK", 60):
+        if index.is_stale():
+            index.load()
+        index.checked_at = time.time()
+    return index
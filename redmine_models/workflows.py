@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+
+from django.conf import settings
+
+# Workflow.type
+TRANSITION = "WorkflowTransition"
+PERMISSION = "WorkflowPermission"
+
+# WorkflowPermission.rule
+READONLY = "readonly"
+REQUIRED = "required"
+
+
+def _pk(obj):
+    return getattr(obj, "pk", obj)
+
+
+def _consider_workflow(permissions):
+    # Role#consider_workflow?
+    return "add_issues" in permissions or "edit_issues" in permissions
+
+
+class WorkflowTable(object):
+    """Redmine's workflows, precompiled from ``Workflow.cached``.
+
+    Transitions are bitsets over ``IssueStatus`` ids, one per tracker, role
+    and old status (0 for new issues) and per author/assignee case, so that
+    the statuses allowed to a user are the union of a few integers.  Field
+    permissions are ``{field_name: rule}`` per tracker, role and old status.
+    """
+
+    def __init__(self, using=None):
+        from .models import IssueStatus, Workflow
+
+        self.using = using or settings.REDMINE_DATABASE
+        self.generation = Workflow.cached.generation(self.using)
+        # (tracker, role, old status) -> [bits for (author, assignee) rows]
+        rows = {}
+        self.rules = {}
+        for workflow in Workflow.cached.all(self.using):
+            key = (workflow.tracker_id, workflow.role_id, workflow.old_status_id)
+            if workflow.type == PERMISSION:
+                self.rules.setdefault(key, {})[workflow.field_name] = workflow.rule
+            elif workflow.type == TRANSITION or not workflow.type:
+                bits = rows.setdefault(key, [0, 0, 0, 0])
+                bits[2 * bool(workflow.author) + bool(workflow.assignee)] |= (
+                    1 << workflow.new_status_id)
+        # IssueStatus.new_statuses_allowed: authors and assignees get the
+        # rows of their case and the plain ones, both the rows of any case
+        self.transitions = {}
+        for key, (plain, assignee, author, both) in rows.items():
+            self.transitions[key] = (
+                plain,
+                plain | assignee | both,
+                plain | author | both,
+                plain | author | assignee | both,
+            )
+        self.statuses = dict((status.pk, status) for status in IssueStatus.cached.all(self.using))
+
+    def _index(self, index):
+        if index is None:
+            from .permissions import permission_index
+
+            index = permission_index(self.using)
+        return index
+
+    def _roles(self, issue, user, index):
+        if _pk(user) in index.admins:
+            role_ids = index.role_permissions
+        else:
+            role_ids = index.roles(user, issue.project_id)
+        return [role_id for role_id in role_ids
+                if _consider_workflow(index.role_permissions.get(role_id, ()))]
+
+    def transition_bits(self, tracker, roles, old_status, author=False, assignee=False):
+        case = 2 * bool(author) + bool(assignee)
+        bits = 0
+        tracker_id, old_status_id = _pk(tracker), _pk(old_status) or 0
+        for role_id in roles:
+            masks = self.transitions.get((tracker_id, role_id, old_status_id))
+            if masks is not None:
+                bits |= masks[case]
+        return bits
+
+    def statuses_in(self, bits):
+        """``IssueStatus`` rows whose bit is set, in position order."""
+        found = []
+        status_id = 0
+        while bits:
+            if bits & 1 and status_id in self.statuses:
+                found.append(self.statuses[status_id])
+            bits >>= 1
+            status_id += 1
+        return sorted(found, key=lambda status: (status.position or 0, status.pk))
+
+    def allowed_statuses(self, issue, user, index=None):
+        """Statuses ``issue`` may take, as ``Issue#new_statuses_allowed_to``:
+        its current status is included when any transition is allowed, a new
+        issue falls back to its tracker's default status.  Whether the issue
+        may be closed or reopened given its subtasks and blocking relations
+        is not checked.
+        """
+        index = self._index(index)
+        user_id = _pk(user)
+        roles = self._roles(issue, user, index)
+        author = user_id is not None and issue.author_id == user_id
+        assignee = user_id is not None and issue.assigned_to_id is not None and (
+            issue.assigned_to_id == user_id
+            or issue.assigned_to_id in index.groups.get(user_id, ()))
+        new = issue.pk is None
+        bits = self.transition_bits(issue.tracker_id, roles,
+                                    None if new else issue.status_id, author, assignee)
+        if bits and not new and issue.status_id:
+            bits |= 1 << issue.status_id
+        if not bits and new:
+            from .models import Tracker
+
+            default = Tracker.cached.get(issue.tracker_id, using=self.using).default_status_id
+            if default:
+                bits = 1 << default
+        return self.statuses_in(bits)
+
+    def field_rules(self, issue, user, index=None):
+        """``{field_name: "readonly" or "required"}`` for ``issue`` in its
+        current status, as ``Issue#workflow_rule_by_attribute``: a field
+        gets a rule only when every role of the user has one, the stricter
+        "required" when they disagree.
+        """
+        roles = self._roles(issue, user, self._index(index))
+        if not roles:
+            return {}
+        by_field = {}
+        for role_id in roles:
+            rules = self.rules.get((issue.tracker_id, role_id, issue.status_id or 0), {})
+            for field_name, rule in rules.items():
+                by_field.setdefault(field_name, []).append(rule)
+        return dict((field_name, rules[0] if len(set(rules)) == 1 else REQUIRED)
+                    for field_name, rules in by_field.items()
+                    if len(rules) >= len(roles))
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def workflow_table(using=None):
+    """Shared :class:`WorkflowTable`, rebuilt when ``Workflow.cached``
+    reloads the table."""
+    from .models import Workflow
+
+    using = using or settings.REDMINE_DATABASE
+    table = _tables.get(using)
+    if table is None or table.generation != Workflow.cached.generation(using):
+        table = WorkflowTable(using)
+        with _tables_lock:
+            _tables[using] = table
+    return table
+
+
+def allowed_statuses(issue, user, index=None, using=None):
+    """Statuses ``user`` may give ``issue``.  Roles come from ``index``, a
+    :class:`~redmine_models.permissions.PermissionIndex`, by default the
+    shared one of :func:`~redmine_models.permissions.permission_index`."""
+    return workflow_table(using).allowed_statuses(issue, user, index)
+
+
+def field_rules(issue, user, index=None, using=None):
+    """Read-only and required fields of ``issue`` for ``user``."""
+    return workflow_table(using).field_rules(issue, user, index)
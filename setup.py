@@ -28,6 +28,7 @@ setup(
         'Topic :: Office/Business :: Groupware',
         'Topic :: Internet :: WWW/HTTP :: Site Management',
     ],
-    install_requires=['django>=1.7'],
+    install_requires=['django>=1.7', 'PyYAML'],
+    extras_require={'numpy': ['numpy'], 'parquet': ['pyarrow']},
     requires=['django (>=1.7)'],
 )
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from redmine_models.models import (Enumeration, Issue, IssueStatus, Member,
+                                   MemberRole, Project, Role, TimeEntry, Tracker, User)
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def make_user(login="jsmith", **kwargs):
+    values = dict(login=login, hashed_password="", firstname="John", lastname=login,
+                  admin=False, status=1, mail_notification="", must_change_passwd=False,
+                  type="User")
+    values.update(kwargs)
+    return User.objects.create(**values)
+
+
+def make_group(name="Developers", **kwargs):
+    return make_user(login="", lastname=name, type="Group", **kwargs)
+
+
+def make_role(name="Developer", permissions=(), **kwargs):
+    """A role; ``permissions`` are names, stored as Redmine's YAML symbols."""
+    values = dict(name=name, builtin=0, issues_visibility="default",
+                  users_visibility="all", time_entries_visibility="all",
+                  all_roles_managed=True,
+                  permissions="---\n" + "".join("- :%s\n" % p for p in permissions))
+    values.update(kwargs)
+    return Role.objects.create(**values)
+
+
+def make_member(principal, project, *roles):
+    member = Member.objects.create(user=principal, project=project, mail_notification=False)
+    for role in roles:
+        MemberRole.objects.create(member=member, role=role)
+    return member
+
+
+def make_project(identifier="ecookbook", **kwargs):
+    values = dict(name=identifier, identifier=identifier, is_public=True, status=1,
+                  inherit_members=False, lft=1, rgt=2)
+    values.update(kwargs)
+    return Project.objects.create(**values)
+
+
+def make_issue(project=None, **kwargs):
+    """An issue with its required references, created as needed."""
+    values = dict(subject="Issue", done_ratio=0, lock_version=0, is_private=False,
+                  created_on=NOW, updated_on=NOW)
+    values.update(kwargs)
+    if project is None:
+        project = Project.objects.first() or make_project()
+    values.setdefault("author", User.objects.first() or make_user())
+    values.setdefault("tracker", Tracker.objects.first() or Tracker.objects.create(
+        name="Bug", is_in_chlog=True, is_in_roadmap=True))
+    values.setdefault("status", IssueStatus.objects.first() or IssueStatus.objects.create(
+        name="New", is_closed=False))
+    values.setdefault("priority", Enumeration.objects.filter(type="IssuePriority").first()
+                      or Enumeration.objects.create(name="Normal", type="IssuePriority",
+                                                    is_default=True, active=True))
+    return Issue.objects.create(project=project, **values)
+
+
+def make_time_entry(project, user, hours=1.0, spent_on=NOW.date(), **kwargs):
+    """A time entry with Redmine's ``tyear``/``tmonth``/``tweek`` derived
+    from ``spent_on``."""
+    values = dict(created_on=NOW, updated_on=NOW, tyear=spent_on.year,
+                  tmonth=spent_on.month, tweek=spent_on.isocalendar()[1])
+    values.update(kwargs)
+    values.setdefault("activity", Enumeration.objects.filter(type="TimeEntryActivity").first()
+                      or Enumeration.objects.create(name="Development",
+                                                    type="TimeEntryActivity",
+                                                    is_default=True, active=True))
+    return TimeEntry.objects.create(project=project, user=user, hours=hours,
+                                    spent_on=spent_on, **values)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+SECRET_KEY = "redmine-models-tests"
+
+INSTALLED_APPS = ["redmine_models"]
+
+# The replicas mirror the primary: the tests check where reads are routed,
+# the data is the same.
+DATABASES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+    "redmine": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:",
+                "TEST": {"DEPENDENCIES": []}},
+    "replica1": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:",
+                 "TEST": {"MIRROR": "redmine"}},
+    "replica2": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:",
+                 "TEST": {"MIRROR": "redmine"}},
+}
+DATABASE_ROUTERS = ["redmine_models.routers.DatabaseRouter"]
+
+REDMINE_DATABASE = "redmine"
+REDMINE_MODELS_MANAGED = True
+
+USE_TZ = False
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
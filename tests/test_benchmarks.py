@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks, skipped unless ``REDMINE_BENCHMARKS`` is set to a scale
+factor: 1 runs them at the documented sizes, 0.01 at a hundredth::
+
+    REDMINE_BENCHMARKS=1 python runtests.py tests.test_benchmarks
+"""
+
+from __future__ import unicode_literals
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unittest
+
+from django.db import connections
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from redmine_models.models import EnabledModule, Issue, Journal, JournalDetail, Role, User
+from redmine_models.permissions import PermissionIndex
+
+from .factories import NOW, make_issue, make_member, make_project, make_role, make_user
+from .test_permissions import issue_visible
+
+SCALE = float(os.environ.get("REDMINE_BENCHMARKS") or 0)
+
+
+def scaled(count):
+    return max(1, int(count * SCALE))
+
+
+def timed(function, repeat=3):
+    """Return the best time of ``repeat`` calls and the last result."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(title, **figures):
+    sys.stderr.write("\n%s\n" % title)
+    for name, value in figures.items():
+        sys.stderr.write("  %-28s %s\n" % (name, value))
+
+
+def traced(function):
+    """Return the time, the peak of traced memory and the result of a call."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def megabytes(size):
+    return "%.1f MB" % (size / 1024.0 / 1024)
+
+
+def make_issues(count, projects, users, **kwargs):
+    """``count`` issues spread over ``projects``, written with bulk_create."""
+    template = make_issue(projects[0], author=users[0])
+    rng = random.Random(count)
+    issues = []
+    for i in range(count - 1):
+        issues.append(Issue(
+            project=rng.choice(projects), tracker_id=template.tracker_id,
+            status_id=template.status_id, priority_id=template.priority_id,
+            author=rng.choice(users), subject="Issue %d" % i, done_ratio=0,
+            lock_version=0, is_private=rng.random() < 0.2, created_on=NOW,
+            updated_on=NOW, assigned_to=rng.choice(users) if rng.random() < 0.5 else None,
+            **kwargs))
+    Issue.objects.bulk_create(issues, batch_size=5000)
+
+
+@unittest.skipUnless(SCALE, "set REDMINE_BENCHMARKS to run the benchmarks")
+class IssueVisibilityBenchmark(TestCase):
+    """``visible_to()`` against ``Issue#visible?`` checked in Python over
+    100k issues."""
+
+    databases = {"redmine"}
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        roles = [make_role(name, ["view_issues"], issues_visibility=visibility)
+                 for name, visibility in [("Manager", "all"), ("Developer", "default"),
+                                          ("Reporter", "own")]]
+        make_role("Non member", ["view_issues"], builtin=1)
+        make_role("Anonymous", ["view_issues"], builtin=2)
+        projects = []
+        for i in range(scaled(200)):
+            project = make_project("project-%d" % i, is_public=i % 2 == 0)
+            EnabledModule.objects.create(project=project, name="issue_tracking")
+            projects.append(project)
+        users = [make_user("user-%d" % i) for i in range(scaled(500))]
+        for user in users:
+            for project in rng.sample(projects, min(len(projects), 5)):
+                make_member(user, project, rng.choice(roles))
+        make_issues(scaled(100000), projects, users)
+        cls.user = users[0]
+
+    def test_visible_to(self):
+        index = PermissionIndex()
+        visibility = dict(Role.objects.values_list("pk", "issues_visibility"))
+        user = User.objects.get(pk=self.user.pk)
+        columns = ("id", "project_id", "author_id", "assigned_to_id", "is_private")
+
+        def python_side():
+            return [issue.pk for issue in Issue.objects.only(*columns).order_by("pk")
+                    if issue_visible(issue, user, index, visibility)]
+
+        def in_sql():
+            return list(Issue.objects.visible_to(user).order_by("pk")
+                        .values_list("pk", flat=True))
+
+        def python_page():
+            return python_side()[:25]
+
+        def sql_page():
+            issues = Issue.objects.visible_to(user).order_by("-pk")
+            return issues.count(), list(issues[:25])
+
+        python_time, expected = timed(python_side)
+        sql_time, found = timed(in_sql)
+        page_python, page = timed(python_page)
+        page_sql, (count, page) = timed(sql_page)
+        self.assertEqual(found, expected)
+        self.assertEqual(count, len(expected))
+        report("Issue visibility over %d issues" % Issue.objects.count(),
+               visible="%d" % len(expected),
+               python_filtering="%.3fs" % python_time,
+               visible_to="%.3fs" % sql_time,
+               python_page="%.3fs" % page_python,
+               visible_to_count_and_page="%.3fs" % page_sql)
+
+
+@unittest.skipUnless(SCALE, "set REDMINE_BENCHMARKS to run the benchmarks")
+class StreamMemoryBenchmark(TestCase):
+    """Memory held by ``stream()`` over a 500k then a 5M-row table."""
+
+    databases = {"redmine"}
+
+    def fill(self, journal, count):
+        """Add plain INSERTed journal details up to ``count`` rows."""
+        table = JournalDetail._meta.db_table
+        existing = JournalDetail.objects.count()
+        with connections["redmine"].cursor() as cursor:
+            for first in range(existing, count, 100000):
+                cursor.executemany(
+                    "INSERT INTO %s (journal_id, property, prop_key, old_value, value)"
+                    " VALUES (%%s, 'attr', 'status_id', %%s, %%s)" % table,
+                    [(journal.pk, str(i), str(i + 1))
+                     for i in range(first, min(count, first + 100000))])
+
+    def test_stream(self):
+        issue = make_issue()
+        journal = Journal.objects.create(journalized_id=issue.pk, journalized_type="Issue",
+                                         user_id=issue.author_id, created_on=NOW,
+                                         private_notes=False)
+
+        def count(rows):
+            n = 0
+            for row in rows:
+                n += 1
+            return n
+
+        figures = {}
+        peaks = []
+        for size in (scaled(500000), scaled(5000000)):
+            self.fill(journal, size)
+            elapsed, peak, found = traced(
+                lambda: count(JournalDetail.objects.stream(batch_size=5000)))
+            self.assertEqual(found, size)
+            peaks.append(peak)
+            figures["stream %d rows" % size] = "%.1fs, peak %s" % (elapsed, megabytes(peak))
+            elapsed, found = timed(
+                lambda: count(JournalDetail.objects.values("id", "value")
+                              .stream(batch_size=5000)), repeat=1)
+            figures["stream values %d rows" % size] = "%.2fs" % elapsed
+        elapsed, peak, found = traced(
+            lambda: len(list(JournalDetail.objects.all()[:scaled(500000)])))
+        figures["list %d rows" % found] = "%.1fs, peak %s" % (elapsed, megabytes(peak))
+        report("JournalDetail.objects.stream()", **figures)
+        # flat: ten times the rows, about the same peak
+        self.assertLess(peaks[1], 2 * peaks[0])
+
+
+@unittest.skipUnless(SCALE, "set REDMINE_BENCHMARKS to run the benchmarks")
+class IssueTreeBenchmark(TestCase):
+    """``subtree_of()`` against walking ``parent_id`` one query per issue,
+    in 200k issues split into trees of 1111 (ten children per issue, three
+    levels deep)."""
+
+    databases = {"redmine"}
+    fanout = 10
+    levels = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        template = make_issue()
+        cls.roots = []
+        issues = []
+        next_id = [template.pk + 1]
+
+        def grow(parent, root_id, lft, level):
+            issue = Issue(
+                pk=next_id[0], project_id=template.project_id,
+                tracker_id=template.tracker_id, status_id=template.status_id,
+                priority_id=template.priority_id, author_id=template.author_id,
+                subject="Issue %d" % next_id[0], done_ratio=0, lock_version=0,
+                is_private=False, created_on=NOW, updated_on=NOW,
+                parent_id=parent and parent.pk, root_id=root_id or next_id[0], lft=lft)
+            next_id[0] += 1
+            issues.append(issue)
+            rgt = lft + 1
+            if level < cls.levels:
+                for i in range(cls.fanout):
+                    rgt = grow(issue, issue.root_id, rgt, level + 1) + 1
+            issue.rgt = rgt
+            return rgt
+
+        size = sum(cls.fanout ** level for level in range(cls.levels + 1))
+        for i in range(max(1, scaled(200000) // size)):
+            grow(None, None, 1, 0)
+            cls.roots.append(issues[-size])
+            if len(issues) >= 50000:
+                Issue.objects.bulk_create(issues, batch_size=5000)
+                issues = []
+        Issue.objects.bulk_create(issues, batch_size=5000)
+
+    def test_subtree_of(self):
+        root = self.roots[len(self.roots) // 2]
+
+        def recursive():
+            def walk(node):
+                node.tree_children = list(Issue.objects.filter(parent_id=node.pk)
+                                          .order_by("lft"))
+                for child in node.tree_children:
+                    walk(child)
+                return node
+            return walk(Issue.objects.get(pk=root.pk))
+
+        def nested_set():
+            return Issue.objects.subtree_of(Issue.objects.get(pk=root.pk))
+
+        def flatten(node):
+            return [node.pk] + [pk for child in node.tree_children for pk in flatten(child)]
+
+        recursive_time, expected = timed(recursive)
+        nested_time, found = timed(nested_set)
+        with CaptureQueriesContext(connections["redmine"]) as walked:
+            recursive()
+        with CaptureQueriesContext(connections["redmine"]) as ranged:
+            nested_set()
+        self.assertEqual(flatten(found), flatten(expected))
+        report("Issue subtree of %d in %d issues" % (len(flatten(found)),
+                                                    Issue.objects.count()),
+               parent_traversal="%.3fs, %d queries" % (recursive_time,
+                                                      len(walked.captured_queries)),
+               subtree_of="%.3fs, %d queries" % (nested_time,
+                                                len(ranged.captured_queries)))
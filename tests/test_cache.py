@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models.models import Tracker
+
+
+class TableCacheTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.tracker = Tracker.objects.create(name="Bug", is_in_chlog=True,
+                                              is_in_roadmap=True)
+
+    def test_lookups(self):
+        self.assertEqual(Tracker.cached.get(self.tracker.pk).name, "Bug")
+        self.assertEqual(Tracker.cached.get(name="Bug").pk, self.tracker.pk)
+        with self.assertRaises(Tracker.DoesNotExist):
+            Tracker.cached.get(name="Feature")
+
+    def test_save_invalidates(self):
+        Tracker.cached.get(self.tracker.pk)
+        self.tracker.name = "Defect"
+        self.tracker.save()
+        with self.assertNumQueries(2, using="redmine"):
+            self.assertEqual(Tracker.cached.get(self.tracker.pk).name, "Defect")
+        self.tracker.delete()
+        self.assertEqual(Tracker.cached.all(), [])
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models.commit_refs import ReferenceParser, scan_changesets
+from redmine_models.models import Changeset, ChangesetsIssue, Repository
+
+from .factories import NOW, make_issue, make_project
+
+
+class ScanChangesetsTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.parser = ReferenceParser(["refs"], ["fixes"])
+        project = make_project()
+        self.issues = [make_issue(project) for i in range(3)]
+        repository = Repository.objects.create(project=project, url="/repo",
+                                               type="Repository::Git", is_default=True)
+        ids = [issue.pk for issue in self.issues]
+        self.changesets = [
+            Changeset.objects.create(repository=repository, revision=str(i),
+                                     committed_on=NOW, comments=comments)
+            for i, comments in enumerate(["refs #%d fixes #%d" % tuple(ids[:2]),
+                                          "fixes #%d, #%d and #%d" % tuple(ids)])]
+
+    def links(self):
+        return sorted(ChangesetsIssue.objects.values_list("changeset_id", "issue_id"))
+
+    def test_counts_new_links_only(self):
+        first, second = self.changesets
+        ChangesetsIssue.objects.create(changeset=first, issue=self.issues[0])
+        result = scan_changesets(parser=self.parser, batch_size=1)
+        self.assertEqual((result.changesets, result.references, result.linked), (2, 4, 1))
+        self.assertEqual(result.fixes, [(first.pk, self.issues[1].pk, "fixes")] + [
+            (second.pk, issue.pk, "fixes") for issue in self.issues])
+        self.assertEqual(len(self.links()), 5)
+
+        result = scan_changesets(parser=self.parser)
+        self.assertEqual((result.references, result.linked, result.fixes), (0, 5, []))
+        self.assertEqual(len(self.links()), 5)
+
+    def test_workers(self):
+        result = scan_changesets(parser=self.parser, workers=2)
+        self.assertEqual((result.changesets, result.references), (2, 5))
+        self.assertEqual(self.links(), sorted(
+            [(self.changesets[0].pk, issue.pk) for issue in self.issues[:2]]
+            + [(self.changesets[1].pk, issue.pk) for issue in self.issues]))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import NotSupportedError, connections, transaction
+from django.test import TransactionTestCase
+
+from redmine_models import indexes
+
+
+class IndexCommandsTest(TransactionTestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.addCleanup(self.drop_supplementary_indexes)
+
+    def drop_supplementary_indexes(self):
+        with connections["redmine"].schema_editor() as editor:
+            for name, model_indexes in indexes.SUPPLEMENTARY_INDEXES.items():
+                model = indexes._model(name)
+                live = indexes.live_indexes(model, "redmine")
+                for index in model_indexes:
+                    if indexes._columns(model, index.fields) in live:
+                        editor.remove_index(model, index)
+
+    def command(self, name, *args):
+        out = StringIO()
+        call_command(name, *args, database="redmine", stdout=out)
+        return out.getvalue()
+
+    def test_check_reports_missing_supplementary_indexes(self):
+        output = self.command("redmine_check_indexes")
+        for model_indexes in indexes.SUPPLEMENTARY_INDEXES.values():
+            for index in model_indexes:
+                self.assertIn("run redmine_create_indexes to add %s" % index.name, output)
+        self.assertNotIn("Missing index", output)
+        with self.assertRaises(CommandError):
+            self.command("redmine_check_indexes", "--fail")
+
+    def test_create_is_idempotent(self):
+        names = sorted(index.name for model_indexes in indexes.SUPPLEMENTARY_INDEXES.values()
+                       for index in model_indexes)
+        output = self.command("redmine_create_indexes", "--dry-run")
+        self.assertEqual(sorted(line.split()[2] for line in output.splitlines()), names)
+        output = self.command("redmine_create_indexes")
+        self.assertEqual(sorted(line.split()[1] for line in output.splitlines()), names)
+        self.assertEqual(self.command("redmine_create_indexes"), "Nothing to create.\n")
+        self.assertEqual(self.command("redmine_check_indexes"),
+                         "All expected indexes are present.\n")
+        self.command("redmine_check_indexes", "--fail")
+
+    def test_concurrent_creation_refused_in_a_transaction(self):
+        connection = connections["redmine"]
+        vendor = connection.vendor
+        connection.vendor = "postgresql"
+        try:
+            with transaction.atomic(using="redmine"):
+                with self.assertRaises(NotSupportedError):
+                    indexes.create_supplementary_indexes("redmine")
+                # a dry run only lists them
+                self.assertEqual(len(indexes.create_supplementary_indexes(
+                    "redmine", dry_run=True)), 4)
+        finally:
+            connection.vendor = vendor
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import router
+from django.test import TransactionTestCase, override_settings
+
+from redmine_models.instrumentation import record_queries
+from redmine_models.models import Tracker
+from redmine_models.routers import ReplicaPool, unpin
+
+
+@override_settings(REDMINE_READ_DATABASES=["replica1", "replica2"])
+class RecordQueriesTest(TransactionTestCase):
+    databases = {"redmine", "replica1", "replica2"}
+
+    def setUp(self):
+        self.router = router.routers[0]
+        self.saved = self.router.replicas
+        self.router.replicas = ReplicaPool(["replica1", "replica2"])
+        unpin()
+
+    def tearDown(self):
+        self.router.replicas = self.saved
+        unpin()
+
+    def test_replica_reads_are_recorded(self):
+        with record_queries() as recorder:
+            for i in range(4):
+                list(Tracker.objects.all())
+            Tracker.objects.create(name="Bug", is_in_chlog=True, is_in_roadmap=True)
+        self.assertEqual(recorder.by_alias(), {"replica1": 2, "replica2": 2, "redmine": 1})
+        stats = recorder.by_table()
+        self.assertEqual(stats["replica1", "trackers", "Tracker", "select"].queries, 2)
+        self.assertEqual(stats["redmine", "trackers", "Tracker", "insert"].queries, 1)
+        self.assertIn('database="replica2",table="trackers"', recorder.to_prometheus())
+
+    def test_single_alias(self):
+        with record_queries("redmine") as recorder:
+            list(Tracker.objects.all())
+        self.assertEqual(recorder.total, 0)
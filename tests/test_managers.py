@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models.managers import ISSUE_RELATED
+from redmine_models.models import (Change, Changeset, ChangesetsIssue, CustomField,
+                                   CustomValue, Enumeration, Issue, Journal,
+                                   JournalDetail, Repository, TimeEntry, Version,
+                                   Watcher)
+
+from .factories import NOW, make_issue
+
+class PresetQueryCountTest(TestCase):
+    """Each preset runs a fixed number of queries, whatever the row count."""
+
+    databases = {"redmine"}
+
+    @classmethod
+    def setUpTestData(cls):
+        parent = make_issue(subject="Parent")
+        user, project = parent.author, parent.project
+        version = Version.objects.create(project=project, name="1.0", sharing="none")
+        activity = Enumeration.objects.create(name="Development", type="TimeEntryActivity",
+                                              is_default=False, active=True)
+        field = CustomField.objects.create(
+            type="IssueCustomField", name="Story points", field_format="int",
+            is_required=False, is_for_all=True, is_filter=False, searchable=False,
+            editable=True, visible=True, multiple=False)
+        repository = Repository.objects.create(project=project, url="/git", is_default=True,
+                                               type="Repository::Git", extra_info="")
+        for i in range(4):
+            issue = make_issue(project, parent=parent, assigned_to=user,
+                               fixed_version=version, author=user)
+            CustomValue.objects.create(customized_type="Issue", customized_id=issue.pk,
+                                       custom_field=field, value=str(i))
+            Watcher.objects.create(watchable_type="Issue", watchable_id=issue.pk, user=user)
+            TimeEntry.objects.create(project=project, user=user, author=user, issue=issue,
+                                     hours=1, activity=activity, spent_on=NOW.date(),
+                                     tyear=2024, tmonth=1, tweek=1,
+                                     created_on=NOW, updated_on=NOW)
+            journal = Journal.objects.create(journalized_type="Issue", journalized_id=issue.pk,
+                                             user=user, created_on=NOW, private_notes=False)
+            JournalDetail.objects.create(journal=journal, property="attr",
+                                         prop_key="status_id", old_value="1", value="2")
+            changeset = Changeset.objects.create(repository=repository, revision=str(i),
+                                                 committed_on=NOW, user=user)
+            ChangesetsIssue.objects.create(changeset=changeset, issue=issue)
+            Change.objects.create(changeset=changeset, action="M", path="/README")
+
+    def setUp(self):
+        # reference tables come from their cache, loaded here
+        CustomField.cached.all()
+
+    def touch_issue(self, issue):
+        for name in ISSUE_RELATED:
+            getattr(issue, name)
+
+    def test_issue_for_list(self):
+        with self.assertNumQueries(1, using="redmine"):
+            for issue in Issue.objects.for_list():
+                self.touch_issue(issue)
+                issue.tracker.name, issue.status.name
+
+    def test_issue_for_detail(self):
+        # the issues, children, relations both ways, then one query per
+        # polymorphic relation: journals, attachments, watchers, custom values
+        with self.assertNumQueries(1 + 3 + 4, using="redmine"):
+            for issue in Issue.objects.for_detail():
+                self.touch_issue(issue)
+                issue.parent
+                list(issue.children.all())
+                list(issue.related_to.all())
+                list(issue.related_from.all())
+                list(issue.journals.all())
+                list(issue.attachments.all())
+                list(issue.watchers.all())
+                list(issue.custom_values.all())
+
+    def test_issue_for_export(self):
+        with self.assertNumQueries(2, using="redmine"):
+            issues = list(Issue.objects.for_export())
+            for issue in issues:
+                self.touch_issue(issue)
+        self.assertEqual(sorted(issue.custom_field_values.get("Story points")
+                                for issue in issues[1:]), [0, 1, 2, 3])
+
+    def touch_time_entry(self, entry):
+        entry.project.name, entry.user.lastname, entry.activity.name
+        entry.issue.subject, entry.issue.tracker.name
+
+    def test_time_entry_for_list(self):
+        with self.assertNumQueries(1, using="redmine"):
+            for entry in TimeEntry.objects.for_list():
+                self.touch_time_entry(entry)
+
+    def test_time_entry_for_detail(self):
+        with self.assertNumQueries(2, using="redmine"):
+            for entry in TimeEntry.objects.for_detail():
+                self.touch_time_entry(entry)
+                entry.author
+                list(entry.custom_values.all())
+
+    def test_time_entry_for_export(self):
+        # no time entry custom field, so no custom value query
+        with self.assertNumQueries(1, using="redmine"):
+            for entry in TimeEntry.objects.for_export():
+                self.touch_time_entry(entry)
+                entry.custom_field_values
+
+    def test_journal_for_list(self):
+        with self.assertNumQueries(2, using="redmine"):
+            for journal in Journal.objects.for_list():
+                journal.user.login
+                list(journal.journaldetail_set.all())
+
+    def test_journal_for_detail(self):
+        with self.assertNumQueries(3, using="redmine"):
+            for journal in Journal.objects.for_detail():
+                journal.user.login
+                list(journal.journaldetail_set.all())
+                journal.journalized.subject
+
+    def test_journal_for_export(self):
+        with self.assertNumQueries(2, using="redmine"):
+            for journal in Journal.objects.for_export():
+                list(journal.journaldetail_set.all())
+
+    def test_changeset_for_list(self):
+        with self.assertNumQueries(1, using="redmine"):
+            for changeset in Changeset.objects.for_list():
+                changeset.repository.url, changeset.user.login
+
+    def test_changeset_for_detail(self):
+        with self.assertNumQueries(3, using="redmine"):
+            for changeset in Changeset.objects.for_detail():
+                changeset.repository.project.name, changeset.user.login
+                list(changeset.change_set.all())
+                for link in changeset.changesetsissue_set.all():
+                    link.issue.tracker.name, link.issue.status.name
+
+    def test_changeset_for_export(self):
+        with self.assertNumQueries(1, using="redmine"):
+            for changeset in Changeset.objects.for_export():
+                changeset.repository.url, changeset.user.login
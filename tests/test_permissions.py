@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models.models import EnabledModule, GroupUser, Issue, Role, User
+from redmine_models.permissions import (BUILTIN_ANONYMOUS, BUILTIN_NON_MEMBER,
+                                        PROJECT_ARCHIVED, PermissionIndex)
+
+from .factories import (make_group, make_issue, make_member, make_project, make_role,
+                        make_user)
+
+
+def issue_visible(issue, user, index, visibility):
+    """Redmine's ``Issue#visible?`` checked in Python, one issue at a time;
+    ``visibility`` maps role ids to their ``issues_visibility``."""
+    user_id = getattr(user, "pk", user)
+    if not index.allowed(user_id, "view_issues", issue.project_id):
+        return False
+    if user_id in index.admins:
+        return True
+    principals = set([user_id]) | index.groups.get(user_id, set()) if user_id else set()
+    own = user_id is not None and (issue.author_id == user_id
+                                   or issue.assigned_to_id in principals)
+    for role_id in index.roles(user_id, issue.project_id):
+        if "view_issues" not in index.role_permissions.get(role_id, ()):
+            continue
+        if visibility[role_id] == "all" or own or (
+                visibility[role_id] == "default" and not issue.is_private):
+            return True
+    return False
+
+
+class IssueVisibilityTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.manager = make_role("Manager", ["view_issues"], issues_visibility="all")
+        self.developer = make_role("Developer", ["view_issues"])
+        self.reporter = make_role("Reporter", ["view_issues"], issues_visibility="own")
+        make_role("Non member", ["view_issues"], builtin=BUILTIN_NON_MEMBER)
+        make_role("Anonymous", ["view_issues"], builtin=BUILTIN_ANONYMOUS)
+
+        self.private = self.project("private", is_public=False)
+        self.public = self.project("public")
+        self.author = make_user("author")
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        self.carol = make_user("carol")
+        self.admin = make_user("admin", admin=True)
+        make_member(self.alice, self.private, self.developer)
+        make_member(self.bob, self.private, self.reporter)
+
+        self.issues = {}
+        for name, project, kwargs in [
+                ("open", self.private, {}),
+                ("private", self.private, {"is_private": True}),
+                ("alice's", self.private, {"is_private": True, "author": self.alice}),
+                ("bob's", self.private, {"is_private": True, "assigned_to": self.bob}),
+                ("public", self.public, {}),
+                ("public private", self.public, {"is_private": True}),
+                ("carol's", self.public, {"is_private": True, "author": self.carol})]:
+            self.issues[name] = make_issue(project, **dict({"author": self.author}, **kwargs))
+        make_issue(self.project("archived", status=PROJECT_ARCHIVED), author=self.author)
+        make_issue(self.project("no tracking", modules=()), author=self.author)
+
+    def project(self, identifier, modules=("issue_tracking",), **kwargs):
+        project = make_project(identifier, **kwargs)
+        for name in modules:
+            EnabledModule.objects.create(project=project, name=name)
+        return project
+
+    def visible(self, user):
+        names = dict((issue.pk, name) for name, issue in self.issues.items())
+        return sorted(names[pk] for pk in
+                      Issue.objects.visible_to(user).values_list("pk", flat=True))
+
+    def test_admin(self):
+        self.assertEqual(self.visible(self.admin), sorted(self.issues))
+        self.assertEqual(self.visible(self.admin.pk), sorted(self.issues))
+
+    def test_default_visibility(self):
+        self.assertEqual(self.visible(self.alice), ["alice's", "open", "public"])
+
+    def test_all_visibility(self):
+        make_member(self.carol, self.private, self.manager)
+        self.assertEqual(self.visible(self.carol),
+                         ["alice's", "bob's", "carol's", "open", "private", "public"])
+
+    def test_own_visibility(self):
+        self.assertEqual(self.visible(self.bob), ["bob's", "public"])
+
+    def test_group_membership(self):
+        group = make_group()
+        GroupUser.objects.create(group=group, user=self.carol)
+        make_member(group, self.private, self.manager)
+        self.assertEqual(self.visible(self.carol),
+                         ["alice's", "bob's", "carol's", "open", "private", "public"])
+
+    def test_assigned_to_a_group(self):
+        group = make_group()
+        GroupUser.objects.create(group=group, user=self.bob)
+        Issue.objects.filter(pk=self.issues["private"].pk).update(assigned_to=group)
+        self.assertEqual(self.visible(self.bob), ["bob's", "private", "public"])
+
+    def test_non_member(self):
+        self.assertEqual(self.visible(self.carol), ["carol's", "public"])
+
+    def test_non_member_role_overridden_by_group(self):
+        non_member = make_user("", lastname="Non member users", type="GroupNonMember")
+        make_member(non_member, self.public, self.reporter)
+        self.assertEqual(self.visible(self.carol), ["carol's"])
+        self.assertEqual(self.visible(self.alice), ["alice's", "open"])
+
+    def test_anonymous(self):
+        self.assertEqual(self.visible(None), ["public"])
+
+    def test_role_without_view_issues(self):
+        self.developer.permissions = "---\n- :add_issues\n"
+        self.developer.save()
+        self.assertEqual(self.visible(self.alice), ["public"])
+
+    def test_matches_python_checks(self):
+        group = make_group()
+        GroupUser.objects.create(group=group, user=self.carol)
+        make_member(group, self.public, self.reporter)
+        index = PermissionIndex()
+        visibility = dict(Role.objects.values_list("pk", "issues_visibility"))
+        issues = list(Issue.objects.all())
+        for user in [None] + list(User.objects.filter(type="User")):
+            self.assertEqual(
+                set(Issue.objects.visible_to(user).values_list("pk", flat=True)),
+                set(issue.pk for issue in issues
+                    if issue_visible(issue, user, index, visibility)))
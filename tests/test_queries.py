@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import SimpleTestCase
+
+from redmine_models.queries import date_range
+
+
+class DateRangeTest(SimpleTestCase):
+
+    def test_relative_operators(self):
+        today = datetime.date.today()
+        days = datetime.timedelta(days=3)
+        expected = {
+            ">t-": (today - days, None),
+            "<t-": (None, today - days),
+            "><t-": (today - days, today),
+            "t-": (today - days, today - days),
+            ">t+": (today + days, None),
+            # "in less than": overdue dates included
+            "<t+": (None, today + days),
+            "><t+": (today, today + days),
+            "t+": (today + days, today + days),
+        }
+        for operator, dates in expected.items():
+            self.assertEqual(date_range(operator, ["3"]), dates, operator)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db.models import Count, Sum
+from django.test import TestCase
+
+from redmine_models.models import TimeEntry, TimeEntryRollup
+from redmine_models.reports import refresh_rollup
+
+from .factories import NOW, make_project, make_time_entry, make_user
+
+DIMENSIONS = ("project_id", "user_id", "activity_id", "tyear", "tweek")
+
+
+class RefreshRollupTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.project = make_project("one")
+        self.other = make_project("two", lft=3, rgt=4)
+        self.user = make_user()
+        self.monday = NOW.date()
+        self.next_week = self.monday + datetime.timedelta(days=7)
+        self.entries = [
+            make_time_entry(self.project, self.user, 1.0),
+            make_time_entry(self.project, self.user, 2.0),
+            make_time_entry(self.project, self.user, 4.0, self.next_week),
+            make_time_entry(self.other, self.user, 8.0,
+                            updated_on=NOW - datetime.timedelta(days=1)),
+        ]
+        refresh_rollup(full=True)
+        self.later = NOW + datetime.timedelta(hours=1)
+
+    def rollup(self):
+        return dict((row[:5], row[5:]) for row in TimeEntryRollup.objects.values_list(
+            *DIMENSIONS + ("hours", "entries")))
+
+    def expected(self):
+        return dict((row[:5], row[5:]) for row in TimeEntry.objects.values_list(*DIMENSIONS)
+                    .annotate(Sum("hours"), Count("pk")).order_by())
+
+    def rollup_ids(self, project):
+        return set(TimeEntryRollup.objects.filter(project=project)
+                   .values_list("pk", flat=True))
+
+    def test_full(self):
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertEqual(len(self.rollup()), 3)
+
+    def test_insert(self):
+        untouched = self.rollup_ids(self.other)
+        make_time_entry(self.project, self.user, 0.5, updated_on=self.later)
+        make_time_entry(self.project, self.user, 0.25, self.monday - datetime.timedelta(days=7),
+                        updated_on=self.later)
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+        # only the touched buckets were rebuilt
+        self.assertEqual(self.rollup_ids(self.other), untouched)
+
+    def test_update(self):
+        untouched = self.rollup_ids(self.other)
+        entry = self.entries[0]
+        entry.hours = 3.0
+        entry.updated_on = self.later
+        entry.save()
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertEqual(self.rollup_ids(self.other), untouched)
+
+    def test_move(self):
+        entry = self.entries[3]
+        entry.project = self.project
+        entry.spent_on = self.next_week
+        entry.tweek = self.next_week.isocalendar()[1]
+        entry.updated_on = self.later
+        entry.save()
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertFalse(TimeEntryRollup.objects.filter(project=self.other).exists())
+
+    def test_delete(self):
+        untouched = self.rollup_ids(self.other)
+        self.entries[0].delete()
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertEqual(self.rollup_ids(self.other), untouched)
+
+    def test_delete_the_last_entry_of_a_bucket(self):
+        self.entries[2].delete()
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertFalse(TimeEntryRollup.objects.filter(tweek=self.entries[2].tweek).exists())
+
+    def test_queryset_delete(self):
+        TimeEntry.objects.filter(project=self.other).delete()
+        refresh_rollup()
+        self.assertEqual(self.rollup(), self.expected())
+
+    def test_changes_made_by_redmine_need_a_full_refresh(self):
+        TimeEntry.objects.filter(pk=self.entries[3].pk)._raw_delete("redmine")
+        refresh_rollup()
+        self.assertNotEqual(self.rollup(), self.expected())
+        refresh_rollup(full=True)
+        self.assertEqual(self.rollup(), self.expected())
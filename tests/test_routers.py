@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.db import router
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from redmine_models.models import Tracker
+from redmine_models.routers import (ReplicaPool, is_pinned, pin_primary, unpin,
+                                    use_primary)
+
+
+class ReplicaRoutingTest(TransactionTestCase):
+    # not TestCase: the replicas mirror the primary, so they must not wait
+    # on its test transaction
+    databases = {"redmine", "replica1", "replica2"}
+
+    def setUp(self):
+        self.router = router.routers[0]
+        self.saved = self.router.replicas, self.router.pin_seconds
+        self.router.replicas = ReplicaPool({"replica1": 2, "replica2": 1})
+        unpin()
+
+    def tearDown(self):
+        self.router.replicas, self.router.pin_seconds = self.saved
+        unpin()
+
+    def test_reads_are_spread_by_weight(self):
+        used = Counter(Tracker.objects.all().db for i in range(30))
+        self.assertEqual(used, {"replica1": 20, "replica2": 10})
+
+    def test_reads_run_on_the_replicas(self):
+        with CaptureQueriesContext(connections["replica1"]) as replica1, \
+                CaptureQueriesContext(connections["replica2"]) as replica2, \
+                CaptureQueriesContext(connections["redmine"]) as primary:
+            for i in range(3):
+                list(Tracker.objects.all())
+        self.assertEqual((len(replica1), len(replica2), len(primary)), (2, 1, 0))
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        Tracker.objects.create(name="Bug", is_in_chlog=True, is_in_roadmap=True)
+        self.assertTrue(is_pinned())
+        self.assertEqual(Tracker.objects.all().db, "redmine")
+        unpin()
+        self.assertEqual(Tracker.objects.all().db, "replica1")
+        self.assertEqual(Tracker.objects.get(name="Bug").name, "Bug")
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual(Tracker.objects.all().db, "redmine")
+        self.assertEqual(Tracker.objects.all().db, "replica1")
+
+    def test_lagging_replica_is_ejected(self):
+        lags = {"replica1": 120, "replica2": 0}
+        self.router.replicas = ReplicaPool(["replica1", "replica2"], lag_check=lags.get)
+        used = set(Tracker.objects.all().db for i in range(4))
+        self.assertEqual(used, set(["replica2"]))
+
+    def test_pin_after_a_write_expires(self):
+        self.router.pin_seconds = 0
+        Tracker.objects.create(name="Bug", is_in_chlog=True, is_in_roadmap=True)
+        self.assertFalse(is_pinned())
+        self.assertEqual(Tracker.objects.all().db, "replica1")
+
+    def test_explicit_pin_lasts_until_unpin(self):
+        pin_primary()
+        self.router.pin_seconds = 0
+        Tracker.objects.create(name="Bug", is_in_chlog=True, is_in_roadmap=True)
+        self.assertEqual(Tracker.objects.all().db, "redmine")
+        unpin()
+        self.assertEqual(Tracker.objects.all().db, "replica1")
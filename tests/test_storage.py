@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import RequestFactory, SimpleTestCase
+
+from redmine_models.models import Attachment
+from redmine_models.storage import FileSystemAttachmentStorage
+
+DATA = bytes(bytearray(range(256))) * 4
+
+
+class FileSystemAttachmentStorageTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, "2024", "01"))
+        with open(os.path.join(self.root, "2024", "01", "abc_file.bin"), "wb") as fp:
+            fp.write(DATA)
+        self.storage = FileSystemAttachmentStorage(self.root)
+        # the database row is out of date
+        self.attachment = Attachment(pk=1, filename="file.bin", disk_filename="abc_file.bin",
+                                     disk_directory="2024/01", filesize=10,
+                                     content_type="application/octet-stream")
+
+    def get(self, **headers):
+        request = RequestFactory().get("/attachments/1", **headers)
+        return self.storage.response(self.attachment, request)
+
+    def test_size_comes_from_the_file(self):
+        self.assertEqual(self.storage.size(self.attachment), len(DATA))
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE="bytes=100-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 100-1023/1024")
+        self.assertEqual(response["Content-Length"], "924")
+        self.assertEqual(b"".join(response.streaming_content), DATA[100:])
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE="bytes=-24")
+        self.assertEqual(response["Content-Range"], "bytes 1000-1023/1024")
+        self.assertEqual(b"".join(response.streaming_content), DATA[-24:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE="bytes=2000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], "1024")
+        self.assertEqual(b"".join(response.streaming_content), DATA)
+        response.close()
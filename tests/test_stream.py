@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+
+from redmine_models.models import Issue
+
+from .factories import NOW, make_issue
+
+
+class StreamTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        # updated_on has ties, closed_on NULLs
+        self.issues = [
+            make_issue(subject="Issue %d" % i,
+                       updated_on=NOW + datetime.timedelta(minutes=i % 3),
+                       closed_on=NOW + datetime.timedelta(days=i) if i % 4 else None)
+            for i in range(10)]
+
+    def pks(self, rows):
+        return [getattr(row, "pk", None) or row["id"] for row in rows]
+
+    def test_pk_order(self):
+        expected = [issue.pk for issue in self.issues]
+        # 10 rows in pages of 3: 4 pages
+        with self.assertNumQueries(4, using="redmine"):
+            self.assertEqual(self.pks(Issue.objects.stream(batch_size=3)), expected)
+        # pages of 2: the sixth query finds the end
+        with self.assertNumQueries(6, using="redmine"):
+            self.assertEqual(self.pks(Issue.objects.stream(batch_size=2)), expected)
+        self.assertEqual(self.pks(Issue.objects.stream(order_by="pk")), expected)
+        self.assertEqual(self.pks(Issue.objects.stream(order_by="-id", batch_size=3)),
+                         expected[::-1])
+
+    def test_order_by_with_ties(self):
+        expected = [issue.pk for issue in
+                    sorted(self.issues, key=lambda issue: (issue.updated_on, issue.pk))]
+        # 4 pages, then the rows where the nullable updated_on is NULL
+        with self.assertNumQueries(5, using="redmine"):
+            self.assertEqual(self.pks(Issue.objects.stream(batch_size=3,
+                                                           order_by="updated_on")),
+                             expected)
+        self.assertEqual(self.pks(Issue.objects.stream(batch_size=2,
+                                                       order_by="-updated_on")),
+                         expected[::-1])
+
+    def test_order_by_nullable_column(self):
+        dated = [issue.pk for issue in self.issues if issue.closed_on]
+        undated = [issue.pk for issue in self.issues if not issue.closed_on]
+        self.assertEqual(self.pks(Issue.objects.stream(batch_size=3, order_by="closed_on")),
+                         dated + undated)
+        self.assertEqual(self.pks(Issue.objects.stream(batch_size=3,
+                                                       order_by="-closed_on")),
+                         dated[::-1] + undated[::-1])
+
+    def test_filtered(self):
+        issues = Issue.objects.filter(subject__in=["Issue 1", "Issue 5", "Issue 7"])
+        self.assertEqual(self.pks(issues.stream(batch_size=2)),
+                         [self.issues[i].pk for i in (1, 5, 7)])
+
+    def test_values(self):
+        rows = list(Issue.objects.values("subject").stream(batch_size=3,
+                                                          order_by="updated_on"))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(set(row["subject"] for row in rows),
+                         set(issue.subject for issue in self.issues))
+        # ordering columns added for the keyset are left out
+        self.assertEqual(set(rows[0]), {"subject"})
+        rows = list(Issue.objects.values("id", "updated_on").stream(batch_size=3))
+        self.assertEqual([row["id"] for row in rows], [issue.pk for issue in self.issues])
+
+    def test_only(self):
+        with self.assertNumQueries(5, using="redmine"):
+            issues = list(Issue.objects.only("subject").stream(batch_size=3,
+                                                                order_by="updated_on"))
+            self.assertEqual(len(set(issue.pk for issue in issues)), 10)
+            for issue in issues:
+                issue.subject, issue.updated_on
+        self.assertIn("done_ratio", issues[0].get_deferred_fields())
+        with self.assertNumQueries(5, using="redmine"):
+            for issue in Issue.objects.defer("updated_on").stream(batch_size=3,
+                                                                   order_by="updated_on"):
+                issue.updated_on
+
+    def test_unsupported(self):
+        with self.assertRaises(TypeError):
+            Issue.objects.all()[:5].stream()
+        with self.assertRaises(TypeError):
+            Issue.objects.values_list("pk").stream()
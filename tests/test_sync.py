@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+
+from redmine_models.models import Issue
+from redmine_models.sync import ChangeFeed
+
+from .factories import NOW, make_issue
+
+
+class MemoryCursorStore(dict):
+
+    def set(self, key, value):
+        if value is None:
+            self.pop(key, None)
+        else:
+            self[key] = value
+
+
+class ChangeFeedTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.store = MemoryCursorStore()
+        self.feed = ChangeFeed(self.store, batch_size=2)
+
+    def changed(self):
+        return [issue.pk for batch in self.feed.changes("Issue") for issue in batch]
+
+    def test_yields_changes_once(self):
+        issues = [make_issue(updated_on=NOW + datetime.timedelta(seconds=i))
+                  for i in range(3)]
+        self.assertEqual(self.changed(), [issue.pk for issue in issues])
+        self.assertEqual(self.changed(), [])
+        Issue.objects.filter(pk=issues[0].pk).update(
+            updated_on=NOW + datetime.timedelta(minutes=1))
+        self.assertEqual(self.changed(), [issues[0].pk])
+
+    def test_lower_id_changed_within_the_cursor_second(self):
+        recent = datetime.datetime.now().replace(microsecond=0)
+        first = make_issue(updated_on=NOW)
+        second = make_issue(updated_on=recent)
+        self.assertEqual(self.changed(), [first.pk])
+        # updated_on has a one second precision: the second is not settled yet
+        Issue.objects.filter(pk=first.pk).update(updated_on=recent)
+        self.assertEqual(self.changed(), [])
+        self.feed.settle = -60
+        self.assertEqual(self.changed(), [first.pk, second.pk])
+        self.assertEqual(self.changed(), [])
+
+    def test_many_rows_within_one_second(self):
+        issues = [make_issue(updated_on=NOW) for i in range(5)]
+        with self.assertNumQueries(3, using="redmine"):
+            self.assertEqual(self.changed(), [issue.pk for issue in issues])
+        self.assertEqual(self.changed(), [])
+        self.assertEqual(self.feed.cursor("Issue"), (NOW, issues[-1].pk))
+        self.assertEqual(self.store["Issue"], {"timestamp": NOW.isoformat(),
+                                               "id": issues[-1].pk})
+
+    def test_values(self):
+        issues = [make_issue(updated_on=NOW) for i in range(3)]
+        rows = [row for batch in self.feed.changes("Issue", fields=["subject"])
+                for row in batch]
+        self.assertEqual([row["id"] for row in rows], [issue.pk for issue in issues])
+        self.assertEqual(set(rows[0]), {"id", "subject", "updated_on"})
+
+    def test_deletions(self):
+        issues = [make_issue() for i in range(3)]
+        self.assertEqual(self.feed.deletions("Issue"), [])
+        Issue.objects.filter(pk=issues[1].pk).delete()
+        self.assertEqual(self.feed.deletions("Issue", force=True), [issues[1].pk])
+        with self.assertNumQueries(2, using="redmine"):
+            self.assertEqual(self.feed.deletions("Issue", force=True), [])
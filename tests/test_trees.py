@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models.managers import build_tree
+from redmine_models.models import Issue, Project
+
+from .factories import make_issue, make_project
+
+
+class ProjectTreeTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        # root ( a ( a1 a2 ) b ) other
+        self.root = make_project("root", lft=1, rgt=10)
+        self.a = make_project("a", lft=2, rgt=7, parent=self.root)
+        self.a1 = make_project("a1", lft=3, rgt=4, parent=self.a)
+        self.a2 = make_project("a2", lft=5, rgt=6, parent=self.a)
+        self.b = make_project("b", lft=8, rgt=9, parent=self.root)
+        self.other = make_project("other", lft=11, rgt=12)
+
+    def test_descendants(self):
+        self.assertEqual(list(Project.objects.descendants(self.root)),
+                         [self.a, self.a1, self.a2, self.b])
+        self.assertEqual(list(Project.objects.descendants(self.a, include_self=True)),
+                         [self.a, self.a1, self.a2])
+        self.assertEqual(list(Project.objects.descendants(self.a1)), [])
+        self.assertEqual(list(Project.objects.descendants(self.a1, include_self=True)),
+                         [self.a1])
+
+    def test_ancestors(self):
+        self.assertEqual(list(Project.objects.ancestors(self.a2)), [self.root, self.a])
+        self.assertEqual(list(Project.objects.ancestors(self.a2, include_self=True)),
+                         [self.root, self.a, self.a2])
+        self.assertEqual(list(Project.objects.ancestors(self.root)), [])
+
+    def test_with_depth(self):
+        self.assertEqual(
+            dict(Project.objects.with_depth().values_list("identifier", "depth")),
+            {"root": 0, "a": 1, "a1": 2, "a2": 2, "b": 1, "other": 0})
+        self.assertEqual(
+            list(Project.objects.with_depth().filter(depth__lte=1).order_by("lft")),
+            [self.root, self.a, self.b, self.other])
+
+    def test_subtree_of(self):
+        with self.assertNumQueries(1, using="redmine"):
+            root = Project.objects.subtree_of(self.a)
+        self.assertEqual(root, self.a)
+        self.assertEqual(root.depth, 0)
+        self.assertEqual(root.tree_children, [self.a1, self.a2])
+        self.assertEqual([child.depth for child in root.tree_children], [1, 1])
+        self.assertEqual(Project.objects.subtree_of(self.a, include_self=False),
+                         [self.a1, self.a2])
+        self.assertEqual(Project.objects.subtree_of(self.b, include_self=False), [])
+
+    def test_build_tree(self):
+        projects = list(Project.objects.order_by("-lft"))
+        with self.assertNumQueries(0, using="redmine"):
+            roots = build_tree(projects)
+        self.assertEqual(roots, [self.root, self.other])
+        self.assertEqual(roots[0].tree_children, [self.a, self.b])
+        self.assertEqual(roots[0].tree_children[0].tree_children, [self.a1, self.a2])
+        self.assertEqual(roots[1].tree_children, [])
+
+
+class IssueTreeTest(TestCase):
+    """Issue trees number ``lft``/``rgt`` from 1 within each ``root_id``."""
+
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.parent = self.issue(1, 6)
+        self.first = self.issue(2, 3, self.parent)
+        self.second = self.issue(4, 5, self.parent)
+        self.other = self.issue(1, 4)
+        self.other_child = self.issue(2, 3, self.other)
+
+    def issue(self, lft, rgt, parent=None):
+        issue = make_issue(lft=lft, rgt=rgt, parent=parent)
+        issue.root_id = parent.root_id if parent else issue.pk
+        Issue.objects.filter(pk=issue.pk).update(root_id=issue.root_id)
+        return issue
+
+    def test_descendants_stay_in_their_tree(self):
+        self.assertEqual(list(Issue.objects.descendants(self.parent)),
+                         [self.first, self.second])
+        self.assertEqual(list(Issue.objects.descendants(self.other, include_self=True)),
+                         [self.other, self.other_child])
+
+    def test_ancestors_stay_in_their_tree(self):
+        self.assertEqual(list(Issue.objects.ancestors(self.other_child)), [self.other])
+        self.assertEqual(list(Issue.objects.ancestors(self.first, include_self=True)),
+                         [self.parent, self.first])
+
+    def test_with_depth(self):
+        self.assertEqual(
+            dict(Issue.objects.with_depth().values_list("pk", "depth")),
+            {self.parent.pk: 0, self.first.pk: 1, self.second.pk: 1,
+             self.other.pk: 0, self.other_child.pk: 1})
+
+    def test_subtree_of(self):
+        with self.assertNumQueries(1, using="redmine"):
+            root = Issue.objects.subtree_of(self.parent)
+        self.assertEqual(root.tree_children, [self.first, self.second])
+        with self.assertNumQueries(1, using="redmine"):
+            children = Issue.objects.subtree_of(self.other_child, include_self=False)
+        self.assertEqual(children, [])
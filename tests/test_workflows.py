@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from redmine_models import permissions
+from redmine_models.models import GroupUser, Issue, IssueStatus, Tracker, Workflow
+from redmine_models.permissions import PermissionIndex
+from redmine_models.workflows import (PERMISSION, READONLY, REQUIRED, TRANSITION,
+                                      allowed_statuses, field_rules)
+
+from .factories import (make_group, make_issue, make_member, make_project, make_role,
+                        make_user)
+
+
+class WorkflowTest(TestCase):
+    databases = {"redmine"}
+
+    def setUp(self):
+        self.new, self.assigned, self.resolved, self.closed = [
+            IssueStatus.objects.create(name=name, is_closed=name == "Closed", position=i)
+            for i, name in enumerate(["New", "Assigned", "Resolved", "Closed"])]
+        self.tracker = Tracker.objects.create(name="Bug", is_in_chlog=True,
+                                              is_in_roadmap=True, default_status=self.new)
+        self.developer = make_role("Developer", ["view_issues", "edit_issues"])
+        self.reporter = make_role("Reporter", ["view_issues"])
+        self.project = make_project()
+        self.user = make_user("dlopper")
+        self.other = make_user("jsmith")
+        make_member(self.user, self.project, self.developer)
+        make_member(self.other, self.project, self.reporter)
+        for old, new, author, assignee in [
+                (self.new, self.assigned, False, False),
+                (self.new, self.resolved, True, False),
+                (self.new, self.closed, False, True),
+                (self.assigned, self.resolved, True, True)]:
+            self.transition(old, new, author=author, assignee=assignee)
+        self.rule(self.new, "due_date", READONLY)
+        self.index = PermissionIndex()
+
+    def transition(self, old, new, role=None, author=False, assignee=False):
+        Workflow.objects.create(tracker=self.tracker, role=role or self.developer,
+                                old_status=old, new_status=new, author=author,
+                                assignee=assignee, type=TRANSITION)
+
+    def rule(self, old, field_name, rule, role=None):
+        Workflow.objects.create(tracker=self.tracker, role=role or self.developer,
+                                old_status=old, new_status=old, author=False,
+                                assignee=False, type=PERMISSION, field_name=field_name,
+                                rule=rule)
+
+    def issue(self, status, **kwargs):
+        return make_issue(self.project, tracker=self.tracker, status=status,
+                          author=kwargs.pop("author", self.other), **kwargs)
+
+    def allowed(self, issue, user=None):
+        return allowed_statuses(issue, user or self.user, self.index)
+
+    def test_author_and_assignee_transitions(self):
+        new, assigned, resolved, closed = self.new, self.assigned, self.resolved, self.closed
+        self.assertEqual(self.allowed(self.issue(new)), [new, assigned])
+        self.assertEqual(self.allowed(self.issue(new, author=self.user)),
+                         [new, assigned, resolved])
+        self.assertEqual(self.allowed(self.issue(new, assigned_to=self.user)),
+                         [new, assigned, closed])
+        self.assertEqual(self.allowed(self.issue(new, author=self.user,
+                                                 assigned_to=self.user)),
+                         [new, assigned, resolved, closed])
+        # rows flagged both author and assignee apply to either
+        self.assertEqual(self.allowed(self.issue(assigned)), [])
+        self.assertEqual(self.allowed(self.issue(assigned, author=self.user)),
+                         [assigned, resolved])
+        self.assertEqual(self.allowed(self.issue(assigned, assigned_to=self.user)),
+                         [assigned, resolved])
+
+    def test_assigned_to_a_group(self):
+        group = make_group()
+        GroupUser.objects.create(group=group, user=self.user)
+        index = PermissionIndex()
+        issue = self.issue(self.new, assigned_to=group)
+        self.assertEqual(allowed_statuses(issue, self.user, index),
+                         [self.new, self.assigned, self.closed])
+
+    def test_roles_without_workflow(self):
+        issue = self.issue(self.new, author=self.other)
+        self.transition(self.new, self.closed, role=self.reporter)
+        # the reporter can neither add nor edit issues
+        self.assertEqual(self.allowed(issue, self.other), [])
+
+    def test_new_issue_falls_back_to_the_default_status(self):
+        issue = Issue(project=self.project, tracker=self.tracker, author=self.user)
+        self.assertEqual(self.allowed(issue), [self.new])
+        self.assertEqual(self.allowed(issue, self.other), [self.new])
+
+    def test_field_rules(self):
+        issue = self.issue(self.new)
+        self.assertEqual(field_rules(issue, self.user, self.index), {"due_date": READONLY})
+        self.assertEqual(field_rules(self.issue(self.assigned), self.user, self.index), {})
+
+    def test_field_rules_of_several_roles(self):
+        manager = make_role("Manager", ["edit_issues"])
+        self.rule(self.new, "due_date", REQUIRED, role=manager)
+        self.rule(self.new, "subject", READONLY, role=manager)
+        self.project.member_set.get(user=self.user).memberrole_set.create(role=manager)
+        index = PermissionIndex()
+        # a field gets a rule only when every role has one, the strictest
+        self.assertEqual(field_rules(self.issue(self.new), self.user, index),
+                         {"due_date": REQUIRED})
+
+    def test_shared_permission_index(self):
+        permissions._shared.clear()
+        self.addCleanup(permissions._shared.clear)
+        issue = self.issue(self.new, author=self.user)
+        self.assertEqual(allowed_statuses(issue, self.user),
+                         [self.new, self.assigned, self.resolved])
+        self.assertEqual(field_rules(issue, self.user), {"due_date": READONLY})
+        with self.assertNumQueries(0, using="redmine"):
+            allowed_statuses(issue, self.user)